@@ -5,12 +5,183 @@ d = { 'settings': { 'branch': 'main',
                 'doc_host': 'https://cah-jake-bergren.github.io',
                 'git_url': 'https://github.com/cah-jake-bergren/classifier',
                 'lib_path': 'classifier'},
-  'syms': { 'classifier.chroma': { 'classifier.chroma.get_or_make_chroma': ('chroma.html#get_or_make_chroma', 'classifier/chroma.py'),
+  'syms': { 'classifier.benchmark': { 'classifier.benchmark.HashingEmbeddings': ( 'benchmark.html#hashingembeddings',
+                                                                                  'classifier/benchmark.py'),
+                                      'classifier.benchmark.HashingEmbeddings.__init__': ( 'benchmark.html#hashingembeddings.__init__',
+                                                                                           'classifier/benchmark.py'),
+                                      'classifier.benchmark.HashingEmbeddings.embed_documents': ( 'benchmark.html#hashingembeddings.embed_documents',
+                                                                                                  'classifier/benchmark.py'),
+                                      'classifier.benchmark.HashingEmbeddings.embed_query': ( 'benchmark.html#hashingembeddings.embed_query',
+                                                                                              'classifier/benchmark.py'),
+                                      'classifier.benchmark._git_commit': ('benchmark.html#_git_commit', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.compare_benchmarks': ( 'benchmark.html#compare_benchmarks',
+                                                                                   'classifier/benchmark.py'),
+                                      'classifier.benchmark.get_benchmarks': ('benchmark.html#get_benchmarks', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.main': ('benchmark.html#main', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.make_email_frame': ( 'benchmark.html#make_email_frame',
+                                                                                 'classifier/benchmark.py'),
+                                      'classifier.benchmark.make_summaries': ('benchmark.html#make_summaries', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.read_benchmarks': ('benchmark.html#read_benchmarks', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.run_benchmarks': ('benchmark.html#run_benchmarks', 'classifier/benchmark.py'),
+                                      'classifier.benchmark.time_call': ('benchmark.html#time_call', 'classifier/benchmark.py')},
+            'classifier.cache': { 'classifier.cache.CachedEmbeddings': ('cache.html#cachedembeddings', 'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings.__init__': ( 'cache.html#cachedembeddings.__init__',
+                                                                                  'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings._key': ('cache.html#cachedembeddings._key', 'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings.embed_documents': ( 'cache.html#cachedembeddings.embed_documents',
+                                                                                         'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings.embed_query': ( 'cache.html#cachedembeddings.embed_query',
+                                                                                     'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings.hits': ('cache.html#cachedembeddings.hits', 'classifier/cache.py'),
+                                  'classifier.cache.CachedEmbeddings.misses': ('cache.html#cachedembeddings.misses', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache': ('cache.html#diskcache', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.__init__': ('cache.html#diskcache.__init__', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.__len__': ('cache.html#diskcache.__len__', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache._evict': ('cache.html#diskcache._evict', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache._size_bytes': ('cache.html#diskcache._size_bytes', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.clear': ('cache.html#diskcache.clear', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.close': ('cache.html#diskcache.close', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.get': ('cache.html#diskcache.get', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.get_many': ('cache.html#diskcache.get_many', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.set': ('cache.html#diskcache.set', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.set_many': ('cache.html#diskcache.set_many', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.size_bytes': ('cache.html#diskcache.size_bytes', 'classifier/cache.py'),
+                                  'classifier.cache.DiskCache.stats': ('cache.html#diskcache.stats', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache': ('cache.html#responsecache', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.__init__': ('cache.html#responsecache.__init__', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache._key': ('cache.html#responsecache._key', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.cache': ('cache.html#responsecache.cache', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.clear': ('cache.html#responsecache.clear', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.lookup': ('cache.html#responsecache.lookup', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.lookup_many': ( 'cache.html#responsecache.lookup_many',
+                                                                                  'classifier/cache.py'),
+                                  'classifier.cache.ResponseCache.update': ('cache.html#responsecache.update', 'classifier/cache.py'),
+                                  'classifier.cache.ResponseCacheMiss': ('cache.html#responsecachemiss', 'classifier/cache.py'),
+                                  'classifier.cache._dump_generations': ('cache.html#_dump_generations', 'classifier/cache.py'),
+                                  'classifier.cache._load_generations': ('cache.html#_load_generations', 'classifier/cache.py'),
+                                  'classifier.cache._split_at_llm': ('cache.html#_split_at_llm', 'classifier/cache.py'),
+                                  'classifier.cache.batch_through_cache': ('cache.html#batch_through_cache', 'classifier/cache.py'),
+                                  'classifier.cache.configure_response_cache': ( 'cache.html#configure_response_cache',
+                                                                                 'classifier/cache.py'),
+                                  'classifier.cache.get_cached_embedder': ('cache.html#get_cached_embedder', 'classifier/cache.py'),
+                                  'classifier.cache.get_llm_string': ('cache.html#get_llm_string', 'classifier/cache.py'),
+                                  'classifier.cache.get_response_cache': ('cache.html#get_response_cache', 'classifier/cache.py'),
+                                  'classifier.cache.hash_text': ('cache.html#hash_text', 'classifier/cache.py'),
+                                  'classifier.cache.make_cached_embedder': ('cache.html#make_cached_embedder', 'classifier/cache.py')},
+            'classifier.chroma': { 'classifier.chroma.NumpyVectorStore': ('chroma.html#numpyvectorstore', 'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.__init__': ( 'chroma.html#numpyvectorstore.__init__',
+                                                                                    'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.__len__': ( 'chroma.html#numpyvectorstore.__len__',
+                                                                                   'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore._score_chunks': ( 'chroma.html#numpyvectorstore._score_chunks',
+                                                                                         'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore._top_k_documents': ( 'chroma.html#numpyvectorstore._top_k_documents',
+                                                                                            'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.filter_positions': ( 'chroma.html#numpyvectorstore.filter_positions',
+                                                                                            'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.from_chroma': ( 'chroma.html#numpyvectorstore.from_chroma',
+                                                                                       'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.from_documents': ( 'chroma.html#numpyvectorstore.from_documents',
+                                                                                          'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.from_embeddings': ( 'chroma.html#numpyvectorstore.from_embeddings',
+                                                                                           'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.get_document': ( 'chroma.html#numpyvectorstore.get_document',
+                                                                                        'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.load': ('chroma.html#numpyvectorstore.load', 'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.partition': ( 'chroma.html#numpyvectorstore.partition',
+                                                                                     'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.save': ('chroma.html#numpyvectorstore.save', 'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search': ( 'chroma.html#numpyvectorstore.similarity_search',
+                                                                                             'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vector': ( 'chroma.html#numpyvectorstore.similarity_search_by_vector',
+                                                                                                       'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vector_per_value': ( 'chroma.html#numpyvectorstore.similarity_search_by_vector_per_value',
+                                                                                                                 'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vector_with_score': ( 'chroma.html#numpyvectorstore.similarity_search_by_vector_with_score',
+                                                                                                                  'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vectors': ( 'chroma.html#numpyvectorstore.similarity_search_by_vectors',
+                                                                                                        'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vectors_per_value': ( 'chroma.html#numpyvectorstore.similarity_search_by_vectors_per_value',
+                                                                                                                  'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_by_vectors_with_score': ( 'chroma.html#numpyvectorstore.similarity_search_by_vectors_with_score',
+                                                                                                                   'classifier/chroma.py'),
+                                   'classifier.chroma.NumpyVectorStore.similarity_search_with_score': ( 'chroma.html#numpyvectorstore.similarity_search_with_score',
+                                                                                                        'classifier/chroma.py'),
+                                   'classifier.chroma._query_chroma': ('chroma.html#_query_chroma', 'classifier/chroma.py'),
+                                   'classifier.chroma._read_ingested': ('chroma.html#_read_ingested', 'classifier/chroma.py'),
+                                   'classifier.chroma._write_ingested': ('chroma.html#_write_ingested', 'classifier/chroma.py'),
+                                   'classifier.chroma.document_hash': ('chroma.html#document_hash', 'classifier/chroma.py'),
+                                   'classifier.chroma.embed_queries': ('chroma.html#embed_queries', 'classifier/chroma.py'),
+                                   'classifier.chroma.get_collection_size': ('chroma.html#get_collection_size', 'classifier/chroma.py'),
+                                   'classifier.chroma.get_or_make_chroma': ('chroma.html#get_or_make_chroma', 'classifier/chroma.py'),
+                                   'classifier.chroma.get_or_make_vector_store': ( 'chroma.html#get_or_make_vector_store',
+                                                                                   'classifier/chroma.py'),
+                                   'classifier.chroma.ingest_documents': ('chroma.html#ingest_documents', 'classifier/chroma.py'),
+                                   'classifier.chroma.list_blob_names': ('chroma.html#list_blob_names', 'classifier/chroma.py'),
+                                   'classifier.chroma.normalize_embeddings': ('chroma.html#normalize_embeddings', 'classifier/chroma.py'),
+                                   'classifier.chroma.read_json_line_batches': ( 'chroma.html#read_json_line_batches',
+                                                                                 'classifier/chroma.py'),
+                                   'classifier.chroma.read_json_line_batches_from_gcs': ( 'chroma.html#read_json_line_batches_from_gcs',
+                                                                                          'classifier/chroma.py'),
                                    'classifier.chroma.read_json_lines_from_gcs': ( 'chroma.html#read_json_lines_from_gcs',
-                                                                                   'classifier/chroma.py')},
-            'classifier.evaluate': { 'classifier.evaluate.display_evaluation_row': ( 'evaluate.html#display_evaluation_row',
-                                                                                     'classifier/evaluate.py')},
-            'classifier.experiments.retrieval_filtering': { 'classifier.experiments.retrieval_filtering.fix_string': ( 'experiments/10k_retrieval_filtering.html#fix_string',
+                                                                                   'classifier/chroma.py'),
+                                   'classifier.chroma.similarity_search_batch': ( 'chroma.html#similarity_search_batch',
+                                                                                  'classifier/chroma.py'),
+                                   'classifier.chroma.similarity_search_batch_with_score': ( 'chroma.html#similarity_search_batch_with_score',
+                                                                                             'classifier/chroma.py'),
+                                   'classifier.chroma.similarity_search_per_label': ( 'chroma.html#similarity_search_per_label',
+                                                                                      'classifier/chroma.py'),
+                                   'classifier.chroma.similarity_search_per_label_batch': ( 'chroma.html#similarity_search_per_label_batch',
+                                                                                            'classifier/chroma.py'),
+                                   'classifier.chroma.top_k_indices': ('chroma.html#top_k_indices', 'classifier/chroma.py'),
+                                   'classifier.chroma.update_chroma': ('chroma.html#update_chroma', 'classifier/chroma.py')},
+            'classifier.dedupe': { 'classifier.dedupe.fan_out': ('dedupe.html#fan_out', 'classifier/dedupe.py'),
+                                   'classifier.dedupe.get_email_representatives': ( 'dedupe.html#get_email_representatives',
+                                                                                    'classifier/dedupe.py'),
+                                   'classifier.dedupe.get_representative_emails': ( 'dedupe.html#get_representative_emails',
+                                                                                    'classifier/dedupe.py'),
+                                   'classifier.dedupe.minhash_signatures': ('dedupe.html#minhash_signatures', 'classifier/dedupe.py'),
+                                   'classifier.dedupe.near_duplicate_representatives': ( 'dedupe.html#near_duplicate_representatives',
+                                                                                         'classifier/dedupe.py'),
+                                   'classifier.dedupe.shingle_hashes': ('dedupe.html#shingle_hashes', 'classifier/dedupe.py')},
+            'classifier.dispatch': { 'classifier.dispatch.adispatch': ('dispatch.html#adispatch', 'classifier/dispatch.py'),
+                                     'classifier.dispatch.dispatch': ('dispatch.html#dispatch', 'classifier/dispatch.py'),
+                                     'classifier.dispatch.dispatch_batches': ('dispatch.html#dispatch_batches', 'classifier/dispatch.py')},
+            'classifier.evaluate': { 'classifier.evaluate.PredictionRuns': ('evaluate.html#predictionruns', 'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.__init__': ( 'evaluate.html#predictionruns.__init__',
+                                                                                      'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.__len__': ( 'evaluate.html#predictionruns.__len__',
+                                                                                     'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns._bootstrap': ( 'evaluate.html#predictionruns._bootstrap',
+                                                                                        'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns._present': ( 'evaluate.html#predictionruns._present',
+                                                                                      'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns._with_intervals': ( 'evaluate.html#predictionruns._with_intervals',
+                                                                                             'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.class_metrics': ( 'evaluate.html#predictionruns.class_metrics',
+                                                                                           'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.confusion_matrices': ( 'evaluate.html#predictionruns.confusion_matrices',
+                                                                                                'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.from_files': ( 'evaluate.html#predictionruns.from_files',
+                                                                                        'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.from_frames': ( 'evaluate.html#predictionruns.from_frames',
+                                                                                         'classifier/evaluate.py'),
+                                     'classifier.evaluate.PredictionRuns.summary': ( 'evaluate.html#predictionruns.summary',
+                                                                                     'classifier/evaluate.py'),
+                                     'classifier.evaluate._confusion_metrics': ( 'evaluate.html#_confusion_metrics',
+                                                                                 'classifier/evaluate.py'),
+                                     'classifier.evaluate._tidy_labels': ('evaluate.html#_tidy_labels', 'classifier/evaluate.py'),
+                                     'classifier.evaluate.compare_runs': ('evaluate.html#compare_runs', 'classifier/evaluate.py'),
+                                     'classifier.evaluate.display_evaluation_row': ( 'evaluate.html#display_evaluation_row',
+                                                                                     'classifier/evaluate.py'),
+                                     'classifier.evaluate.normalize_labels': ('evaluate.html#normalize_labels', 'classifier/evaluate.py'),
+                                     'classifier.evaluate.read_prediction_columns': ( 'evaluate.html#read_prediction_columns',
+                                                                                      'classifier/evaluate.py')},
+            'classifier.experiments.retrieval_filtering': { 'classifier.experiments.retrieval_filtering._get_step_2_prediction': ( 'experiments/10k_retrieval_filtering.html#_get_step_2_prediction',
+                                                                                                                                   'classifier/experiments/retrieval_filtering.py'),
+                                                            'classifier.experiments.retrieval_filtering._invoke_chain': ( 'experiments/10k_retrieval_filtering.html#_invoke_chain',
+                                                                                                                          'classifier/experiments/retrieval_filtering.py'),
+                                                            'classifier.experiments.retrieval_filtering.fix_string': ( 'experiments/10k_retrieval_filtering.html#fix_string',
                                                                                                                        'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.format_category_answer': ( 'experiments/10k_retrieval_filtering.html#format_category_answer',
                                                                                                                                    'classifier/experiments/retrieval_filtering.py'),
@@ -20,12 +191,12 @@ d = { 'settings': { 'branch': 'main',
                                                                                                                                          'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.get_label_filtered_documents': ( 'experiments/10k_retrieval_filtering.html#get_label_filtered_documents',
                                                                                                                                          'classifier/experiments/retrieval_filtering.py'),
-                                                            'classifier.experiments.retrieval_filtering.get_llm': ( 'experiments/10k_retrieval_filtering.html#get_llm',
-                                                                                                                    'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.get_prediction_chain': ( 'experiments/10k_retrieval_filtering.html#get_prediction_chain',
                                                                                                                                  'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.get_summary_prediction': ( 'experiments/10k_retrieval_filtering.html#get_summary_prediction',
                                                                                                                                    'classifier/experiments/retrieval_filtering.py'),
+                                                            'classifier.experiments.retrieval_filtering.get_summary_predictions': ( 'experiments/10k_retrieval_filtering.html#get_summary_predictions',
+                                                                                                                                    'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.get_top_3_chain': ( 'experiments/10k_retrieval_filtering.html#get_top_3_chain',
                                                                                                                             'classifier/experiments/retrieval_filtering.py'),
                                                             'classifier.experiments.retrieval_filtering.invoke_chain': ( 'experiments/10k_retrieval_filtering.html#invoke_chain',
@@ -38,50 +209,261 @@ d = { 'settings': { 'branch': 'main',
                                                                                                                                     'classifier/experiments/split_processing.py'),
                                                          'classifier.experiments.split_processing.format_email_for_train_summary': ( 'experiments/split_processing.html#format_email_for_train_summary',
                                                                                                                                      'classifier/experiments/split_processing.py'),
+                                                         'classifier.experiments.split_processing.get_batch_predictions': ( 'experiments/split_processing.html#get_batch_predictions',
+                                                                                                                            'classifier/experiments/split_processing.py'),
                                                          'classifier.experiments.split_processing.make_description_from_row': ( 'experiments/split_processing.html#make_description_from_row',
                                                                                                                                 'classifier/experiments/split_processing.py')},
             'classifier.load': { 'classifier.load.Email': ('load.html#email', 'classifier/load.py'),
                                  'classifier.load.Email.to_series': ('load.html#email.to_series', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch': ('load.html#emailbatch', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.__getitem__': ('load.html#emailbatch.__getitem__', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.__init__': ('load.html#emailbatch.__init__', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.__iter__': ('load.html#emailbatch.__iter__', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.__len__': ('load.html#emailbatch.__len__', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.batches': ('load.html#emailbatch.batches', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.from_emails': ('load.html#emailbatch.from_emails', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.from_frame': ('load.html#emailbatch.from_frame', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.take': ('load.html#emailbatch.take', 'classifier/load.py'),
+                                 'classifier.load.EmailBatch.to_frame': ('load.html#emailbatch.to_frame', 'classifier/load.py'),
+                                 'classifier.load._check_text_column': ('load.html#_check_text_column', 'classifier/load.py'),
+                                 'classifier.load._make_arrow_friendly': ('load.html#_make_arrow_friendly', 'classifier/load.py'),
                                  'classifier.load.email_from_row': ('load.html#email_from_row', 'classifier/load.py'),
                                  'classifier.load.email_small_enough': ('load.html#email_small_enough', 'classifier/load.py'),
                                  'classifier.load.get_batches': ('load.html#get_batches', 'classifier/load.py'),
+                                 'classifier.load.get_blob_version': ('load.html#get_blob_version', 'classifier/load.py'),
+                                 'classifier.load.get_email_batch_from_frame': ( 'load.html#get_email_batch_from_frame',
+                                                                                 'classifier/load.py'),
                                  'classifier.load.get_emails_from_frame': ('load.html#get_emails_from_frame', 'classifier/load.py'),
                                  'classifier.load.get_idx': ('load.html#get_idx', 'classifier/load.py'),
                                  'classifier.load.get_possible_labels': ('load.html#get_possible_labels', 'classifier/load.py'),
                                  'classifier.load.get_raw_emails': ('load.html#get_raw_emails', 'classifier/load.py'),
                                  'classifier.load.get_raw_emails_tejas_case_numbers': ( 'load.html#get_raw_emails_tejas_case_numbers',
                                                                                         'classifier/load.py'),
+                                 'classifier.load.get_snapshot_path': ('load.html#get_snapshot_path', 'classifier/load.py'),
                                  'classifier.load.get_tejas_case_numbers': ('load.html#get_tejas_case_numbers', 'classifier/load.py'),
                                  'classifier.load.get_train_test_idx': ('load.html#get_train_test_idx', 'classifier/load.py'),
                                  'classifier.load.process_raw_emails': ('load.html#process_raw_emails', 'classifier/load.py'),
-                                 'classifier.load.write_idx': ('load.html#write_idx', 'classifier/load.py')},
-            'classifier.machine_learning': {},
-            'classifier.predict': { 'classifier.predict.filter_examples': ('predict.html#filter_examples', 'classifier/predict.py'),
+                                 'classifier.load.read_snapshot': ('load.html#read_snapshot', 'classifier/load.py'),
+                                 'classifier.load.select_emails': ('load.html#select_emails', 'classifier/load.py'),
+                                 'classifier.load.write_idx': ('load.html#write_idx', 'classifier/load.py'),
+                                 'classifier.load.write_snapshot': ('load.html#write_snapshot', 'classifier/load.py')},
+            'classifier.machine_learning': { 'classifier.machine_learning.EmbeddingClassifier': ( 'machine_learning.html#embeddingclassifier',
+                                                                                                  'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.__init__': ( 'machine_learning.html#embeddingclassifier.__init__',
+                                                                                                           'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.fit': ( 'machine_learning.html#embeddingclassifier.fit',
+                                                                                                      'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.load': ( 'machine_learning.html#embeddingclassifier.load',
+                                                                                                       'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.predict': ( 'machine_learning.html#embeddingclassifier.predict',
+                                                                                                          'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.predict_proba': ( 'machine_learning.html#embeddingclassifier.predict_proba',
+                                                                                                                'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.EmbeddingClassifier.save': ( 'machine_learning.html#embeddingclassifier.save',
+                                                                                                       'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.classify_idx': ( 'machine_learning.html#classify_idx',
+                                                                                           'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.embed_summaries': ( 'machine_learning.html#embed_summaries',
+                                                                                              'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.get_labeled_embeddings': ( 'machine_learning.html#get_labeled_embeddings',
+                                                                                                     'classifier/machine_learning.py'),
+                                             'classifier.machine_learning.train_embedding_classifier': ( 'machine_learning.html#train_embedding_classifier',
+                                                                                                         'classifier/machine_learning.py')},
+            'classifier.predict': { 'classifier.predict.LocalBatchRunner': ('predict.html#localbatchrunner', 'classifier/predict.py'),
+                                    'classifier.predict.LocalBatchRunner.__init__': ( 'predict.html#localbatchrunner.__init__',
+                                                                                      'classifier/predict.py'),
+                                    'classifier.predict.LocalBatchRunner._run': ( 'predict.html#localbatchrunner._run',
+                                                                                  'classifier/predict.py'),
+                                    'classifier.predict.LocalBatchRunner.submit': ( 'predict.html#localbatchrunner.submit',
+                                                                                    'classifier/predict.py'),
+                                    'classifier.predict.LocalBatchRunner.wait': ( 'predict.html#localbatchrunner.wait',
+                                                                                  'classifier/predict.py'),
+                                    'classifier.predict.VertexBatchRunner': ('predict.html#vertexbatchrunner', 'classifier/predict.py'),
+                                    'classifier.predict.VertexBatchRunner.submit': ( 'predict.html#vertexbatchrunner.submit',
+                                                                                     'classifier/predict.py'),
+                                    'classifier.predict.VertexBatchRunner.wait': ( 'predict.html#vertexbatchrunner.wait',
+                                                                                   'classifier/predict.py'),
+                                    'classifier.predict._durable_size': ('predict.html#_durable_size', 'classifier/predict.py'),
+                                    'classifier.predict._find_json_lines': ('predict.html#_find_json_lines', 'classifier/predict.py'),
+                                    'classifier.predict._next_retrieval_k': ('predict.html#_next_retrieval_k', 'classifier/predict.py'),
+                                    'classifier.predict._prediction_checkpoint_path': ( 'predict.html#_prediction_checkpoint_path',
+                                                                                        'classifier/predict.py'),
+                                    'classifier.predict._read_json_lines': ('predict.html#_read_json_lines', 'classifier/predict.py'),
+                                    'classifier.predict._retrieve_examples': ('predict.html#_retrieve_examples', 'classifier/predict.py'),
+                                    'classifier.predict._stuff_prediction_prompt': ( 'predict.html#_stuff_prediction_prompt',
+                                                                                     'classifier/predict.py'),
+                                    'classifier.predict._write_prediction_checkpoint': ( 'predict.html#_write_prediction_checkpoint',
+                                                                                         'classifier/predict.py'),
+                                    'classifier.predict.cascade_predictions': ('predict.html#cascade_predictions', 'classifier/predict.py'),
+                                    'classifier.predict.cascade_report': ('predict.html#cascade_report', 'classifier/predict.py'),
+                                    'classifier.predict.collect_batch_predictions': ( 'predict.html#collect_batch_predictions',
+                                                                                      'classifier/predict.py'),
+                                    'classifier.predict.filter_examples': ('predict.html#filter_examples', 'classifier/predict.py'),
+                                    'classifier.predict.format_email': ('predict.html#format_email', 'classifier/predict.py'),
                                     'classifier.predict.format_example': ('predict.html#format_example', 'classifier/predict.py'),
+                                    'classifier.predict.get_max_retrieval_k': ('predict.html#get_max_retrieval_k', 'classifier/predict.py'),
+                                    'classifier.predict.get_prediction_token_budget': ( 'predict.html#get_prediction_token_budget',
+                                                                                        'classifier/predict.py'),
                                     'classifier.predict.get_predictions': ('predict.html#get_predictions', 'classifier/predict.py'),
+                                    'classifier.predict.get_retrieval_k': ('predict.html#get_retrieval_k', 'classifier/predict.py'),
                                     'classifier.predict.make_prediction_prompt': ( 'predict.html#make_prediction_prompt',
                                                                                    'classifier/predict.py'),
+                                    'classifier.predict.make_prediction_prompts': ( 'predict.html#make_prediction_prompts',
+                                                                                    'classifier/predict.py'),
+                                    'classifier.predict.predict_and_write': ('predict.html#predict_and_write', 'classifier/predict.py'),
                                     'classifier.predict.predict_batch': ('predict.html#predict_batch', 'classifier/predict.py'),
+                                    'classifier.predict.predict_prompts': ('predict.html#predict_prompts', 'classifier/predict.py'),
+                                    'classifier.predict.prediction_stream': ('predict.html#prediction_stream', 'classifier/predict.py'),
+                                    'classifier.predict.prompt_stream': ('predict.html#prompt_stream', 'classifier/predict.py'),
+                                    'classifier.predict.read_completed_idx': ('predict.html#read_completed_idx', 'classifier/predict.py'),
+                                    'classifier.predict.run_batch_predictions': ( 'predict.html#run_batch_predictions',
+                                                                                  'classifier/predict.py'),
+                                    'classifier.predict.run_prediction_pipeline': ( 'predict.html#run_prediction_pipeline',
+                                                                                    'classifier/predict.py'),
+                                    'classifier.predict.stream_batches': ('predict.html#stream_batches', 'classifier/predict.py'),
+                                    'classifier.predict.stream_predictions': ('predict.html#stream_predictions', 'classifier/predict.py'),
+                                    'classifier.predict.summarize_stream': ('predict.html#summarize_stream', 'classifier/predict.py'),
+                                    'classifier.predict.vote_label': ('predict.html#vote_label', 'classifier/predict.py'),
+                                    'classifier.predict.vote_threshold_table': ( 'predict.html#vote_threshold_table',
+                                                                                 'classifier/predict.py'),
+                                    'classifier.predict.write_prediction_rows': ( 'predict.html#write_prediction_rows',
+                                                                                  'classifier/predict.py'),
+                                    'classifier.predict.write_prediction_shards': ( 'predict.html#write_prediction_shards',
+                                                                                    'classifier/predict.py'),
                                     'classifier.predict.write_predictions': ('predict.html#write_predictions', 'classifier/predict.py')},
-            'classifier.process': { 'classifier.process.email_to_document': ('process.html#email_to_document', 'classifier/process.py'),
+            'classifier.process': { 'classifier.process._batch_chain': ('process.html#_batch_chain', 'classifier/process.py'),
+                                    'classifier.process._is_filler': ('process.html#_is_filler', 'classifier/process.py'),
+                                    'classifier.process._metadata_by_prompt': ('process.html#_metadata_by_prompt', 'classifier/process.py'),
+                                    'classifier.process._read_checkpoint': ('process.html#_read_checkpoint', 'classifier/process.py'),
+                                    'classifier.process._take_match': ('process.html#_take_match', 'classifier/process.py'),
+                                    'classifier.process._truncate_lines': ('process.html#_truncate_lines', 'classifier/process.py'),
+                                    'classifier.process._write_checkpoint': ('process.html#_write_checkpoint', 'classifier/process.py'),
+                                    'classifier.process.compare_chain_splits': ( 'process.html#compare_chain_splits',
+                                                                                 'classifier/process.py'),
+                                    'classifier.process.email_to_document': ('process.html#email_to_document', 'classifier/process.py'),
+                                    'classifier.process.emails_to_documents': ('process.html#emails_to_documents', 'classifier/process.py'),
+                                    'classifier.process.get_batch_output_prefix': ( 'process.html#get_batch_output_prefix',
+                                                                                    'classifier/process.py'),
+                                    'classifier.process.get_context_token_limit': ( 'process.html#get_context_token_limit',
+                                                                                    'classifier/process.py'),
                                     'classifier.process.get_documents_summaries': ( 'process.html#get_documents_summaries',
                                                                                     'classifier/process.py'),
+                                    'classifier.process.get_llm_email_splits': ( 'process.html#get_llm_email_splits',
+                                                                                 'classifier/process.py'),
+                                    'classifier.process.get_prediction_content': ( 'process.html#get_prediction_content',
+                                                                                   'classifier/process.py'),
                                     'classifier.process.get_summaries': ('process.html#get_summaries', 'classifier/process.py'),
                                     'classifier.process.get_summary_chain': ('process.html#get_summary_chain', 'classifier/process.py'),
                                     'classifier.process.load_batch_prediction_results': ( 'process.html#load_batch_prediction_results',
                                                                                           'classifier/process.py'),
+                                    'classifier.process.parse_split_answer': ('process.html#parse_split_answer', 'classifier/process.py'),
                                     'classifier.process.prepare_batch_summarization_files': ( 'process.html#prepare_batch_summarization_files',
                                                                                               'classifier/process.py'),
                                     'classifier.process.prepare_summarization_prompt': ( 'process.html#prepare_summarization_prompt',
                                                                                          'classifier/process.py'),
-                                    'classifier.process.summarize_prompts': ('process.html#summarize_prompts', 'classifier/process.py')},
-            'classifier.schema': { 'classifier.schema.batch_embed_documents': ('schema.html#batch_embed_documents', 'classifier/schema.py'),
+                                    'classifier.process.split_email_chain': ('process.html#split_email_chain', 'classifier/process.py'),
+                                    'classifier.process.split_email_chains': ('process.html#split_email_chains', 'classifier/process.py'),
+                                    'classifier.process.summarize_prompts': ('process.html#summarize_prompts', 'classifier/process.py'),
+                                    'classifier.process.summarize_unique_emails': ( 'process.html#summarize_unique_emails',
+                                                                                    'classifier/process.py')},
+            'classifier.schema': { 'classifier.schema.ClientRegistry': ('schema.html#clientregistry', 'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.__init__': ( 'schema.html#clientregistry.__init__',
+                                                                                  'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.get': ('schema.html#clientregistry.get', 'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.override': ( 'schema.html#clientregistry.override',
+                                                                                  'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.register': ( 'schema.html#clientregistry.register',
+                                                                                  'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.reset': ('schema.html#clientregistry.reset', 'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.set': ('schema.html#clientregistry.set', 'classifier/schema.py'),
+                                   'classifier.schema.ClientRegistry.warm': ('schema.html#clientregistry.warm', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter': ('schema.html#ratelimiter', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.__init__': ('schema.html#ratelimiter.__init__', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter._make_bucket': ( 'schema.html#ratelimiter._make_bucket',
+                                                                                   'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter._set_requests_per_minute': ( 'schema.html#ratelimiter._set_requests_per_minute',
+                                                                                               'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.acquire': ('schema.html#ratelimiter.acquire', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.configure': ('schema.html#ratelimiter.configure', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.requests_per_minute': ( 'schema.html#ratelimiter.requests_per_minute',
+                                                                                          'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.succeeded': ('schema.html#ratelimiter.succeeded', 'classifier/schema.py'),
+                                   'classifier.schema.RateLimiter.throttled': ('schema.html#ratelimiter.throttled', 'classifier/schema.py'),
+                                   'classifier.schema.TokenBucket': ('schema.html#tokenbucket', 'classifier/schema.py'),
+                                   'classifier.schema.TokenBucket.__init__': ('schema.html#tokenbucket.__init__', 'classifier/schema.py'),
+                                   'classifier.schema.TokenBucket.refill': ('schema.html#tokenbucket.refill', 'classifier/schema.py'),
+                                   'classifier.schema.TokenBucket.take': ('schema.html#tokenbucket.take', 'classifier/schema.py'),
+                                   'classifier.schema._count_requests': ('schema.html#_count_requests', 'classifier/schema.py'),
+                                   'classifier.schema._count_text': ('schema.html#_count_text', 'classifier/schema.py'),
+                                   'classifier.schema._make_embedder': ('schema.html#_make_embedder', 'classifier/schema.py'),
+                                   'classifier.schema._make_llm': ('schema.html#_make_llm', 'classifier/schema.py'),
+                                   'classifier.schema._make_model': ('schema.html#_make_model', 'classifier/schema.py'),
+                                   'classifier.schema._make_storage_client': ('schema.html#_make_storage_client', 'classifier/schema.py'),
+                                   'classifier.schema._predict': ('schema.html#_predict', 'classifier/schema.py'),
+                                   'classifier.schema.backoff_delay': ('schema.html#backoff_delay', 'classifier/schema.py'),
+                                   'classifier.schema.batch_embed_documents': ('schema.html#batch_embed_documents', 'classifier/schema.py'),
                                    'classifier.schema.batch_predict': ('schema.html#batch_predict', 'classifier/schema.py'),
+                                   'classifier.schema.configure_rate_limit': ('schema.html#configure_rate_limit', 'classifier/schema.py'),
                                    'classifier.schema.get_embedder': ('schema.html#get_embedder', 'classifier/schema.py'),
+                                   'classifier.schema.get_llm': ('schema.html#get_llm', 'classifier/schema.py'),
                                    'classifier.schema.get_model': ('schema.html#get_model', 'classifier/schema.py'),
+                                   'classifier.schema.get_rate_limiter': ('schema.html#get_rate_limiter', 'classifier/schema.py'),
                                    'classifier.schema.get_storage_client': ('schema.html#get_storage_client', 'classifier/schema.py'),
                                    'classifier.schema.init_vertexai': ('schema.html#init_vertexai', 'classifier/schema.py'),
                                    'classifier.schema.predict': ('schema.html#predict', 'classifier/schema.py'),
                                    'classifier.schema.quota_handler': ('schema.html#quota_handler', 'classifier/schema.py'),
                                    'classifier.schema.seconds_to_next_minute': ( 'schema.html#seconds_to_next_minute',
-                                                                                 'classifier/schema.py')}}}
+                                                                                 'classifier/schema.py'),
+                                   'classifier.schema.warm_up_clients': ('schema.html#warm_up_clients', 'classifier/schema.py')},
+            'classifier.telemetry': { 'classifier.telemetry.CallMetrics': ('telemetry.html#callmetrics', 'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.__init__': ( 'telemetry.html#callmetrics.__init__',
+                                                                                     'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics._stage': ( 'telemetry.html#callmetrics._stage',
+                                                                                   'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.record_call': ( 'telemetry.html#callmetrics.record_call',
+                                                                                        'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.record_retry': ( 'telemetry.html#callmetrics.record_retry',
+                                                                                         'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.record_sleep': ( 'telemetry.html#callmetrics.record_sleep',
+                                                                                         'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.reset': ( 'telemetry.html#callmetrics.reset',
+                                                                                  'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.summary': ( 'telemetry.html#callmetrics.summary',
+                                                                                    'classifier/telemetry.py'),
+                                      'classifier.telemetry.CallMetrics.to_prometheus': ( 'telemetry.html#callmetrics.to_prometheus',
+                                                                                          'classifier/telemetry.py'),
+                                      'classifier.telemetry.StageMetrics': ('telemetry.html#stagemetrics', 'classifier/telemetry.py'),
+                                      'classifier.telemetry.StageMetrics.__init__': ( 'telemetry.html#stagemetrics.__init__',
+                                                                                      'classifier/telemetry.py'),
+                                      'classifier.telemetry.StageMetrics.observe': ( 'telemetry.html#stagemetrics.observe',
+                                                                                     'classifier/telemetry.py'),
+                                      'classifier.telemetry.StageMetrics.quantile': ( 'telemetry.html#stagemetrics.quantile',
+                                                                                      'classifier/telemetry.py'),
+                                      'classifier.telemetry.StageMetrics.summary': ( 'telemetry.html#stagemetrics.summary',
+                                                                                     'classifier/telemetry.py'),
+                                      'classifier.telemetry._label': ('telemetry.html#_label', 'classifier/telemetry.py'),
+                                      'classifier.telemetry._write_atomically': ( 'telemetry.html#_write_atomically',
+                                                                                  'classifier/telemetry.py'),
+                                      'classifier.telemetry.write_call_metrics': ( 'telemetry.html#write_call_metrics',
+                                                                                   'classifier/telemetry.py')},
+            'classifier.tokens': { 'classifier.tokens.TokenCounter': ('tokens.html#tokencounter', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.__call__': ('tokens.html#tokencounter.__call__', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.__init__': ('tokens.html#tokencounter.__init__', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter._estimate': ( 'tokens.html#tokencounter._estimate',
+                                                                                 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.budget': ('tokens.html#tokencounter.budget', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.calibrate': ( 'tokens.html#tokencounter.calibrate',
+                                                                                 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.count': ('tokens.html#tokencounter.count', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.load': ('tokens.html#tokencounter.load', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.margin': ('tokens.html#tokencounter.margin', 'classifier/tokens.py'),
+                                   'classifier.tokens.TokenCounter.save': ('tokens.html#tokencounter.save', 'classifier/tokens.py'),
+                                   'classifier.tokens._count_tokens_remote': ('tokens.html#_count_tokens_remote', 'classifier/tokens.py'),
+                                   'classifier.tokens._make_token_counter': ('tokens.html#_make_token_counter', 'classifier/tokens.py'),
+                                   'classifier.tokens.calibrate_token_counter': ( 'tokens.html#calibrate_token_counter',
+                                                                                  'classifier/tokens.py'),
+                                   'classifier.tokens.count_tokens': ('tokens.html#count_tokens', 'classifier/tokens.py'),
+                                   'classifier.tokens.count_tokens_remote': ('tokens.html#count_tokens_remote', 'classifier/tokens.py'),
+                                   'classifier.tokens.get_token_budget': ('tokens.html#get_token_budget', 'classifier/tokens.py'),
+                                   'classifier.tokens.get_token_counter': ('tokens.html#get_token_counter', 'classifier/tokens.py'),
+                                   'classifier.tokens.token_features': ('tokens.html#token_features', 'classifier/tokens.py')}}}
@@ -0,0 +1,216 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/13_benchmark.ipynb.
+
+# %% auto 0
+__all__ = ['BENCHMARK_LABELS', 'BENCHMARK_EMAILS', 'BENCHMARK_BODY_WORDS', 'BENCHMARK_BODY_SIGMA', 'BENCHMARK_REPEATS',
+           'BENCHMARK_FILE_NAME', 'make_email_frame', 'HashingEmbeddings', 'make_summaries', 'time_call',
+           'get_benchmarks', 'run_benchmarks', 'read_benchmarks', 'compare_benchmarks', 'main']
+
+# %% ../nbs/13_benchmark.ipynb 2
+from typing import Any, Callable, Dict, List, Sequence
+from pathlib import Path
+from datetime import datetime, timezone
+import json
+import platform
+import subprocess
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+from fastcore.script import call_parse
+from langchain.embeddings.base import Embeddings
+from langchain.schema import Document
+
+from .schema import CLIENTS
+from .load import LABEL_COLUMN, EmailBatch, email_from_row, email_small_enough, get_batches
+from .process import email_to_document, prepare_summarization_prompt
+from .chroma import NumpyVectorStore
+from .predict import make_prediction_prompt
+from .tokens import TokenCounter, get_token_counter, count_tokens
+from .experiments.retrieval_filtering import format_filtered_examples
+
+# %% ../nbs/13_benchmark.ipynb 4
+BENCHMARK_LABELS = ["Pricing", "Credits", "Returns", "Shipping", "Account", "Invoices"]
+BENCHMARK_EMAILS = 1000
+BENCHMARK_BODY_WORDS = 120
+BENCHMARK_BODY_SIGMA = 1.0
+BENCHMARK_REPEATS = 5
+BENCHMARK_FILE_NAME = "benchmarks.jsonl"
+_VOCABULARY = np.array(
+    "the order invoice credit price account return shipment please thank you for your "
+    "we have received attached regarding customer item quantity delivery date number "
+    "request update issue refund contract pharmacy product backorder status confirm "
+    "0 1 12 345 2023 99.50 PO# \n".split(" "), dtype=object)
+
+
+def make_email_frame(
+        n: int = BENCHMARK_EMAILS,
+        body_words: int = BENCHMARK_BODY_WORDS,
+        body_sigma: float = BENCHMARK_BODY_SIGMA,
+        seed: int = 0) -> pd.DataFrame:
+    "A raw emails frame, like `load.get_raw_emails`, of `n` made up emails indexed by idx."
+    rng = np.random.default_rng(seed)
+    lengths = np.maximum(1, rng.lognormal(np.log(body_words), body_sigma, size=n).astype(int))
+    words = _VOCABULARY[rng.integers(0, len(_VOCABULARY), size=lengths.sum())]
+    ends = np.cumsum(lengths)
+    bodies = [" ".join(words[end - length:end]) for end, length in zip(ends, lengths)]
+    subjects = [" ".join(s) for s in _VOCABULARY[rng.integers(0, len(_VOCABULARY) - 1, size=(n, 5))]]
+    return pd.DataFrame({
+        LABEL_COLUMN: np.array(BENCHMARK_LABELS, dtype=object)[rng.integers(0, len(BENCHMARK_LABELS), size=n)],
+        'email_subject': subjects,
+        'email_body': bodies,
+        'case_number': rng.integers(10 ** 7, 10 ** 8, size=n),
+        'origin': "Email",
+    }, index=pd.Index(np.arange(n), name='idx'))
+
+
+class HashingEmbeddings(Embeddings):
+    "Bag of words embeddings from hashed words, so retrieval runs without the embedding model."
+    def __init__(self, size: int = 64):
+        self.size = size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = np.zeros(self.size)
+        for word in text.split():
+            vector[zlib.crc32(word.encode()) % self.size] += 1
+        return vector.tolist()
+
+
+def make_summaries(data: pd.DataFrame, words: int = 40) -> List[Document]:
+    "Stand-in summaries: the start of every email, with its idx and label."
+    return [
+        Document(
+            page_content=" ".join(body.split()[:words]),
+            metadata={'idx': int(idx), 'label': label})
+        for idx, label, body in zip(data.index, data[LABEL_COLUMN], data.email_body)]
+
+# %% ../nbs/13_benchmark.ipynb 6
+def time_call(
+        func: Callable[[], Any],
+        repeats: int = BENCHMARK_REPEATS,
+        setup: Callable[[], Any] = None) -> List[float]:
+    "Seconds taken by each of `repeats` calls of `func`."
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def get_benchmarks(
+        data: pd.DataFrame,
+        store: NumpyVectorStore,
+        prompt_limit: int = 20) -> Dict[str, Callable[[], Any]]:
+    "A function per benchmark, each processing every email in `data` once."
+    emails = list(EmailBatch.from_frame(data))
+    documents = [email_to_document(e) for e in emails]
+    summaries = make_summaries(data)
+    rows = list(data.iterrows())
+    examples = {
+        label: store.similarity_search(summaries[0].page_content, k=3, filter={'label': label})
+        for label in BENCHMARK_LABELS}
+    return {
+        'email_from_row': lambda: [email_from_row(idx, row) for idx, row in rows],
+        # Without selecting the train and test idx, which are read from GCS
+        'get_emails_from_frame': lambda: list(EmailBatch.from_frame(data)),
+        'email_to_document': lambda: [email_to_document(e) for e in emails],
+        'get_batches': lambda: [len(b) for b in get_batches(iter(documents), 32)],
+        'email_small_enough': lambda: [email_small_enough(e.email_subject, e.email_body) for e in emails],
+        'email_small_enough_tokens': lambda: [
+            email_small_enough(e.email_subject, e.email_body, count=count_tokens) for e in emails],
+        'prepare_summarization_prompt': lambda: [prepare_summarization_prompt(d) for d in documents],
+        'format_filtered_examples': lambda: [format_filtered_examples(examples) for _ in emails],
+        'make_prediction_prompt': lambda: [make_prediction_prompt(s, store, prompt_limit) for s in summaries],
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError, NameError):
+        return None
+
+
+def run_benchmarks(
+        n: int = BENCHMARK_EMAILS,
+        body_words: int = BENCHMARK_BODY_WORDS,
+        body_sigma: float = BENCHMARK_BODY_SIGMA,
+        repeats: int = BENCHMARK_REPEATS,
+        names: Sequence[str] = None,
+        path: Path = None,
+        seed: int = 0) -> pd.DataFrame:
+    """
+    Time every benchmark, or only `names`, on `n` synthetic emails.
+    Results are one row per benchmark, appended to the JSON lines file at `path` when given.
+    """
+    data = make_email_frame(n, body_words, body_sigma, seed)
+    store = NumpyVectorStore.from_documents(make_summaries(data), HashingEmbeddings())
+    benchmarks = get_benchmarks(data, store)
+    counter = get_token_counter()
+    coefficients = counter.coefficients if counter.calibrated else None
+    run = {
+        'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'emails': n,
+        'body_words': body_words,
+        'body_sigma': body_sigma,
+        'repeats': repeats,
+    }
+    records = []
+    with CLIENTS.override('token_counter', TokenCounter(coefficients)):
+        for name in benchmarks if names is None else names:
+            times = time_call(
+                benchmarks[name], repeats,
+                setup=lambda: CLIENTS.set('token_counter', TokenCounter(coefficients)))
+            records.append({
+                **run,
+                'benchmark': name,
+                'min_s': min(times),
+                'median_s': float(np.median(times)),
+                'per_email_us': min(times) / n * 1e6,
+                'times_s': times,
+            })
+    if path is not None:
+        with open(path, 'a') as f:
+            f.writelines(json.dumps(r) + "\n" for r in records)
+    return pd.DataFrame.from_records(records)
+
+# %% ../nbs/13_benchmark.ipynb 8
+def read_benchmarks(path: Path) -> pd.DataFrame:
+    return pd.read_json(path, lines=True)
+
+
+def compare_benchmarks(
+        results: pd.DataFrame,
+        baseline: str,
+        current: str) -> pd.DataFrame:
+    "Per email times of two commits' runs, each benchmark's latest, and how many times slower `current` is."
+    def latest(commit: str) -> pd.Series:
+        runs = results[results.commit == commit].sort_values('run_at')
+        return runs.groupby('benchmark').per_email_us.last()
+    comparison = pd.DataFrame({baseline: latest(baseline), current: latest(current)})
+    comparison['ratio'] = comparison[current] / comparison[baseline]
+    return comparison.sort_values('ratio', ascending=False)
+
+
+@call_parse
+def main(
+        n: int = BENCHMARK_EMAILS,  # Number of synthetic emails
+        body_words: int = BENCHMARK_BODY_WORDS,  # Median words in an email body
+        body_sigma: float = BENCHMARK_BODY_SIGMA,  # Spread of the log-normal body lengths
+        repeats: int = BENCHMARK_REPEATS,  # Times to run each benchmark
+        path: str = BENCHMARK_FILE_NAME,  # JSON lines file the results are appended to
+        seed: int = 0):
+    "Run the benchmarks and append the results to `path`."
+    results = run_benchmarks(n, body_words, body_sigma, repeats, path=Path(path), seed=seed)
+    print(results[['benchmark', 'min_s', 'median_s', 'per_email_us']].to_string(index=False))
@@ -0,0 +1,338 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/09_cache.ipynb.
+
+# %% auto 0
+__all__ = ['CACHE_DIR', 'DEFAULT_CACHE_BYTES', 'EVICTION_TARGET', 'EMBEDDING_CACHE_FILE_NAME', 'RESPONSE_CACHE_FILE_NAME',
+           'RESPONSE_CACHE_MODES', 'RESPONSE_CACHE_MODE', 'hash_text', 'DiskCache', 'CachedEmbeddings',
+           'make_cached_embedder', 'get_cached_embedder', 'ResponseCacheMiss', 'ResponseCache',
+           'configure_response_cache', 'get_response_cache', 'get_llm_string', 'batch_through_cache']
+
+# %% ../nbs/09_cache.ipynb 2
+from typing import Any, Callable, Dict, List, Iterable, Optional, Sequence, Tuple
+from pathlib import Path
+from functools import reduce
+import os
+import hashlib
+import json
+import operator
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.globals import get_llm_cache, set_llm_cache
+from langchain.llms.base import BaseLLM
+from langchain.schema import BaseCache, Generation
+from langchain.schema.runnable import Runnable, RunnableSequence
+
+from .schema import get_embedder, batch_embed_documents, CLIENTS
+
+# %% ../nbs/09_cache.ipynb 4
+CACHE_DIR = Path(os.environ.get("CLASSIFIER_CACHE_DIR", Path.home() / ".cache" / "classifier"))
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3
+# When over the limit, evict down to this fraction of it so we don't evict on every write
+EVICTION_TARGET = 0.9
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    "A size-bounded, least-recently-used key/value store backed by SQLite."
+    def __init__(
+            self,
+            path: Path,
+            max_bytes: int = DEFAULT_CACHE_BYTES):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self._connection.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # SQLite limits the number of parameters in a single statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                found.update(rows)
+            if len(found) > 0:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE cache SET accessed = ? WHERE key = ?",
+                    [(now, k) for k in found])
+                self._connection.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str) -> bytes:
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: Dict[str, bytes]) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                [(k, v, len(v), now) for k, v in items.items()])
+            self._connection.commit()
+            self._evict()
+
+    def set(self, key: str, value: bytes) -> None:
+        self.set_many({key: value})
+
+    def _evict(self) -> None:
+        size = self._size_bytes()
+        if size <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_TARGET
+        rows = self._connection.execute(
+            "SELECT key, size FROM cache ORDER BY accessed ASC").fetchall()
+        evict = []
+        for key, entry_size in rows:
+            if size <= target:
+                break
+            evict.append((key,))
+            size -= entry_size
+        self._connection.executemany("DELETE FROM cache WHERE key = ?", evict)
+        self._connection.commit()
+
+    def _size_bytes(self) -> int:
+        return self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self._size_bytes()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'entries': len(self),
+            'size_bytes': self.size_bytes(),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM cache")
+            self._connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self._connection.close()
+
+# %% ../nbs/09_cache.ipynb 6
+EMBEDDING_CACHE_FILE_NAME = "embeddings.sqlite3"
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embed only the texts that haven't been embedded by this model before.
+    Only those misses are sent through `batch_embed_documents`, so cached texts never wait on the rate limiter.
+    """
+    limits_requests = True
+
+    def __init__(
+            self,
+            embedder: Embeddings,
+            cache: DiskCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.model_name = getattr(embedder, 'model_name', type(embedder).__name__)
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}:{hash_text(text)}"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        found = self.cache.get_many(keys)
+        # Only send each missing text once, even if it appears more than once
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        if len(missing) > 0:
+            embeddings = batch_embed_documents(self.embedder, list(missing.values()))
+            new = {
+                k: np.asarray(e, dtype=np.float64).tobytes()
+                for k, e in zip(missing.keys(), embeddings)}
+            self.cache.set_many(new)
+            found.update(new)
+        return [np.frombuffer(found[k], dtype=np.float64).tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    @property
+    def hits(self) -> int:
+        return self.cache.hits
+
+    @property
+    def misses(self) -> int:
+        return self.cache.misses
+
+
+def make_cached_embedder(
+        cache_dir: Path = CACHE_DIR,
+        max_bytes: int = DEFAULT_CACHE_BYTES) -> CachedEmbeddings:
+    return CachedEmbeddings(
+        get_embedder(),
+        DiskCache(Path(cache_dir) / EMBEDDING_CACHE_FILE_NAME, max_bytes=max_bytes))
+
+
+CLIENTS.register('cached_embedder', make_cached_embedder)
+
+
+def get_cached_embedder() -> CachedEmbeddings:
+    "The process-wide cached embedder, sharing one cache file and connection."
+    return CLIENTS.get('cached_embedder')
+
+# %% ../nbs/09_cache.ipynb 12
+RESPONSE_CACHE_FILE_NAME = "responses.sqlite3"
+RESPONSE_CACHE_MODES = ("read_write", "read_only", "off")
+RESPONSE_CACHE_MODE = os.environ.get("CLASSIFIER_RESPONSE_CACHE", "read_write")
+
+
+class ResponseCacheMiss(KeyError):
+    "A read only response cache was asked for a response it doesn't have."
+
+
+def _dump_generations(generations: Sequence[Generation]) -> bytes:
+    return json.dumps(
+        [{'text': g.text, 'generation_info': g.generation_info} for g in generations],
+        default=str).encode("utf-8")
+
+
+def _load_generations(value: bytes) -> List[Generation]:
+    return [Generation(**g) for g in json.loads(value)]
+
+
+class ResponseCache(BaseCache):
+    "LangChain's LLM cache, kept in a `DiskCache` that is only opened on first use."
+    def __init__(
+            self,
+            path: Path,
+            max_bytes: int = DEFAULT_CACHE_BYTES,
+            read_only: bool = False):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self._cache = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self) -> DiskCache:
+        with self._lock:
+            if self._cache is None:
+                self._cache = DiskCache(self.path, max_bytes=self.max_bytes)
+        return self._cache
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return f"{hash_text(llm_string)}:{hash_text(prompt)}"
+
+    def lookup_many(self, prompts: List[str], llm_string: str) -> Dict[int, List[Generation]]:
+        "The cached generations of the prompts that have them, by position. Never raises on a miss."
+        keys = [self._key(p, llm_string) for p in prompts]
+        found = self.cache.get_many(keys)
+        return {i: _load_generations(found[k]) for i, k in enumerate(keys) if k in found}
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[List[Generation]]:
+        found = self.lookup_many([prompt], llm_string)
+        if 0 in found:
+            return found[0]
+        if self.read_only:
+            raise ResponseCacheMiss(f"No cached response for prompt {hash_text(prompt)}")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if not self.read_only:
+            self.cache.set(self._key(prompt, llm_string), _dump_generations(return_val))
+
+    def clear(self, **kwargs: Any) -> None:
+        self.cache.clear()
+
+
+def configure_response_cache(
+        mode: str = RESPONSE_CACHE_MODE,
+        cache_dir: Path = CACHE_DIR,
+        max_bytes: int = DEFAULT_CACHE_BYTES) -> Optional[ResponseCache]:
+    """
+    Install the process-wide response cache, or remove it when `mode` is 'off'.
+    Nothing is cached until this is called, so importing the package never freezes a model's answers.
+    """
+    if mode not in RESPONSE_CACHE_MODES:
+        raise ValueError(f"Unknown response cache mode {mode!r}, expected one of {RESPONSE_CACHE_MODES}")
+    cache = None
+    if mode != "off":
+        cache = ResponseCache(
+            Path(cache_dir) / RESPONSE_CACHE_FILE_NAME,
+            max_bytes=max_bytes,
+            read_only=mode == "read_only")
+    set_llm_cache(cache)
+    return cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    cache = get_llm_cache()
+    return cache if isinstance(cache, ResponseCache) else None
+
+# %% ../nbs/09_cache.ipynb 14
+def get_llm_string(llm: BaseLLM, stop: Optional[List[str]] = None) -> str:
+    "How LangChain identifies a model and its parameters in the cache."
+    return str(sorted({**llm.dict(), 'stop': stop}.items()))
+
+
+def _split_at_llm(chain: Runnable) -> Tuple[Optional[Runnable], Optional[BaseLLM], Optional[Runnable]]:
+    "The steps before the chain's one LLM, the LLM, and the steps after it."
+    steps = chain.steps if isinstance(chain, RunnableSequence) else [chain]
+    positions = [i for i, step in enumerate(steps) if isinstance(step, BaseLLM)]
+    if len(positions) != 1:
+        return None, None, None
+    before, llm, after = steps[:positions[0]], steps[positions[0]], steps[positions[0] + 1:]
+    return (
+        reduce(operator.or_, before) if len(before) > 0 else None,
+        llm,
+        reduce(operator.or_, after) if len(after) > 0 else None)
+
+
+def batch_through_cache(
+        chain: Runnable,
+        inputs: List[Any],
+        call: Callable[[List[Any]], List[Any]]) -> List[Any]:
+    "Run `chain` on `inputs`, handing only the inputs without a cached response to `call`."
+    cache = get_response_cache()
+    prompt, llm, after = _split_at_llm(chain)
+    if cache is None or llm is None or len(inputs) == 0:
+        return call(inputs)
+    rendered = inputs if prompt is None else prompt.batch(inputs)
+    prompts = [p if isinstance(p, str) else p.to_string() for p in rendered]
+    found = cache.lookup_many(prompts, get_llm_string(llm))
+    missing = [i for i in range(len(inputs)) if i not in found]
+    results = {}
+    if len(missing) > 0:
+        results.update(zip(missing, call([inputs[i] for i in missing])))
+    if len(found) > 0:
+        answers = [g[0].text for g in found.values()]
+        results.update(zip(found.keys(), answers if after is None else after.batch(answers)))
+    return [results[i] for i in range(len(inputs))]
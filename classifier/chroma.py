@@ -1,36 +1,137 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/03_chroma.ipynb.
 
 # %% auto 0
-__all__ = ['get_or_make_chroma', 'read_json_lines_from_gcs']
+__all__ = ['INGEST_CHUNK_SIZE', 'INGESTED_FILE_NAME', 'VECTOR_STORE_BACKENDS', 'VECTOR_STORE_BACKEND', 'NUMPY_STORE_DIR_NAME',
+           'EMBEDDINGS_FILE_NAME', 'DOCUMENTS_FILE_NAME', 'PAGE_CONTENT_COLUMN', 'SEARCH_CHUNK_SIZE', 'VectorStore',
+           'QUERY_EMBEDDING_BATCH_SIZE', 'JSON_LINES_CHUNK_SIZE', 'JSON_LINES_BATCH_SIZE', 'document_hash',
+           'ingest_documents', 'get_or_make_chroma', 'update_chroma', 'normalize_embeddings', 'top_k_indices',
+           'NumpyVectorStore', 'get_collection_size', 'get_or_make_vector_store', 'similarity_search_per_label',
+           'embed_queries', 'similarity_search_batch_with_score', 'similarity_search_batch',
+           'similarity_search_per_label_batch', 'read_json_line_batches', 'list_blob_names',
+           'read_json_line_batches_from_gcs', 'read_json_lines_from_gcs']
 
 # %% ../nbs/03_chroma.ipynb 2
-from typing import List, Dict, Any, Iterable
+from typing import List, Dict, Any, Iterable, Callable, BinaryIO, Union, Tuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import os
 import json
+import shutil
+import queue
+import threading
+import numpy as np
 import pandas as pd
 
 import chromadb
 from langchain.vectorstores import Chroma
 from langchain.embeddings import VertexAIEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.schema import Document
 from langchain.document_loaders import DataFrameLoader
 from google.cloud import storage
 from tqdm import tqdm
 
-from .schema import get_embedder, get_storage_client, WRITE_PREFIX
+from .schema import get_embedder, get_storage_client, batch_embed_documents, WRITE_PREFIX
+from .cache import get_cached_embedder, hash_text
 from .load import get_emails_from_frame, get_idx, Email, \
     PROJECT_BUCKET, get_train_test_idx, LABEL_COLUMN, get_batches, write_idx, \
     get_raw_emails_tejas_case_numbers
 
 # %% ../nbs/03_chroma.ipynb 16
+INGEST_CHUNK_SIZE = 500
+INGESTED_FILE_NAME = "ingested.json"
+
+
+def document_hash(document: Document) -> str:
+    return hash_text(document.page_content + json.dumps(document.metadata, sort_keys=True, default=str))
+
+
+def _read_ingested(chroma: Chroma, checkpoint_path: Path = None) -> Dict[str, Dict[str, str]]:
+    "The id and hash of every document in the store by idx, from the checkpoint or else the collection."
+    if checkpoint_path is not None and checkpoint_path.exists():
+        return json.loads(checkpoint_path.read_text())
+    collection = chroma._collection.get(include=['documents', 'metadatas'])
+    return {
+        str(metadata.get('idx')): {
+            'id': id, 
+            'hash': document_hash(Document(page_content=text, metadata=metadata))}
+        for id, text, metadata in zip(collection['ids'], collection['documents'], collection['metadatas'])
+        if metadata is not None and 'idx' in metadata}
+
+
+def _write_ingested(ingested: Dict[str, Dict[str, str]], checkpoint_path: Path) -> None:
+    temporary_path = checkpoint_path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(ingested))
+    os.replace(temporary_path, checkpoint_path)
+
+
+def ingest_documents(
+        chroma: Chroma,
+        documents: List[Document],
+        embeddings: List[List[float]] = None,
+        chunk_size: int = INGEST_CHUNK_SIZE,
+        checkpoint_path: Path = None) -> int:
+    """
+    Upsert new or changed documents into `chroma`, `chunk_size` at a time, keyed by their idx.
+    Every document needs an idx in its metadata, and documents whose content hash is already in the store are skipped.
+    Uses `embeddings` when given, otherwise each chunk is embedded as it is written.
+    The store's contents are checkpointed after every chunk, so an interrupted run loses one chunk at most.
+    Returns the number of documents written.
+    """
+    missing = [position for position, document in enumerate(documents) if document.metadata.get('idx') is None]
+    if len(missing) > 0:
+        raise ValueError(f"Every document needs an idx to be ingested, but {len(missing)} don't, starting at position {missing[0]}")
+    if checkpoint_path is None and chroma._persist_directory is not None:
+        checkpoint_path = Path(chroma._persist_directory) / INGESTED_FILE_NAME
+    ingested = _read_ingested(chroma, checkpoint_path)
+    # The last document with an idx wins
+    pending = {}
+    for position, document in enumerate(documents):
+        key = str(document.metadata.get('idx'))
+        content_hash = document_hash(document)
+        pending.pop(key, None)
+        if ingested.get(key, {}).get('hash') != content_hash:
+            pending[key] = (position, content_hash)
+    written = 0
+    pbar = tqdm(total=len(pending), ncols=80, leave=False)
+    for chunk in get_batches(iter(pending.items()), chunk_size):
+        if len(chunk) == 0:
+            continue
+        chunk_documents = [documents[position] for _, (position, _) in chunk]
+        if embeddings is None:
+            chunk_embeddings = batch_embed_documents(
+                chroma._embedding_function, [d.page_content for d in chunk_documents])
+        else:
+            chunk_embeddings = [
+                np.asarray(embeddings[position], dtype=np.float64).tolist() for _, (position, _) in chunk]
+        # Changed documents keep their id so they are replaced rather than duplicated
+        ids = [ingested.get(key, {}).get('id', key) for key, _ in chunk]
+        chroma._collection.upsert(
+            ids=ids,
+            embeddings=chunk_embeddings,
+            documents=[d.page_content for d in chunk_documents],
+            metadatas=[d.metadata for d in chunk_documents])
+        for (key, (_, content_hash)), id in zip(chunk, ids):
+            ingested[key] = {'id': id, 'hash': content_hash}
+        if checkpoint_path is not None:
+            _write_ingested(ingested, checkpoint_path)
+        written += len(chunk)
+        pbar.update(len(chunk))
+    pbar.close()
+    if written > 0:
+        get_collection_size(chroma, refresh=True)
+    return written
+
+
 def get_or_make_chroma(
         data_dir: Path, 
         documents: List[Document] = None,
-        overwrite: bool = False):
+        overwrite: bool = False,
+        embeddings: List[List[float]] = None):
     chroma_dir = data_dir / 'chroma'
     if not chroma_dir.exists():
         chroma_dir.mkdir()
-    embedding_function = get_embedder()
+    embedding_function = get_cached_embedder()
     persist_directory = str(chroma_dir.resolve())
     if len(list(chroma_dir.glob("*.sqlite3"))) > 0:
         if not overwrite:
@@ -40,22 +141,562 @@ def get_or_make_chroma(
             )
         else:
             for f in chroma_dir.glob("*"):
-                f.unlink()
+                if f.is_dir():
+                    shutil.rmtree(f)
+                else:
+                    f.unlink()
     if documents is None:
         raise ValueError("documents cannot be None")
-    return Chroma.from_documents(
-        documents,
-        embedding_function,
-        persist_directory=persist_directory
+    chroma = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=embedding_function
     )
+    ingest_documents(chroma, documents, embeddings)
+    return chroma
+
+
+def update_chroma(
+        data_dir: Path,
+        documents: List[Document],
+        embeddings: List[List[float]] = None,
+        chunk_size: int = INGEST_CHUNK_SIZE) -> Chroma:
+    "Add new or changed documents to the store in `data_dir`, making it if needed."
+    chroma = Chroma(
+        persist_directory=str((data_dir / 'chroma').resolve()),
+        embedding_function=get_cached_embedder()
+    )
+    ingest_documents(chroma, documents, embeddings, chunk_size)
+    return chroma
 
 # %% ../nbs/03_chroma.ipynb 21
+VECTOR_STORE_BACKENDS = ['chroma', 'numpy']
+# Choose the backend for a run with the CLASSIFIER_VECTOR_STORE environment variable
+VECTOR_STORE_BACKEND = os.environ.get("CLASSIFIER_VECTOR_STORE", "chroma")
+NUMPY_STORE_DIR_NAME = "numpy"
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+DOCUMENTS_FILE_NAME = "documents.parquet"
+PAGE_CONTENT_COLUMN = "page_content"
+# Queries scored at once, bounding the size of the query by document score matrix
+SEARCH_CHUNK_SIZE = 256
+
+
+def normalize_embeddings(embeddings: Any) -> np.ndarray:
+    "Scale embeddings to unit length, so a dot product is their cosine similarity."
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    "Positions of the `k` highest scores, highest first and ties in order of position."
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    # Ties with the k-th score go to the earliest positions, so a larger k only extends the ranking
+    top = np.r_[np.flatnonzero(scores > kth), np.flatnonzero(scores == kth)][:k]
+    top.sort()
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class NumpyVectorStore:
+    """
+    Exact nearest neighbor search over a contiguous matrix of normalized embeddings.
+    Mirrors the parts of `Chroma` we use, ranking by cosine similarity.
+    """
+    def __init__(
+            self,
+            embeddings: np.ndarray,
+            texts: List[str],
+            metadata: pd.DataFrame,
+            embedding_function: Embeddings):
+        if not (len(embeddings) == len(texts) == len(metadata)):
+            raise ValueError("embeddings, texts and metadata must be the same length")
+        self.embeddings = embeddings
+        self.texts = np.asarray(texts, dtype=object)
+        self.metadata = metadata.reset_index(drop=True)
+        self.embedding_function = embedding_function
+        self._records = self.metadata.to_dict('records')
+        self._columns = {c: self.metadata[c].to_numpy() for c in self.metadata.columns}
+        self._partitions = {}
+
+    @classmethod
+    def from_embeddings(
+            cls,
+            documents: List[Document],
+            embeddings: Any,
+            embedding_function: Embeddings) -> 'NumpyVectorStore':
+        return cls(
+            normalize_embeddings(embeddings),
+            [d.page_content for d in documents],
+            pd.DataFrame.from_records([d.metadata for d in documents]),
+            embedding_function)
+
+    @classmethod
+    def from_documents(
+            cls,
+            documents: List[Document],
+            embedding_function: Embeddings,
+            chunk_size: int = INGEST_CHUNK_SIZE) -> 'NumpyVectorStore':
+        "Embed `documents` `chunk_size` at a time, like `ingest_documents`, so a cached embedder keeps every finished chunk."
+        embeddings = embed_queries(embedding_function, [d.page_content for d in documents], chunk_size)
+        return cls.from_embeddings(documents, embeddings, embedding_function)
+
+    @classmethod
+    def from_chroma(cls, chroma: Chroma) -> 'NumpyVectorStore':
+        "Copy a chroma collection, reusing its embeddings."
+        collection = chroma._collection.get(include=['embeddings', 'documents', 'metadatas'])
+        documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(collection['documents'], collection['metadatas'])]
+        return cls.from_embeddings(documents, collection['embeddings'], chroma._embedding_function)
+
+    def save(self, directory: Path) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / EMBEDDINGS_FILE_NAME, np.ascontiguousarray(self.embeddings))
+        documents = self.metadata.copy()
+        documents.insert(0, PAGE_CONTENT_COLUMN, self.texts)
+        documents.to_parquet(directory / DOCUMENTS_FILE_NAME, index=False)
+
+    @classmethod
+    def load(
+            cls,
+            directory: Path,
+            embedding_function: Embeddings,
+            mmap: bool = True) -> 'NumpyVectorStore':
+        directory = Path(directory)
+        embeddings = np.load(directory / EMBEDDINGS_FILE_NAME, mmap_mode='r' if mmap else None)
+        documents = pd.read_parquet(directory / DOCUMENTS_FILE_NAME)
+        return cls(
+            embeddings,
+            documents[PAGE_CONTENT_COLUMN].tolist(),
+            documents.drop(columns=PAGE_CONTENT_COLUMN),
+            embedding_function)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def partition(self, key: str) -> Dict[Any, np.ndarray]:
+        "The rows holding each value of a metadata column, worked out once per column."
+        if key not in self._partitions:
+            values = pd.Series(self._columns.get(key, np.array([], dtype=object)))
+            self._partitions[key] = values.groupby(values, sort=False).indices
+        return self._partitions[key]
+
+    def filter_positions(self, filter: Dict[str, Any]) -> np.ndarray:
+        "Rows whose metadata equals every value in `filter`."
+        positions = None
+        for key, value in filter.items():
+            rows = self.partition(key).get(value, np.array([], dtype=np.int64))
+            positions = rows if positions is None else np.intersect1d(positions, rows)
+        return positions
+
+    def get_document(self, position: int) -> Document:
+        return Document(page_content=self.texts[position], metadata=dict(self._records[position]))
+
+    def similarity_search_by_vector_with_score(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Dict[str, Any] = None) -> List[Tuple[Document, float]]:
+        "Returns documents with their cosine distance, like `Chroma`, nearest first."
+        scores = self.embeddings @ normalize_embeddings(embedding)
+        if not filter:
+            return self._top_k_documents(scores, np.arange(len(self)), k)
+        return self._top_k_documents(scores, self.filter_positions(filter), k)
+
+    def _top_k_documents(
+            self,
+            scores: np.ndarray,
+            positions: np.ndarray,
+            k: int) -> List[Tuple[Document, float]]:
+        "The `k` best scoring of `positions`, with their cosine distances."
+        top = positions[top_k_indices(scores[positions], k)]
+        return [(self.get_document(r), float(1 - scores[r])) for r in top]
+
+    def similarity_search_by_vector_per_value(
+            self,
+            embedding: List[float],
+            values: List[Any],
+            k: int = 4,
+            key: str = 'label') -> Dict[Any, List[Document]]:
+        "The `k` nearest documents for each of `values` of `key`, scoring every row once."
+        scores = self.embeddings @ normalize_embeddings(embedding)
+        partition = self.partition(key)
+        empty = np.array([], dtype=np.int64)
+        return {
+            value: [d for d, _ in self._top_k_documents(scores, partition.get(value, empty), k)]
+            for value in values}
+
+    def similarity_search_with_score(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Dict[str, Any] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Dict[str, Any] = None) -> List[Document]:
+        return [d for d, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Dict[str, Any] = None) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _score_chunks(self, embeddings: Any) -> Iterable[Tuple[int, np.ndarray]]:
+        embeddings = normalize_embeddings(embeddings)
+        for start in range(0, len(embeddings), SEARCH_CHUNK_SIZE):
+            yield start, embeddings[start:start + SEARCH_CHUNK_SIZE] @ self.embeddings.T
+
+    def similarity_search_by_vectors_with_score(
+            self,
+            embeddings: Any,
+            k: Union[int, List[int]] = 4,
+            filter: Dict[str, Any] = None) -> List[List[Tuple[Document, float]]]:
+        "Search for many queries at once, with cosine distances. `k` can be given per query."
+        ks = [k] * len(embeddings) if isinstance(k, int) else k
+        positions = self.filter_positions(filter) if filter else np.arange(len(self))
+        results = []
+        for start, scores in self._score_chunks(embeddings):
+            for query_scores, query_k in zip(scores, ks[start:start + len(scores)]):
+                results.append(self._top_k_documents(query_scores, positions, query_k))
+        return results
+
+    def similarity_search_by_vectors(
+            self,
+            embeddings: Any,
+            k: Union[int, List[int]] = 4,
+            filter: Dict[str, Any] = None) -> List[List[Document]]:
+        "Search for many queries at once. `k` can be given per query."
+        return [
+            [d for d, _ in neighbors]
+            for neighbors in self.similarity_search_by_vectors_with_score(embeddings, k, filter)]
+
+    def similarity_search_by_vectors_per_value(
+            self,
+            embeddings: Any,
+            values: List[List[Any]],
+            k: int = 4,
+            key: str = 'label') -> List[Dict[Any, List[Document]]]:
+        "`similarity_search_by_vector_per_value` for many queries, each with its own values."
+        partition = self.partition(key)
+        empty = np.array([], dtype=np.int64)
+        results = []
+        for start, scores in self._score_chunks(embeddings):
+            for query_scores, query_values in zip(scores, values[start:start + len(scores)]):
+                results.append({
+                    value: [d for d, _ in self._top_k_documents(query_scores, partition.get(value, empty), k)]
+                    for value in query_values})
+        return results
+
+
+VectorStore = Union[Chroma, NumpyVectorStore]
+
+
+# Counting a collection is expensive, so it is done once per collection, and again after ingesting into it
+_COLLECTION_SIZES = {}
+
+
+def get_collection_size(chroma: VectorStore, refresh: bool = False) -> int:
+    if isinstance(chroma, NumpyVectorStore):
+        return len(chroma)
+    key = chroma._collection.id
+    if refresh or key not in _COLLECTION_SIZES:
+        _COLLECTION_SIZES[key] = chroma._collection.count()
+    return _COLLECTION_SIZES[key]
+
+
+def get_or_make_vector_store(
+        data_dir: Path,
+        documents: List[Document] = None,
+        overwrite: bool = False,
+        backend: str = None,
+        embedding_function: Embeddings = None) -> VectorStore:
+    """
+    `get_or_make_chroma`, or its equivalent for the `backend` chosen for this run.
+    A new numpy store copies the chroma store in `data_dir` if there is one, rather than embedding again.
+    Numpy stores embed with the cached embedder unless given an `embedding_function`.
+    """
+    backend = VECTOR_STORE_BACKEND if backend is None else backend
+    if backend not in VECTOR_STORE_BACKENDS:
+        raise ValueError(f"Unknown vector store backend {backend}, expected one of {VECTOR_STORE_BACKENDS}")
+    if backend == 'chroma':
+        return get_or_make_chroma(data_dir, documents, overwrite)
+    store_dir = data_dir / NUMPY_STORE_DIR_NAME
+    embedding_function = get_cached_embedder() if embedding_function is None else embedding_function
+    if (store_dir / EMBEDDINGS_FILE_NAME).exists() and not overwrite:
+        return NumpyVectorStore.load(store_dir, embedding_function)
+    if documents is not None:
+        store = NumpyVectorStore.from_documents(documents, embedding_function)
+    elif len(list((data_dir / 'chroma').glob("*.sqlite3"))) > 0:
+        store = NumpyVectorStore.from_chroma(get_or_make_chroma(data_dir))
+    else:
+        raise ValueError("documents cannot be None")
+    store.save(store_dir)
+    return NumpyVectorStore.load(store_dir, embedding_function)
+
+
+def similarity_search_per_label(
+        store: VectorStore,
+        query: str,
+        labels: List[str],
+        k: int = 3,
+        key: str = 'label') -> Dict[str, List[Document]]:
+    """
+    The `k` nearest documents for each of `labels`, embedding the query once.
+    A numpy store answers every label from one scan of the index. Chroma is queried once for
+    all the labels, and again only for labels with fewer than `k` among the nearest.
+    """
+    if isinstance(store, NumpyVectorStore):
+        embedding = store.embedding_function.embed_query(query)
+        return store.similarity_search_by_vector_per_value(embedding, labels, k, key)
+    embedding = store._embedding_function.embed_query(query)
+    results = {l: [] for l in labels}
+    if len(results) == 0:
+        return results
+    found = _query_chroma(store, np.asarray([embedding]), k * len(results), {key: {'$in': list(results)}})[0]
+    for document, _ in found:
+        group = results.get(document.metadata.get(key))
+        if group is not None and len(group) < k:
+            group.append(document)
+    for l, group in results.items():
+        if len(group) < k:
+            results[l] = store.similarity_search_by_vector(embedding, k=k, filter={key: l})
+    return results
+
+# %% ../nbs/03_chroma.ipynb 23
+QUERY_EMBEDDING_BATCH_SIZE = 250
+
+
+def embed_queries(
+        store: Union[VectorStore, Embeddings],
+        queries: List[str],
+        batch_size: int = QUERY_EMBEDDING_BATCH_SIZE) -> np.ndarray:
+    "Embed many queries with the store's embedder, or an embedder itself, `batch_size` texts per call."
+    if isinstance(store, Embeddings):
+        embedder = store
+    else:
+        embedder = store.embedding_function if isinstance(store, NumpyVectorStore) else store._embedding_function
+    embeddings = []
+    for batch in get_batches(iter(queries), batch_size):
+        if len(batch) > 0:
+            embeddings.extend(batch_embed_documents(embedder, batch))
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def _query_chroma(
+        chroma: Chroma,
+        embeddings: np.ndarray,
+        k: int,
+        where: Dict[str, Any] = None) -> List[List[Tuple[Document, float]]]:
+    """
+    One bulk query against the chroma collection, with cosine distances.
+    A cosine collection's own distances are used. In any other space they are worked out
+    from the returned embeddings, so only those collections fetch them.
+    """
+    if len(embeddings) == 0:
+        return []
+    cosine = (chroma._collection.metadata or {}).get('hnsw:space', 'l2') == 'cosine'
+    results = chroma._collection.query(
+        query_embeddings=np.asarray(embeddings).tolist(),
+        n_results=k,
+        where=where or None,
+        include=['documents', 'metadatas', 'distances' if cosine else 'embeddings'])
+    neighbors = []
+    for query, texts, metadatas, found in zip(
+            normalize_embeddings(embeddings),
+            results['documents'],
+            results['metadatas'],
+            results['distances' if cosine else 'embeddings']):
+        if cosine:
+            distances = found
+        else:
+            distances = 1 - normalize_embeddings(found) @ query if len(found) > 0 else []
+        neighbors.append([
+            (Document(page_content=text, metadata=metadata or {}), float(distance))
+            for text, metadata, distance in zip(texts, metadatas, distances)])
+    return neighbors
+
+
+def similarity_search_batch_with_score(
+        store: VectorStore,
+        queries: List[str],
+        k: Union[int, List[int]] = 4,
+        filter: Dict[str, Any] = None,
+        idx: List[Any] = None,
+        batch_size: int = QUERY_EMBEDDING_BATCH_SIZE) -> List[List[Tuple[Document, float]]]:
+    """
+    The `k` nearest documents for every query with their cosine distances, embedding and searching them together.
+    `k` can be given per query. With `idx`, each query's own document is dropped from its
+    neighbors after the search, as `predict.filter_examples` does.
+    """
+    ks = [k] * len(queries) if isinstance(k, int) else list(k)
+    if len(queries) == 0:
+        return []
+    if not isinstance(store, (NumpyVectorStore, Chroma)):
+        # Any other store is searched one query at a time
+        neighbors = [store.similarity_search_with_score(q, k=query_k) for q, query_k in zip(queries, ks)]
+    elif isinstance(store, NumpyVectorStore):
+        neighbors = store.similarity_search_by_vectors_with_score(embed_queries(store, queries, batch_size), ks, filter)
+    else:
+        embeddings = embed_queries(store, queries, batch_size)
+        neighbors = [n[:query_k] for n, query_k in zip(_query_chroma(store, embeddings, max(ks), filter), ks)]
+    if idx is None:
+        return neighbors
+    return [
+        [(d, s) for d, s in documents if int(d.metadata.get('idx')) != int(i)]
+        for documents, i in zip(neighbors, idx)]
+
+
+def similarity_search_batch(
+        store: VectorStore,
+        queries: List[str],
+        k: Union[int, List[int]] = 4,
+        filter: Dict[str, Any] = None,
+        idx: List[Any] = None,
+        batch_size: int = QUERY_EMBEDDING_BATCH_SIZE) -> List[List[Document]]:
+    "`similarity_search_batch_with_score` without the distances."
+    return [
+        [d for d, _ in neighbors]
+        for neighbors in similarity_search_batch_with_score(store, queries, k, filter, idx, batch_size)]
+
+
+def similarity_search_per_label_batch(
+        store: VectorStore,
+        queries: List[str],
+        labels: List[List[str]],
+        k: int = 3,
+        key: str = 'label',
+        batch_size: int = QUERY_EMBEDDING_BATCH_SIZE) -> List[Dict[str, List[Document]]]:
+    "`similarity_search_per_label` for many queries, each with its own labels."
+    if len(queries) == 0:
+        return []
+    embeddings = embed_queries(store, queries, batch_size)
+    if isinstance(store, NumpyVectorStore):
+        return store.similarity_search_by_vectors_per_value(embeddings, labels, k, key)
+    # One bulk query per label, for every query that wants it
+    results = [{} for _ in queries]
+    for label in dict.fromkeys(l for query_labels in labels for l in query_labels):
+        wanted = [i for i, query_labels in enumerate(labels) if label in query_labels]
+        for i, documents in zip(wanted, _query_chroma(store, embeddings[wanted], k, {key: label})):
+            results[i][label] = [d for d, _ in documents]
+    return [{l: results[i].get(l, []) for l in query_labels} for i, query_labels in enumerate(labels)]
+
+# %% ../nbs/03_chroma.ipynb 30
+try:
+    # Several times faster than json when it's installed
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+JSON_LINES_CHUNK_SIZE = 8 * 1024 * 1024
+JSON_LINES_BATCH_SIZE = 1000
+_END_OF_BLOB = object()
+
+
+def read_json_line_batches(
+        f: BinaryIO,
+        batch_size: int = JSON_LINES_BATCH_SIZE,
+        chunk_size: int = JSON_LINES_CHUNK_SIZE,
+        loads: Callable[[bytes], Any] = None) -> Iterable[List[Any]]:
+    "Decode a binary JSONL stream in batches, reading `chunk_size` bytes at a time."
+    loads = _json_loads if loads is None else loads
+    remainder = b""
+    batch = []
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line.strip():
+                batch.append(loads(line))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+    if remainder.strip():
+        batch.append(loads(remainder))
+    if len(batch) > 0:
+        yield batch
+
+
+def list_blob_names(
+        prefix: str,
+        bucket_name: str = PROJECT_BUCKET,
+        suffix: str = ".jsonl") -> List[str]:
+    client = get_storage_client()
+    return sorted(
+        b.name for b in client.list_blobs(bucket_name, prefix=prefix) if b.name.endswith(suffix))
+
+
+def read_json_line_batches_from_gcs(
+        blob_names: Union[str, List[str]],
+        bucket_name: str = PROJECT_BUCKET,
+        batch_size: int = JSON_LINES_BATCH_SIZE,
+        workers: int = 4,
+        chunk_size: int = JSON_LINES_CHUNK_SIZE,
+        max_buffered_batches: int = 8,
+        with_blob_names: bool = False) -> Iterable[List[Any]]:
+    """
+    Stream batches of records from one or more JSONL blobs, in file order.
+    Up to `workers` blobs are downloaded and decoded at once, 
+    each buffering at most `max_buffered_batches` batches ahead of the reader.
+    With `with_blob_names`, yields `(blob_name, batch)` pairs.
+    """
+    if isinstance(blob_names, str):
+        blob_names = [blob_names]
+    bucket = get_storage_client().bucket(bucket_name)
+    queues = [queue.Queue(maxsize=max_buffered_batches) for _ in blob_names]
+    stop = threading.Event()
+
+    def put(q: queue.Queue, item: Any):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def read_blob(blob_name: str, q: queue.Queue):
+        try:
+            with bucket.blob(blob_name).open('rb', chunk_size=chunk_size) as f:
+                for batch in read_json_line_batches(f, batch_size, chunk_size):
+                    if stop.is_set():
+                        return
+                    put(q, batch)
+        except Exception as e:
+            put(q, e)
+        put(q, _END_OF_BLOB)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    for blob_name, q in zip(blob_names, queues):
+        executor.submit(read_blob, blob_name, q)
+    try:
+        for blob_name, q in zip(blob_names, queues):
+            while True:
+                item = q.get()
+                if item is _END_OF_BLOB:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield (blob_name, item) if with_blob_names else item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+
 def read_json_lines_from_gcs(
-        blob_name: str,
+        blob_name: Union[str, List[str]],
         bucket_name: str = PROJECT_BUCKET) -> Iterable[Any]:
-    client = get_storage_client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_name)
-    with blob.open('r') as f:
-        for line in f.readlines():
-            yield json.loads(line)
+    for batch in read_json_line_batches_from_gcs(blob_name, bucket_name):
+        yield from batch
@@ -0,0 +1,126 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/12_dedupe.ipynb.
+
+# %% auto 0
+__all__ = ['SHINGLE_WORDS', 'NUM_PERMUTATIONS', 'MINHASH_CHUNK_SIZE', 'LSH_BANDS', 'NEAR_DUPLICATE_THRESHOLD', 'shingle_hashes',
+           'minhash_signatures', 'near_duplicate_representatives', 'get_email_representatives',
+           'get_representative_emails', 'fan_out']
+
+# %% ../nbs/12_dedupe.ipynb 2
+from typing import List, Sequence
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from .load import EmailBatch
+
+# %% ../nbs/12_dedupe.ipynb 4
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 128
+MINHASH_CHUNK_SIZE = 1000
+_PERMUTATION_BLOCK = 16
+_HASH_SHIFT = np.uint64(32)
+_WORDS = re.compile(r"\w+")
+_NUMBERS = re.compile(r"\d+")
+
+
+def shingle_hashes(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    "Hashes of the distinct runs of `size` words in `text`, with numbers masked."
+    words = _WORDS.findall(_NUMBERS.sub("0", text.lower()))
+    shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+
+def minhash_signatures(
+        texts: Sequence[str],
+        num_permutations: int = NUM_PERMUTATIONS,
+        seed: int = 0,
+        chunk_size: int = MINHASH_CHUNK_SIZE) -> np.ndarray:
+    "A row of `num_permutations` minimum hashes for every text."
+    rng = np.random.default_rng(seed)
+    # Multiply-shift hashing, which wraps around 2**64 and keeps the high 32 bits
+    a = rng.integers(0, 1 << 63, size=num_permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_permutations, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_permutations), dtype=np.uint32)
+    for start in range(0, len(texts), chunk_size):
+        hashes = [shingle_hashes(t) for t in texts[start:start + chunk_size]]
+        # Every text has at least one shingle, so no segment is empty
+        bounds = np.concatenate([[0], np.cumsum([len(h) for h in hashes])[:-1]])
+        flat = np.concatenate(hashes)[:, None]
+        permuted = np.empty((len(flat), _PERMUTATION_BLOCK), dtype=np.uint64)
+        for p in range(0, num_permutations, _PERMUTATION_BLOCK):
+            block = slice(p, p + _PERMUTATION_BLOCK)
+            np.multiply(flat, a[block], out=permuted)
+            permuted += b[block]
+            permuted >>= _HASH_SHIFT
+            signatures[start:start + len(hashes), block] = np.minimum.reduceat(permuted, bounds, axis=0)
+    return signatures
+
+# %% ../nbs/12_dedupe.ipynb 7
+LSH_BANDS = 16
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+
+def near_duplicate_representatives(
+        signatures: np.ndarray,
+        threshold: float = NEAR_DUPLICATE_THRESHOLD,
+        bands: int = LSH_BANDS) -> np.ndarray:
+    "For every row, the position of the first row in its cluster of near duplicates."
+    n, num_permutations = signatures.shape
+    if n == 0:
+        return np.array([], dtype=np.int64)
+    rows = num_permutations // bands
+    # Hashing a band into one key can collide, but every candidate is checked against the threshold anyway
+    multipliers = np.random.default_rng(0).integers(1, 1 << 63, size=rows, dtype=np.uint64)
+    pairs = []
+    for band in range(bands):
+        keys = (signatures[:, band * rows:(band + 1) * rows].astype(np.uint64) * multipliers).sum(axis=1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+        firsts = order[np.flatnonzero(new_bucket)[np.cumsum(new_bucket) - 1]]
+        others = order[~new_bucket]
+        firsts = firsts[~new_bucket]
+        similar = (signatures[others] == signatures[firsts]).mean(axis=1) >= threshold
+        pairs.append(np.stack([firsts[similar], others[similar]], axis=1))
+    parent = np.arange(n)
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for first, other in np.unique(np.concatenate(pairs), axis=0).tolist():
+        first_root, other_root = find(first), find(other)
+        if first_root != other_root:
+            # Keep the earliest row as the root
+            parent[max(first_root, other_root)] = min(first_root, other_root)
+    roots = np.array([find(i) for i in range(n)], dtype=np.int64)
+    return pd.Series(np.arange(n)).groupby(roots).transform('min').to_numpy()
+
+
+def get_email_representatives(
+        emails: EmailBatch,
+        threshold: float = NEAR_DUPLICATE_THRESHOLD) -> pd.Series:
+    """
+    The idx of the email that represents each email, indexed by idx.
+    Emails without a near duplicate represent themselves.
+    """
+    texts = [f"{s}\n{b}" for s, b in zip(emails.email_subject, emails.email_body)]
+    positions = near_duplicate_representatives(minhash_signatures(texts), threshold)
+    return pd.Series(emails.idx[positions], index=pd.Index(emails.idx, name='idx'), name='representative')
+
+
+def get_representative_emails(representatives: pd.Series, emails: EmailBatch) -> EmailBatch:
+    "Just the emails that represent a cluster."
+    return emails.take(np.flatnonzero(representatives.index.to_numpy() == representatives.to_numpy()))
+
+
+def fan_out(values: pd.Series, representatives: pd.Series) -> pd.Series:
+    "Give every email the value of its representative. `values` is indexed by the representatives' idx."
+    return pd.Series(
+        values.reindex(representatives.to_numpy()).to_numpy(), 
+        index=representatives.index,
+        name=values.name)
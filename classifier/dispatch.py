@@ -0,0 +1,117 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/10_dispatch.ipynb.
+
+# %% auto 0
+__all__ = ['DEFAULT_CONCURRENCY', 'adispatch', 'dispatch', 'dispatch_batches']
+
+# %% ../nbs/10_dispatch.ipynb 2
+from typing import Any, AsyncIterator, Callable, Iterable, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import queue
+import threading
+
+from .load import get_batches
+
+# %% ../nbs/10_dispatch.ipynb 4
+DEFAULT_CONCURRENCY = 8
+_END = object()
+
+
+async def adispatch(
+        func: Callable[[Any], Any],
+        items: Iterable[Any],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        buffer_size: int = None) -> AsyncIterator[Any]:
+    """
+    Call `func` on every item, with up to `concurrency` calls in flight.
+    `func` can be a coroutine function or a blocking function, which is run in a thread pool.
+    Items are read in a thread of their own, so a slow upstream, like another `dispatch`,
+    doesn't block the calls already in flight, and finished results are yielded as soon as they are next in order.
+    """
+    buffer_size = 2 * concurrency if buffer_size is None else max(buffer_size, concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    reader = ThreadPoolExecutor(max_workers=1)
+    iterator = iter(items)
+
+    async def call(item: Any) -> Any:
+        async with semaphore:
+            if asyncio.iscoroutinefunction(func):
+                return await func(item)
+            return await loop.run_in_executor(executor, func, item)
+
+    pending = deque()
+    try:
+        while True:
+            item = await loop.run_in_executor(reader, next, iterator, _END)
+            if item is _END:
+                break
+            pending.append(asyncio.ensure_future(call(item)))
+            while len(pending) >= buffer_size or (len(pending) > 0 and pending[0].done()):
+                yield await pending.popleft()
+        while len(pending) > 0:
+            yield await pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+        executor.shutdown(wait=False)
+        reader.shutdown(wait=False)
+
+# %% ../nbs/10_dispatch.ipynb 6
+_DONE = object()
+
+
+def dispatch(
+        func: Callable[[Any], Any],
+        items: Iterable[Any],
+        concurrency: int = DEFAULT_CONCURRENCY,
+        buffer_size: int = None) -> Iterable[Any]:
+    "Synchronous, streaming version of `adispatch`."
+    buffer_size = 2 * concurrency if buffer_size is None else buffer_size
+    results = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+
+    def put(result: Any, error: Exception = None):
+        # Give up if the consumer has gone away rather than blocking forever
+        while not stop.is_set():
+            try:
+                results.put((result, error), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        try:
+            async for result in adispatch(func, items, concurrency, buffer_size):
+                if stop.is_set():
+                    break
+                await loop.run_in_executor(None, put, result)
+        except Exception as e:
+            put(None, e)
+        put(_DONE)
+
+    thread = threading.Thread(target=asyncio.run, args=(produce(),), daemon=True)
+    thread.start()
+    try:
+        while True:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            if result is _DONE:
+                return
+            yield result
+    finally:
+        stop.set()
+
+
+def dispatch_batches(
+        func: Callable[[List[Any]], List[Any]],
+        items: Iterable[Any],
+        batch_size: int = 5,
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[List[Any]]:
+    "Split items into batches and `dispatch` them, yielding each batch's results in order."
+    batches = (b for b in get_batches(items, batch_size) if len(b) > 0)
+    return dispatch(func, batches, concurrency=concurrency)
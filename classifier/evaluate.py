@@ -1,13 +1,19 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/05_evaluate.ipynb.
 
 # %% auto 0
-__all__ = ['display_evaluation_row']
+__all__ = ['EVALUATION_COLUMNS', 'OTHER_LABEL', 'LABEL_PUNCTUATION', 'BOOTSTRAP_SAMPLES', 'BOOTSTRAP_CHUNK_SIZE',
+           'CONFIDENCE_LEVEL', 'SUMMARY_METRICS', 'CLASS_METRICS', 'display_evaluation_row', 'read_prediction_columns',
+           'normalize_labels', 'PredictionRuns', 'compare_runs']
 
 # %% ../nbs/05_evaluate.ipynb 2
 from pathlib import Path
+from typing import Dict, List, Mapping, Sequence, Tuple, Union
 from sklearn import metrics
+import fsspec
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 
 # %% ../nbs/05_evaluate.ipynb 8
 def display_evaluation_row(idx: int, row: pd.Series) -> None:
@@ -17,3 +23,203 @@ def display_evaluation_row(idx: int, row: pd.Series) -> None:
     print("| -- PROMPT -- |\n", row.prompt)
     print("| -- PREDICTION -- |\n", row.prediction)
     print()
+
+# %% ../nbs/05_evaluate.ipynb 24
+EVALUATION_COLUMNS = ['prediction', 'label']
+OTHER_LABEL = "<other>"
+LABEL_PUNCTUATION = "\"'`.*"
+BOOTSTRAP_SAMPLES = 1000
+BOOTSTRAP_CHUNK_SIZE = 100
+CONFIDENCE_LEVEL = 0.95
+SUMMARY_METRICS = ['accuracy', 'macro_precision', 'macro_recall', 'macro_f1']
+CLASS_METRICS = ['precision', 'recall', 'f1']
+
+
+def read_prediction_columns(
+        path: Union[str, Path],
+        columns: Sequence[str] = EVALUATION_COLUMNS) -> pd.DataFrame:
+    "Only `columns` of a predictions CSV, locally or on GCS, as strings."
+    with fsspec.open(str(path), 'rb') as f:
+        table = pa_csv.read_csv(
+            f,
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=list(columns),
+                column_types={c: pa.string() for c in columns},
+                strings_can_be_null=True))
+    return table.to_pandas()
+
+
+def _tidy_labels(values: pd.Series) -> Tuple[np.ndarray, pd.Index]:
+    "Codes into the tidied unique values, so each distinct string is only cleaned once."
+    codes, uniques = pd.factorize(values.fillna("").astype(str))
+    tidy = pd.Series(uniques, dtype=object).str.strip().str.strip(LABEL_PUNCTUATION).str.strip() \
+        .str.replace(r"\s+", " ", regex=True)
+    return codes, pd.Index(tidy)
+
+
+def normalize_labels(
+        predictions: pd.Series,
+        labels: Sequence[str]) -> np.ndarray:
+    "Predicted label strings matched to `labels`, ignoring case and stray punctuation; the rest are `OTHER_LABEL`."
+    canonical = {label.casefold(): label for label in labels}
+    codes, tidy = _tidy_labels(pd.Series(predictions))
+    matched = np.array([canonical.get(t.casefold(), OTHER_LABEL) for t in tidy], dtype=object)
+    return matched[codes]
+
+
+def _confusion_metrics(
+        confusion: np.ndarray,
+        present: np.ndarray) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """
+    Summary and per class metrics for confusion matrices of shape (..., labels, labels).
+    Macro averages are over the `present` labels, like sklearn's with `zero_division=0`.
+    """
+    tp = np.diagonal(confusion, axis1=-2, axis2=-1)
+    support = confusion.sum(axis=-1)
+    predicted = confusion.sum(axis=-2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+        accuracy = tp.sum(axis=-1) / support.sum(axis=-1)
+
+        def macro(values: np.ndarray) -> np.ndarray:
+            return (values * present).sum(axis=-1) / present.sum(axis=-1)
+
+        summary = {
+            'accuracy': accuracy,
+            'macro_precision': macro(precision),
+            'macro_recall': macro(recall),
+            'macro_f1': macro(f1)}
+    return summary, {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+class PredictionRuns:
+    "Many runs' predictions and labels, as codes into one shared list of labels."
+    __slots__ = ('names', 'labels', 'run', 'y_true', 'y_pred')
+
+    def __init__(
+            self,
+            names: List[str],
+            labels: List[str],
+            run: np.ndarray,
+            y_true: np.ndarray,
+            y_pred: np.ndarray):
+        self.names = names
+        self.labels = labels
+        self.run = run
+        self.y_true = y_true
+        self.y_pred = y_pred
+
+    @classmethod
+    def from_frames(cls, frames: Mapping[str, pd.DataFrame]) -> 'PredictionRuns':
+        "Runs from frames with prediction and label columns, keyed by run name."
+        names = list(frames)
+        true_labels = [_tidy_labels(frames[n].label) for n in names]
+        labels = sorted(set().union(*[tidy for _, tidy in true_labels]) - {""})
+        y_true = [tidy.to_numpy(dtype=object)[codes] for codes, tidy in true_labels]
+        y_pred = [normalize_labels(frames[n].prediction, labels) for n in names]
+        if any((p == OTHER_LABEL).any() for p in y_pred):
+            labels.append(OTHER_LABEL)
+        codes = pd.Index(labels)
+        return cls(
+            names=names,
+            labels=labels,
+            run=np.repeat(np.arange(len(names)), [len(frames[n]) for n in names]),
+            y_true=codes.get_indexer(np.concatenate(y_true)) if names else np.array([], dtype=np.int64),
+            y_pred=codes.get_indexer(np.concatenate(y_pred)) if names else np.array([], dtype=np.int64))
+
+    @classmethod
+    def from_files(
+            cls,
+            paths: Union[Sequence[Union[str, Path]], Mapping[str, Union[str, Path]]]) -> 'PredictionRuns':
+        "Runs from predictions CSVs, named by their paths unless given as a mapping of names to paths."
+        if not isinstance(paths, Mapping):
+            paths = {str(p): p for p in paths}
+        return cls.from_frames({name: read_prediction_columns(p) for name, p in paths.items()})
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def confusion_matrices(self) -> np.ndarray:
+        "Counts of shape (runs, labels, labels), true labels along the rows."
+        size = len(self.labels)
+        cells = (self.run * size + self.y_true) * size + self.y_pred
+        return np.bincount(cells, minlength=len(self) * size * size).reshape(len(self), size, size)
+
+    def _present(self, confusion: np.ndarray) -> np.ndarray:
+        return (confusion.sum(axis=-1) + confusion.sum(axis=-2)) > 0
+
+    def _bootstrap(
+            self,
+            confusion: np.ndarray,
+            samples: int,
+            seed: int) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        "Metrics of `samples` bootstrap replicates of every run, replicates along the first axis."
+        rng = np.random.default_rng(seed)
+        runs, size, _ = confusion.shape
+        counts = confusion.reshape(runs, size * size)
+        rows = counts.sum(axis=1)
+        probabilities = counts / np.maximum(rows, 1)[:, None]
+        present = self._present(confusion)
+        summaries, classes = [], []
+        for start in range(0, samples, BOOTSTRAP_CHUNK_SIZE):
+            replicates = min(BOOTSTRAP_CHUNK_SIZE, samples - start)
+            resampled = rng.multinomial(rows, probabilities, size=(replicates, runs))
+            summary, per_class = _confusion_metrics(resampled.reshape(replicates, runs, size, size), present)
+            summaries.append(summary)
+            classes.append(per_class)
+        return (
+            {m: np.concatenate([s[m] for s in summaries]) for m in SUMMARY_METRICS},
+            {m: np.concatenate([c[m] for c in classes]) for m in CLASS_METRICS})
+
+    def _with_intervals(
+            self,
+            frame: pd.DataFrame,
+            replicates: Dict[str, np.ndarray],
+            level: float) -> pd.DataFrame:
+        low, high = np.nanquantile(
+            np.stack([replicates[m] for m in replicates]), [(1 - level) / 2, (1 + level) / 2], axis=1)
+        for i, m in enumerate(replicates):
+            frame[f"{m}_low"] = low[i].ravel()
+            frame[f"{m}_high"] = high[i].ravel()
+        return frame
+
+    def summary(
+            self,
+            samples: int = BOOTSTRAP_SAMPLES,
+            level: float = CONFIDENCE_LEVEL,
+            seed: int = 0) -> pd.DataFrame:
+        "Accuracy and macro averages for every run, with bootstrap intervals unless `samples` is 0."
+        confusion = self.confusion_matrices()
+        summary, _ = _confusion_metrics(confusion, self._present(confusion))
+        frame = pd.DataFrame({'emails': confusion.sum(axis=(1, 2)), **summary}, index=pd.Index(self.names, name='run'))
+        if samples == 0:
+            return frame
+        return self._with_intervals(frame, self._bootstrap(confusion, samples, seed)[0], level)
+
+    def class_metrics(
+            self,
+            samples: int = BOOTSTRAP_SAMPLES,
+            level: float = CONFIDENCE_LEVEL,
+            seed: int = 0) -> pd.DataFrame:
+        "Precision, recall and F1 of every label in every run, with bootstrap intervals unless `samples` is 0."
+        confusion = self.confusion_matrices()
+        _, per_class = _confusion_metrics(confusion, self._present(confusion))
+        frame = pd.DataFrame(
+            {'support': confusion.sum(axis=2).ravel(), **{m: v.ravel() for m, v in per_class.items()}},
+            index=pd.MultiIndex.from_product([self.names, self.labels], names=['run', 'label']))
+        if samples > 0:
+            replicates = self._bootstrap(confusion, samples, seed)[1]
+            frame = self._with_intervals(
+                frame, {m: v.reshape(samples, -1) for m, v in replicates.items()}, level)
+        return frame[frame.support > 0]
+
+
+def compare_runs(
+        paths: Union[Sequence[Union[str, Path]], Mapping[str, Union[str, Path]]],
+        samples: int = BOOTSTRAP_SAMPLES,
+        level: float = CONFIDENCE_LEVEL) -> pd.DataFrame:
+    "`PredictionRuns.summary` for predictions CSVs, best macro F1 first."
+    return PredictionRuns.from_files(paths).summary(samples, level).sort_values('macro_f1', ascending=False)
@@ -2,9 +2,9 @@
 
 # %% auto 0
 __all__ = ['EXPERIMENT_PREFIX', 'EXPERIMENT_WRITE_PREFIX', 'TOP_3_PROMPT_TEMPLATE', 'TOP_3_PROMPT', 'PREDICTION_TEMPLATE',
-           'PREDICTION_PROMPT', 'FINAL_REGEX', 'make_categories_str', 'get_llm', 'format_category_answer', 'fix_string',
+           'PREDICTION_PROMPT', 'FINAL_REGEX', 'make_categories_str', 'format_category_answer', 'fix_string',
            'get_top_3_chain', 'get_label_filtered_documents', 'get_prediction_chain', 'format_filtered_examples',
-           'format_final_category_string', 'invoke_chain', 'get_summary_prediction']
+           'format_final_category_string', 'invoke_chain', 'get_summary_prediction', 'get_summary_predictions']
 
 # %% ../../nbs/experiments/08_10k_retrieval_filtering.ipynb 2
 from typing import Dict, List, Any, Tuple
@@ -25,11 +25,13 @@ from langchain.vectorstores import Chroma
 from langchain.document_loaders import DataFrameLoader
 from langchain.output_parsers import CommaSeparatedListOutputParser, RegexParser
 
-from ..schema import WRITE_PREFIX, PROJECT_BUCKET, quota_handler
+from ..schema import WRITE_PREFIX, PROJECT_BUCKET, quota_handler, get_llm
 from ..load import Email, get_batches, get_emails_from_frame, \
     get_raw_emails, email_small_enough
-from ..chroma import get_or_make_chroma
+from ..chroma import get_or_make_chroma, get_or_make_vector_store, VectorStore, \
+    similarity_search_per_label, similarity_search_per_label_batch
 from ..predict import write_predictions
+from ..cache import batch_through_cache
 from classifier.experiments.split_processing import \
     format_email_for_train_summary, \
     format_email_for_test_summary, \
@@ -76,16 +78,6 @@ Your response should be a list of comma separated values.
 TOP_3_PROMPT = PromptTemplate.from_template(TOP_3_PROMPT_TEMPLATE)
 
 # %% ../../nbs/experiments/08_10k_retrieval_filtering.ipynb 43
-_LLM = None
-
-
-def get_llm() -> VertexAI:
-    global _LLM
-    if _LLM is None:
-        _LLM = VertexAI()
-    return _LLM
-
-
 def format_category_answer(answer: List[str]):
     return [s.replace("||","") for s in answer]
 
@@ -101,18 +93,10 @@ def get_top_3_chain() -> RunnableSequence:
 def get_label_filtered_documents(
         query: str,
         labels: List[str],
-        chroma: Chroma,
+        chroma: VectorStore,
         k: int = 3
         ) -> Dict[str, List[Document]]:
-    documents = {}
-    for l in labels:
-        label_documents = chroma.similarity_search(
-            query,
-            filter={'label': l},
-            k=k
-        )
-        documents[l] = label_documents
-    return documents
+    return similarity_search_per_label(chroma, query, labels, k)
 
 # %% ../../nbs/experiments/08_10k_retrieval_filtering.ipynb 52
 # categories is a list like;
@@ -172,13 +156,44 @@ def format_final_category_string(categories: List[str]) -> str:
 
 # %% ../../nbs/experiments/08_10k_retrieval_filtering.ipynb 59
 @quota_handler
-def invoke_chain(chain: RunnableSequence, *args, **kwargs) -> Any:
-    return chain.invoke(*args, **kwargs)
+def _invoke_chain(chain: RunnableSequence, input: Any, **kwargs) -> Any:
+    return chain.invoke(input, **kwargs)
+
+
+def invoke_chain(chain: RunnableSequence, input: Any, **kwargs) -> Any:
+    "Invoke `chain`, answering from the response cache without waiting on the rate limiter when possible."
+    return batch_through_cache(
+        chain, [input], lambda inputs: [_invoke_chain(chain, inputs[0], **kwargs)])[0]
 
 # %% ../../nbs/experiments/08_10k_retrieval_filtering.ipynb 60
+def _get_step_2_prediction(
+        summary: str,
+        step_1_answer: List[str],
+        similar_documents: Dict[str, List[Document]],
+        step_2_chain: RunnableSequence) -> Tuple[List[str], List[Document], int, str]:
+    final_answer = None
+    step_2_answer = invoke_chain(
+        step_2_chain,
+        {
+            'categories': format_final_category_string(step_1_answer),
+            'examples': format_filtered_examples(similar_documents),
+            'email': summary
+        })
+    step_1_answer_position = int(step_2_answer.get('result'))
+    if step_1_answer_position > len(step_1_answer):
+        return step_1_answer, similar_documents, step_1_answer_position, final_answer
+    try:
+        final_answer = step_1_answer[step_1_answer_position].strip()
+    except IndexError as e:
+        print("Position was ", step_1_answer_position)
+        print("List was ", step_1_answer)
+        raise e
+    return step_1_answer, similar_documents, step_1_answer_position, final_answer
+
+
 def get_summary_prediction(
         summary: str, 
-        chroma: Chroma, 
+        chroma: VectorStore, 
         step_1_chain: RunnableSequence,
         step_2_chain: RunnableSequence,
         descriptions: Dict[str, str]) -> Tuple[List[str], List[Document], int, str]:
@@ -206,20 +221,34 @@ def get_summary_prediction(
         labels=step_1_answer,
         chroma=chroma
     )
-    step_2_answer = invoke_chain(
-        step_2_chain,
-        {
-            'categories': format_final_category_string(step_1_answer),
-            'examples': format_filtered_examples(similar_documents),
-            'email': summary
-        })
-    step_1_answer_position = int(step_2_answer.get('result'))
-    if step_1_answer_position > len(step_1_answer):
-        return step_1_answer, similar_documents, step_1_answer_position, final_answer
-    try:
-        final_answer = step_1_answer[step_1_answer_position].strip()
-    except IndexError as e:
-        print("Position was ", step_1_answer_position)
-        print("List was ", step_1_answer)
-        raise e
-    return step_1_answer, similar_documents, step_1_answer_position, final_answer
+    return _get_step_2_prediction(summary, step_1_answer, similar_documents, step_2_chain)
+
+
+def get_summary_predictions(
+        summaries: List[str],
+        chroma: VectorStore,
+        step_1_chain: RunnableSequence,
+        step_2_chain: RunnableSequence,
+        descriptions: Dict[str, str]) -> List[Tuple[List[str], List[Document], int, str]]:
+    """
+    `get_summary_prediction` for many summaries.
+    Examples for every summary are retrieved together once all the step one answers are in.
+    """
+    categories_str = make_categories_str(descriptions)
+    step_1_answers = [
+        None if s is None else invoke_chain(step_1_chain, {'categories': categories_str, 'email': s})
+        for s in summaries]
+    # Only well formed step one answers go on to step two
+    retrieve = [i for i, a in enumerate(step_1_answers) if a is not None and len(a) == 3]
+    similar_documents = dict(zip(retrieve, similarity_search_per_label_batch(
+        chroma,
+        [summaries[i] for i in retrieve],
+        [step_1_answers[i] for i in retrieve])))
+    predictions = []
+    for i, (summary, step_1_answer) in enumerate(zip(summaries, step_1_answers)):
+        if i not in similar_documents:
+            predictions.append((step_1_answer, None, None, None))
+            continue
+        predictions.append(
+            _get_step_2_prediction(summary, step_1_answer, similar_documents[i], step_2_chain))
+    return predictions
@@ -3,10 +3,11 @@
 # %% auto 0
 __all__ = ['TEJAS_PREFIX', 'TRAIN_PROMPT_TEMPLATE', 'TRAIN_PROMPT', 'TEST_PROMPT_TEMPLATE', 'TEST_PROMPT',
            'make_description_from_row', 'format_email_for_train_summary', 'format_email_for_test_summary',
-           'batch_predict']
+           'batch_predict', 'get_batch_predictions']
 
 # %% ../../nbs/experiments/07_split_processing.ipynb 2
-from typing import Dict, List
+from typing import Dict, List, Iterable
+from functools import partial
 from pathlib import Path
 import numpy as np
 import pandas as pd
@@ -24,6 +25,7 @@ from ..load import Email, get_batches, get_idx, get_emails_from_frame, \
     get_raw_emails_tejas_case_numbers, get_possible_labels, PROJECT_BUCKET
 from ..chroma import get_or_make_chroma
 from ..predict import make_prediction_prompt, get_predictions, write_predictions
+from ..dispatch import dispatch_batches, DEFAULT_CONCURRENCY
 
 # %% ../../nbs/experiments/07_split_processing.ipynb 5
 TEJAS_PREFIX = f"{WRITE_PREFIX}/tejas"
@@ -90,3 +92,12 @@ def format_email_for_test_summary(
 @quota_handler
 def batch_predict(prompts: List[Dict[str, str]], chain: RunnableSequence) -> List[str]:
     return chain.batch(prompts)
+
+
+def get_batch_predictions(
+        prompts: Iterable[Dict[str, str]],
+        chain: RunnableSequence,
+        batch_size: int = 5,
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[List[str]]:
+    "Stream `batch_predict` results for every batch of prompts, in order."
+    return dispatch_batches(partial(batch_predict, chain=chain), prompts, batch_size, concurrency)
@@ -1,29 +1,122 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/01_load.ipynb.
 
 # %% auto 0
-__all__ = ['RAW_EMAILS_FILE', 'TEJAS_FILE', 'LABEL_COLUMN', 'EMAIL_SIZE_LIMIT', 'INCLUSION_COUNT', 'TRAIN_IDX_NAME',
-           'TEST_IDX_NAME', 'get_raw_emails', 'process_raw_emails', 'get_possible_labels', 'get_tejas_case_numbers',
-           'get_raw_emails_tejas_case_numbers', 'Email', 'email_from_row', 'email_small_enough', 'get_train_test_idx',
-           'write_idx', 'get_idx', 'get_emails_from_frame', 'get_batches']
+__all__ = ['RAW_EMAILS_FILE', 'TEJAS_FILE', 'SNAPSHOT_DIR', 'SNAPSHOT_CHECK_SECONDS', 'LABEL_COLUMN', 'EMAIL_COLUMNS',
+           'EMAIL_SIZE_LIMIT', 'INCLUSION_COUNT', 'TRAIN_IDX_NAME', 'TEST_IDX_NAME', 'get_blob_version',
+           'write_snapshot', 'read_snapshot', 'get_snapshot_path', 'get_raw_emails', 'process_raw_emails',
+           'get_possible_labels', 'get_tejas_case_numbers', 'get_raw_emails_tejas_case_numbers', 'Email',
+           'email_from_row', 'EmailBatch', 'email_small_enough', 'get_train_test_idx', 'write_idx', 'get_idx',
+           'select_emails', 'get_email_batch_from_frame', 'get_emails_from_frame', 'get_batches']
 
 # %% ../nbs/01_load.ipynb 2
-from typing import Dict, Any, Iterable, List, Tuple
+from typing import Dict, Any, Iterable, List, Tuple, Callable
+from pathlib import Path
+import time
+import numpy as np
 import pandas as pd
 
 from pydantic import BaseModel
 from sklearn.model_selection import train_test_split
 
-from .schema import PROJECT_BUCKET, WRITE_PREFIX
+from .schema import PROJECT_BUCKET, WRITE_PREFIX, get_storage_client
+from .cache import CACHE_DIR
 
 # %% ../nbs/01_load.ipynb 4
 RAW_EMAILS_FILE = "Last50KCases_withSubjectAndBody.xlsx"
 TEJAS_FILE = "train_test_split/pd_3k_cases_cleaned.csv"
 
 # %% ../nbs/01_load.ipynb 6
-def get_raw_emails(**read_excel_kwargs) -> pd.DataFrame:
-    return pd.read_excel(f'gs://{PROJECT_BUCKET}/{RAW_EMAILS_FILE}', **read_excel_kwargs)
+SNAPSHOT_DIR = CACHE_DIR / "snapshots"
+# How long to trust a snapshot before checking the workbook in GCS for changes again
+SNAPSHOT_CHECK_SECONDS = 300
+_SNAPSHOT_PATHS: Dict[str, Tuple[float, Path]] = {}
 
-# %% ../nbs/01_load.ipynb 7
+
+def get_blob_version(
+        blob_name: str,
+        bucket_name: str = PROJECT_BUCKET) -> str:
+    "Changes whenever the blob is overwritten."
+    blob = get_storage_client().bucket(bucket_name).get_blob(blob_name)
+    if blob is None:
+        raise FileNotFoundError(f"gs://{bucket_name}/{blob_name}")
+    return str(blob.generation or blob.etag)
+
+
+def _make_arrow_friendly(data: pd.DataFrame) -> pd.DataFrame:
+    "Excel columns can mix numbers and text, which parquet can't store in one column."
+    data = data.copy()
+    for column in data.columns[data.dtypes == object]:
+        if pd.api.types.infer_dtype(data[column], skipna=True) not in ('string', 'empty'):
+            data.loc[:, column] = data[column].where(data[column].isna(), data[column].astype(str))
+    return data
+
+
+def write_snapshot(data: pd.DataFrame, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp")
+    # Keep the index, it's how we refer to emails everywhere else
+    _make_arrow_friendly(data).to_parquet(temporary_path, index=True)
+    temporary_path.replace(path)
+
+
+def read_snapshot(
+        path: Path,
+        columns: List[str] = None,
+        case_numbers: Iterable[Any] = None) -> pd.DataFrame:
+    "Read only the columns and cases asked for."
+    filters = None
+    if case_numbers is not None:
+        case_numbers = list(case_numbers)
+        if len(case_numbers) == 0:
+            return pd.read_parquet(path, columns=columns).iloc[:0]
+        filters = [('case_number', 'in', case_numbers)]
+    return pd.read_parquet(path, columns=columns, filters=filters)
+
+
+def get_snapshot_path(
+        blob_name: str,
+        bucket_name: str = PROJECT_BUCKET,
+        snapshot_dir: Path = SNAPSHOT_DIR) -> Path:
+    """
+    Path to a local parquet copy of an excel or csv blob, made on first use.
+    Rebuilt when the blob's generation changes.
+    """
+    key = f"{bucket_name}/{blob_name}"
+    checked = _SNAPSHOT_PATHS.get(key)
+    if checked is not None and time.time() - checked[0] < SNAPSHOT_CHECK_SECONDS and checked[1].exists():
+        return checked[1]
+    stem = Path(blob_name).stem
+    path = Path(snapshot_dir) / f"{stem}-{get_blob_version(blob_name, bucket_name)}.parquet"
+    if not path.exists():
+        uri = f'gs://{bucket_name}/{blob_name}'
+        data = pd.read_csv(uri) if blob_name.endswith(".csv") else pd.read_excel(uri)
+        write_snapshot(data, path)
+        for stale in Path(snapshot_dir).glob(f"{stem}-*.parquet"):
+            if stale != path:
+                stale.unlink()
+    _SNAPSHOT_PATHS[key] = (time.time(), path)
+    return path
+
+
+def get_raw_emails(
+        columns: List[str] = None,
+        case_numbers: Iterable[Any] = None,
+        use_snapshot: bool = True,
+        **read_excel_kwargs) -> pd.DataFrame:
+    """
+    Load the raw emails workbook, optionally only some `columns` and `case_numbers`.
+    Reads from a local snapshot unless `use_snapshot` is False or excel arguments are passed.
+    """
+    if use_snapshot and len(read_excel_kwargs) == 0:
+        return read_snapshot(get_snapshot_path(RAW_EMAILS_FILE), columns, case_numbers)
+    if columns is not None:
+        read_excel_kwargs['usecols'] = columns
+    emails = pd.read_excel(f'gs://{PROJECT_BUCKET}/{RAW_EMAILS_FILE}', **read_excel_kwargs)
+    if case_numbers is not None:
+        emails = emails[emails.case_number.isin(list(case_numbers))]
+    return emails
+
+# %% ../nbs/01_load.ipynb 8
 LABEL_COLUMN = "sfdc_category"
 
 def process_raw_emails(emails: pd.DataFrame) -> pd.DataFrame:
@@ -32,23 +125,20 @@ def process_raw_emails(emails: pd.DataFrame) -> pd.DataFrame:
     emails.loc[:, 'email_body'] = emails.email_body.fillna("N/A").astype(str)
     return emails
 
-# %% ../nbs/01_load.ipynb 9
+# %% ../nbs/01_load.ipynb 10
 def get_possible_labels() -> List[str]:
-    labels = get_raw_emails(usecols=[LABEL_COLUMN])
+    labels = get_raw_emails(columns=[LABEL_COLUMN])
     return labels[LABEL_COLUMN].unique().tolist()
 
-# %% ../nbs/01_load.ipynb 13
+# %% ../nbs/01_load.ipynb 14
 def get_tejas_case_numbers() -> pd.Series:
     return pd.read_csv(f'gs://{PROJECT_BUCKET}/{TEJAS_FILE}', usecols=['case_number']).case_number
 
-# %% ../nbs/01_load.ipynb 17
+# %% ../nbs/01_load.ipynb 18
 def get_raw_emails_tejas_case_numbers() -> pd.DataFrame:
-    raw_emails = get_raw_emails()
-    tejas_case_numbers = get_tejas_case_numbers().tolist()
-    raw_emails = raw_emails[raw_emails.case_number.isin(tejas_case_numbers)]
-    return raw_emails
+    return get_raw_emails(case_numbers=get_tejas_case_numbers().tolist())
 
-# %% ../nbs/01_load.ipynb 21
+# %% ../nbs/01_load.ipynb 22
 class Email(BaseModel):
     idx: int
     label: str
@@ -84,18 +174,133 @@ def email_from_row(
     )
 
 # %% ../nbs/01_load.ipynb 25
+EMAIL_COLUMNS = ['email_subject', 'email_body']
+# pydantic 2 renamed construct, which skips validation
+_construct_email = getattr(Email, 'model_construct', Email.construct)
+
+
+def _check_text_column(data: pd.DataFrame, column: str) -> None:
+    "Raise if any value of `column` is missing or not a string, inferring the column's type in one pass."
+    values = data[column]
+    if len(values) > 0 and pd.api.types.infer_dtype(values, skipna=False) != 'string':
+        bad = values[~values.map(lambda v: isinstance(v, str))]
+        raise ValueError(f"Every email's {column} must be a string, but idx {bad.index[0]} has {bad.iloc[0]!r}")
+
+
+class EmailBatch:
+    "Column-oriented emails; arrays of idx, label, subject and body plus a frame of metadata."
+    __slots__ = ('idx', 'label', 'email_subject', 'email_body', 'metadata')
+
+    def __init__(
+            self,
+            idx: np.ndarray,
+            label: np.ndarray,
+            email_subject: np.ndarray,
+            email_body: np.ndarray,
+            metadata: pd.DataFrame):
+        self.idx = idx
+        self.label = label
+        self.email_subject = email_subject
+        self.email_body = email_body
+        self.metadata = metadata
+
+    @classmethod
+    def from_frame(
+            cls,
+            data: pd.DataFrame,
+            label_column: str = LABEL_COLUMN) -> 'EmailBatch':
+        """
+        The frame's index is used as each email's idx.
+        Raises a `ValueError` if a label, subject or body is missing or isn't a string.
+        """
+        for column in [label_column] + EMAIL_COLUMNS:
+            _check_text_column(data, column)
+        return cls(
+            idx=np.asarray(data.index, dtype=np.int64),
+            label=data[label_column].to_numpy(dtype=object),
+            email_subject=data.email_subject.to_numpy(dtype=object),
+            email_body=data.email_body.to_numpy(dtype=object),
+            metadata=data.drop([label_column] + EMAIL_COLUMNS, axis=1).reset_index(drop=True))
+
+    @classmethod
+    def from_emails(cls, emails: Iterable[Email]) -> 'EmailBatch':
+        emails = list(emails)
+        return cls(
+            idx=np.array([e.idx for e in emails], dtype=np.int64),
+            label=np.array([e.label for e in emails], dtype=object),
+            email_subject=np.array([e.email_subject for e in emails], dtype=object),
+            email_body=np.array([e.email_body for e in emails], dtype=object),
+            metadata=pd.DataFrame.from_records([e.metadata for e in emails]))
+
+    def __len__(self) -> int:
+        return len(self.idx)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return EmailBatch(
+                self.idx[key],
+                self.label[key],
+                self.email_subject[key],
+                self.email_body[key],
+                self.metadata.iloc[key].reset_index(drop=True))
+        key = range(len(self))[key]
+        return next(iter(self[key:key + 1]))
+
+    def take(self, positions: np.ndarray) -> 'EmailBatch':
+        "The emails at `positions`, in that order."
+        positions = np.asarray(positions, dtype=np.int64)
+        return EmailBatch(
+            self.idx[positions],
+            self.label[positions],
+            self.email_subject[positions],
+            self.email_body[positions],
+            self.metadata.iloc[positions].reset_index(drop=True))
+
+    def __iter__(self) -> Iterable[Email]:
+        records = self.metadata.to_dict('records') if self.metadata.shape[1] > 0 else [{} for _ in range(len(self))]
+        for idx, label, subject, body, metadata in zip(
+                self.idx.tolist(), self.label, self.email_subject, self.email_body, records):
+            yield _construct_email(
+                idx=idx,
+                label=label,
+                email_subject=subject,
+                email_body=body,
+                metadata=metadata)
+
+    def batches(self, batch_size: int = 32) -> Iterable['EmailBatch']:
+        for start in range(0, len(self), batch_size):
+            yield self[start:start + batch_size]
+
+    def to_frame(self) -> pd.DataFrame:
+        "The same columns `Email.to_series` gives, for every email at once."
+        data = self.metadata.copy()
+        data.loc[:, 'idx'] = self.idx
+        data.loc[:, 'label'] = self.label
+        data.loc[:, 'email_subject'] = self.email_subject
+        data.loc[:, 'email_body'] = self.email_body
+        return data
+
+# %% ../nbs/01_load.ipynb 30
 # Our prompt to summarize takes up some amount of prompt space. This is a rough limit
 EMAIL_SIZE_LIMIT = 7800
 
 
-def email_small_enough(subject: str, body: str, limit: int = EMAIL_SIZE_LIMIT) -> bool:
+def email_small_enough(
+        subject: str,
+        body: str,
+        limit: int = EMAIL_SIZE_LIMIT,
+        count: Callable[[str], int] = len) -> bool:
+    """
+    Whether an email's subject and body together are under `limit`.
+    Sizes are in characters, or in tokens when `count` is `tokens.count_tokens`.
+    """
     if not isinstance(subject, str):
         subject = str(subject)
     if not isinstance(body, str):
         body = str(body)
-    return (len(subject) + len(body)) < limit
+    return (count(subject) + count(body)) < limit
 
-# %% ../nbs/01_load.ipynb 30
+# %% ../nbs/01_load.ipynb 36
 INCLUSION_COUNT = 3000
 
 
@@ -122,7 +327,7 @@ def get_train_test_idx(
         stratify=input_data[label_column]
     )
 
-# %% ../nbs/01_load.ipynb 34
+# %% ../nbs/01_load.ipynb 40
 TRAIN_IDX_NAME = "train_idx.csv"
 TEST_IDX_NAME = "test_idx.csv"
 
@@ -136,39 +341,62 @@ def write_idx(
     train_idx.to_series().to_csv(f"gs://{bucket_name}/{prefix}/{TRAIN_IDX_NAME}", index=False)
     test_idx.to_series().to_csv(f"gs://{bucket_name}/{prefix}/{TEST_IDX_NAME}", index=False)
 
-# %% ../nbs/01_load.ipynb 36
+# %% ../nbs/01_load.ipynb 42
 def get_idx(
         bucket_name: str = PROJECT_BUCKET,
         prefix: str = WRITE_PREFIX) -> Tuple[pd.Series, pd.Series]:
     return pd.read_csv(f'gs://{bucket_name}/{prefix}/{TRAIN_IDX_NAME}').iloc[:, 0], \
         pd.read_csv(f'gs://{bucket_name}/{prefix}/{TEST_IDX_NAME}').iloc[:, 0]
 
-# %% ../nbs/01_load.ipynb 39
-def get_emails_from_frame(
+# %% ../nbs/01_load.ipynb 45
+def select_emails(
         data: pd.DataFrame,
         which: str = 'both',
         bucket_name: str = PROJECT_BUCKET,
-        index_prefix: str = WRITE_PREFIX,
-        label_column: str = LABEL_COLUMN
-) -> Iterable[Email]:
-    """
-    Pass a raw dataframe
-    """
+        index_prefix: str = WRITE_PREFIX) -> pd.DataFrame:
+    "Rows of `data` in the train, test or both splits."
     if which not in ['train', 'test', 'both']:
         raise ValueError("which must be one of 'train', 'test', 'both'")
     # Load train and test idx
     train_idx, test_idx = get_idx(bucket_name=bucket_name, prefix=index_prefix)
     full_idx = pd.concat([train_idx, test_idx], axis=0, ignore_index=True)
     if which == 'train':
-        data = data.loc[train_idx, :]
+        return data.loc[train_idx, :]
     elif which == 'test':
-        data = data.loc[test_idx, :]
+        return data.loc[test_idx, :]
     else:  # Both
-        data = data.loc[full_idx, :]
-    for idx, row in data.iterrows():
-        yield email_from_row(idx, row, label_column=label_column)
+        return data.loc[full_idx, :]
+
+
+def get_email_batch_from_frame(
+        data: pd.DataFrame,
+        which: str = 'both',
+        bucket_name: str = PROJECT_BUCKET,
+        index_prefix: str = WRITE_PREFIX,
+        label_column: str = LABEL_COLUMN
+) -> EmailBatch:
+    data = select_emails(data, which, bucket_name=bucket_name, index_prefix=index_prefix)
+    return EmailBatch.from_frame(data, label_column=label_column)
+
+
+def get_emails_from_frame(
+        data: pd.DataFrame,
+        which: str = 'both',
+        bucket_name: str = PROJECT_BUCKET,
+        index_prefix: str = WRITE_PREFIX,
+        label_column: str = LABEL_COLUMN
+) -> Iterable[Email]:
+    """
+    Pass a raw dataframe
+    """
+    yield from get_email_batch_from_frame(
+        data,
+        which,
+        bucket_name=bucket_name,
+        index_prefix=index_prefix,
+        label_column=label_column)
 
-# %% ../nbs/01_load.ipynb 41
+# %% ../nbs/01_load.ipynb 47
 def get_batches(loader: Iterable[Any], batch_size: int = 32) -> Iterable[List[Any]]:
     "Get a batch of anything from an iterable."
     batch = []
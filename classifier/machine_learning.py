@@ -1,24 +1,127 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/06_machine_learning.ipynb.
 
 # %% auto 0
-__all__ = []
+__all__ = ['MODEL_FILE_NAME', 'LABELS_FILE_NAME', 'DEFAULT_XGB_PARAMS', 'DEFAULT_NUM_ROUNDS', 'EmbeddingClassifier',
+           'get_labeled_embeddings', 'train_embedding_classifier', 'classify_idx', 'embed_summaries']
 
 # %% ../nbs/06_machine_learning.ipynb 3
-import xgboost
+from typing import List, Sequence, Tuple
 from pathlib import Path
+import json
+
+import xgboost
 import numpy as np
 import pandas as pd
-import json
 from langchain.document_loaders import DataFrameLoader
+from langchain.embeddings.base import Embeddings
 from langchain.schema import Document
 from tqdm import tqdm
-from google.cloud import storage
 from sklearn.preprocessing import LabelEncoder
 from sklearn import metrics
 from sklearn.utils import class_weight
-from matplotlib import pyplot as plt
 
 from .schema import get_storage_client
 from .load import PROJECT_BUCKET, WRITE_PREFIX, \
-    get_training_instances, get_idx
-from .chroma import read_json_lines_from_gcs, get_embedder, get_document_batches
+    get_emails_from_frame, get_raw_emails, get_idx, get_batches
+from .chroma import read_json_lines_from_gcs, get_embedder, \
+    NumpyVectorStore, VectorStore, normalize_embeddings, embed_queries, QUERY_EMBEDDING_BATCH_SIZE
+from .cache import get_cached_embedder
+
+# %% ../nbs/06_machine_learning.ipynb 50
+MODEL_FILE_NAME = "model.json"
+LABELS_FILE_NAME = "labels.json"
+DEFAULT_XGB_PARAMS = {
+    "objective": "multi:softprob",
+    "max_depth": 4,
+    "eta": 0.3,
+    "tree_method": "hist",
+}
+DEFAULT_NUM_ROUNDS = 100
+
+
+class EmbeddingClassifier:
+    "A class weighted gradient boosted classifier over summary embeddings."
+    def __init__(
+            self,
+            booster: xgboost.Booster,
+            labels: List[str]):
+        self.booster = booster
+        self.labels = np.asarray(labels, dtype=object)
+
+    @classmethod
+    def fit(
+            cls,
+            embeddings: np.ndarray,
+            labels: Sequence[str],
+            params: dict = None,
+            num_rounds: int = DEFAULT_NUM_ROUNDS) -> 'EmbeddingClassifier':
+        encoder = LabelEncoder().fit(labels)
+        y = encoder.transform(labels)
+        d_train = xgboost.DMatrix(
+            np.asarray(embeddings, dtype=np.float32),
+            y,
+            weight=class_weight.compute_sample_weight('balanced', y))
+        params = {**DEFAULT_XGB_PARAMS, **(params or {}), 'num_class': len(encoder.classes_)}
+        return cls(xgboost.train(params, d_train, num_boost_round=num_rounds), encoder.classes_.tolist())
+
+    def predict_proba(self, embeddings: np.ndarray) -> np.ndarray:
+        "The probability of every label, one row per embedding, columns in the order of `labels`."
+        return self.booster.inplace_predict(np.asarray(embeddings, dtype=np.float32)).reshape(len(embeddings), -1)
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        return self.labels[self.predict_proba(embeddings).argmax(axis=1)]
+
+    def save(self, directory: Path) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.booster.save_model(directory / MODEL_FILE_NAME)
+        (directory / LABELS_FILE_NAME).write_text(json.dumps(self.labels.tolist()))
+
+    @classmethod
+    def load(cls, directory: Path) -> 'EmbeddingClassifier':
+        directory = Path(directory)
+        booster = xgboost.Booster()
+        booster.load_model(directory / MODEL_FILE_NAME)
+        return cls(booster, json.loads((directory / LABELS_FILE_NAME).read_text()))
+
+# %% ../nbs/06_machine_learning.ipynb 52
+def get_labeled_embeddings(
+        store: VectorStore,
+        idx: Sequence[int] = None) -> Tuple[np.ndarray, pd.DataFrame]:
+    "The store's embeddings and metadata (I.E. idx and label), only for `idx` and in its order when given."
+    if not isinstance(store, NumpyVectorStore):
+        store = NumpyVectorStore.from_chroma(store)
+    if idx is None:
+        return store.embeddings, store.metadata
+    positions = pd.Series(np.arange(len(store.metadata)), index=store.metadata.idx.astype(int))
+    positions = positions.reindex(np.asarray(idx, dtype=int)).dropna().astype(int).to_numpy()
+    return store.embeddings[positions], store.metadata.iloc[positions].reset_index(drop=True)
+
+
+def train_embedding_classifier(
+        store: VectorStore,
+        train_idx: Sequence[int],
+        params: dict = None,
+        num_rounds: int = DEFAULT_NUM_ROUNDS) -> EmbeddingClassifier:
+    embeddings, metadata = get_labeled_embeddings(store, train_idx)
+    return EmbeddingClassifier.fit(embeddings, metadata.label.to_numpy(), params, num_rounds)
+
+
+def classify_idx(
+        classifier: EmbeddingClassifier,
+        store: VectorStore,
+        idx: Sequence[int]) -> pd.DataFrame:
+    "Predictions for the stored emails in `idx`, with the prediction, label and idx columns of a predictions file."
+    embeddings, metadata = get_labeled_embeddings(store, idx)
+    return pd.DataFrame({
+        'prediction': classifier.predict(embeddings),
+        'label': metadata.label.to_numpy(),
+        'idx': metadata.idx.to_numpy()})
+
+
+def embed_summaries(
+        summaries: List[str],
+        embedder: Embeddings = None,
+        batch_size: int = QUERY_EMBEDDING_BATCH_SIZE) -> np.ndarray:
+    embedder = get_cached_embedder() if embedder is None else embedder
+    return normalize_embeddings(embed_queries(embedder, summaries, batch_size))
@@ -1,15 +1,32 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/04_predict.ipynb.
 
 # %% auto 0
-__all__ = ['EMAIL_LABEL_SEP', 'LABEL_STR', 'PREDICTION_PROMPT_TEMPLATE', 'PREDICTION_PROMPT', 'filter_examples', 'format_example',
-           'make_prediction_prompt', 'predict_batch', 'get_predictions', 'write_predictions']
+__all__ = ['EMAIL_LABEL_SEP', 'LABEL_STR', 'PREDICTION_PROMPT_TEMPLATE', 'PREDICTION_PROMPT', 'TYPICAL_EXAMPLE_TOKENS',
+           'PREDICTION_COLUMNS', 'PREDICTION_FLUSH_ROWS', 'PREDICTION_CHECKPOINT_SUFFIX', 'CASCADE_THRESHOLD',
+           'CASCADE_NEIGHBORS', 'PREDICTION_SHARD_SIZE', 'PROMPT_SHARD_NAME', 'METADATA_SHARD_NAME',
+           'BATCH_RESULT_DIR_NAME', 'PIPELINE_BATCH_SIZE', 'RETRIEVAL_BATCH_SIZE', 'RETRIEVAL_CONCURRENCY',
+           'filter_examples', 'format_example', 'get_prediction_token_budget', 'get_max_retrieval_k', 'get_retrieval_k',
+           'make_prediction_prompt', 'make_prediction_prompts', 'predict_batch', 'predict_prompts',
+           'stream_predictions', 'get_predictions', 'read_completed_idx', 'write_prediction_rows', 'write_predictions',
+           'predict_and_write', 'vote_label', 'cascade_predictions', 'cascade_report', 'vote_threshold_table',
+           'write_prediction_shards', 'VertexBatchRunner', 'LocalBatchRunner', 'collect_batch_predictions',
+           'run_batch_predictions', 'format_email', 'stream_batches', 'summarize_stream', 'prompt_stream',
+           'prediction_stream', 'run_prediction_pipeline']
 
 # %% ../nbs/04_predict.ipynb 2
 from pathlib import Path
+import csv
+import io
 import json
-from typing import List, Tuple
+import os
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Set, Tuple, Union
+from functools import partial
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
 import time
+import fsspec
 from tqdm import tqdm
+import numpy as np
 import pandas as pd
 
 import chromadb
@@ -18,13 +35,23 @@ from langchain.prompts import PromptTemplate
 from langchain.vectorstores import Chroma
 from langchain.document_loaders import DataFrameLoader
 from langchain.llms import VertexAI
+from langchain.schema.runnable import RunnableSequence
 
-from .schema import predict, quota_handler, WRITE_PREFIX, PROJECT_BUCKET
+from google.cloud.aiplatform import BatchPredictionJob
+from google.cloud.aiplatform.compat.types import job_state as gca_job_state
+
+from .schema import predict, batch_predict, quota_handler, WRITE_PREFIX, PROJECT_BUCKET, \
+    DEFAULT_PREDICT_PARAMS, get_llm
 from .load import get_possible_labels, get_emails_from_frame, get_idx, LABEL_COLUMN, \
-    get_raw_emails_tejas_case_numbers, get_batches
-from .process import BISON_MAXIMUM_INPUT_TOKENS
-from .chroma import get_or_make_chroma, get_embedder, \
-    read_json_lines_from_gcs
+    get_raw_emails_tejas_case_numbers, get_batches, Email
+from .process import BISON_MAXIMUM_INPUT_TOKENS, email_to_document, \
+    get_documents_summaries, get_summary_chain
+from .chroma import get_or_make_chroma, get_or_make_vector_store, get_embedder, \
+    read_json_lines_from_gcs, NumpyVectorStore, VectorStore, similarity_search_batch, \
+    similarity_search_batch_with_score, get_collection_size
+from .dispatch import dispatch_batches, DEFAULT_CONCURRENCY
+from .cache import hash_text
+from .tokens import count_tokens, get_token_budget
 
 # %% ../nbs/04_predict.ipynb 27
 EMAIL_LABEL_SEP = "|||"
@@ -67,59 +94,253 @@ def format_example(example: Document) -> str:
     return f"EMAIL: {example.page_content.strip()} {EMAIL_LABEL_SEP} LABEL: {example.metadata.get('label')}"
 
 
+def get_prediction_token_budget() -> int:
+    "Estimated tokens a prediction prompt may use, leaving room for the token counts being estimates."
+    return get_token_budget(BISON_MAXIMUM_INPUT_TOKENS)
+
+
+TYPICAL_EXAMPLE_TOKENS = 64
+
+
+def get_max_retrieval_k(max_k: int) -> int:
+    "The most neighbors the k=5, 10, 15... schedule of the original stuffing loop would retrieve."
+    k = 5
+    while k + 5 < max_k:
+        k += 5
+    return k
+
+
+def get_retrieval_k(
+        base_tokens: int,
+        max_k: int,
+        example_tokens: float = TYPICAL_EXAMPLE_TOKENS,
+        retrieved: int = 0,
+        used_tokens: int = 0) -> int:
+    """
+    The number of neighbors to retrieve for a prompt, enough to fill what is left of the budget
+    with examples of `example_tokens` each, after `retrieved` neighbors that used `used_tokens`.
+    """
+    # Each example is followed by a newline, +1 for the email itself being retrieved
+    fits = max(get_prediction_token_budget() - base_tokens - used_tokens, 0) // (example_tokens + 1) + 1
+    # At least double k on every page, so a run of small examples takes few searches
+    return min(get_max_retrieval_k(max_k), retrieved + max(int(fits), retrieved, 1))
+
+
+def _next_retrieval_k(
+        examples: List[Document],
+        base_tokens: int,
+        k: int,
+        max_k: int) -> int:
+    """
+    The k of the next page when all `examples`, retrieved with `k`, fit in the prompt
+    and more neighbors could, sized from their median, or None when the prompt is full.
+    """
+    if k >= get_max_retrieval_k(max_k):
+        return None
+    tokens = [count_tokens(format_example(e)) for e in examples]
+    used_tokens = sum(tokens) + len(tokens)
+    if base_tokens + used_tokens > get_prediction_token_budget():
+        return None
+    example_tokens = np.median(tokens) if len(tokens) > 0 else TYPICAL_EXAMPLE_TOKENS
+    return get_retrieval_k(base_tokens, max_k, example_tokens, k, used_tokens)
+
+
+def _stuff_prediction_prompt(
+        email_summary: Document,
+        examples: List[Document],
+        base_tokens: int) -> str:
+    "Format the prompt with as many of `examples`, in order, as fit in `get_prediction_token_budget`."
+    budget = get_prediction_token_budget()
+    formatted = []
+    prompt_tokens = base_tokens
+    for e in examples:
+        e_formatted = format_example(e)
+        # Each example is followed by a newline
+        e_tokens = count_tokens(e_formatted) + 1
+        if prompt_tokens + e_tokens > budget:
+            break
+        formatted.append(e_formatted)
+        prompt_tokens += e_tokens
+    if len(formatted) == 0:
+        return None
+    return PREDICTION_PROMPT.format(
+        email=email_summary.page_content,
+        examples="\n".join(formatted)
+    )
+
+
 def make_prediction_prompt(
         email_summary: Document,
-        chroma: Chroma,
+        chroma: VectorStore,
         limit: int = None
 ) -> str:
+    """
+    Stuff the prediction prompt with the most similar labeled examples
+    that fit in `get_prediction_token_budget`, counting tokens with `count_tokens`.
+    Retrieves about as many examples as fit, searching again for more only while they all do.
+    """
     idx = email_summary.metadata.get('idx')
-    k = 5
-    prompt = None
-    keep_stuffing = True
-    max_k = len(chroma.get()['ids']) if limit is None else limit
-    while keep_stuffing:
-        examples = chroma.similarity_search(email_summary.page_content, k=k)
-        examples = filter_examples(examples, idx)
-        if len(examples) == 0:
-            k += 5
-            continue
-        else:
-            example_str = ""
-            for e in examples:
-                e_formatted = format_example(e)
-                if len(example_str) == 0:
-                    example_str = e_formatted
-                else:
-                    example_str = example_str + "\n" + e_formatted
-                prompt = PREDICTION_PROMPT.format(
-                    email=email_summary.page_content,
-                    examples=example_str
-                )
-                if len(prompt) >= BISON_MAXIMUM_INPUT_TOKENS:
-                    keep_stuffing = False
-                    break
-        k += 5
-        if k >= max_k:
-            keep_stuffing = False
-    return prompt
+    max_k = get_collection_size(chroma) if limit is None else limit
+    base_tokens = count_tokens(PREDICTION_PROMPT.format(email=email_summary.page_content, examples=""))
+    k = get_retrieval_k(base_tokens, max_k)
+    while k is not None:
+        examples = filter_examples(chroma.similarity_search(email_summary.page_content, k=k), idx)
+        k = _next_retrieval_k(examples, base_tokens, k, max_k)
+    return _stuff_prediction_prompt(email_summary, examples, base_tokens)
+
+
+def _retrieve_examples(
+        email_summaries: List[Document],
+        chroma: VectorStore,
+        limit: int = None,
+        min_k: int = 0
+) -> Tuple[List[List[Tuple[Document, float]]], List[int]]:
+    """
+    Every email's examples with their cosine distances, and the tokens in its prompt without examples.
+    Emails whose examples all fit are searched again together for more, as in `make_prediction_prompt`.
+    At least `min_k` examples are retrieved for each email.
+    """
+    max_k = get_collection_size(chroma) if limit is None else limit
+    base_tokens = [
+        count_tokens(PREDICTION_PROMPT.format(email=s.page_content, examples="")) for s in email_summaries]
+    ks = [max(get_retrieval_k(b, max_k), min_k + 1) for b in base_tokens]
+    examples = [None] * len(email_summaries)
+    pending = list(range(len(email_summaries)))
+    while len(pending) > 0:
+        found = similarity_search_batch_with_score(
+            chroma,
+            [email_summaries[i].page_content for i in pending],
+            k=[ks[i] for i in pending],
+            idx=[email_summaries[i].metadata.get('idx') for i in pending])
+        for i, e in zip(pending, found):
+            examples[i] = e
+            ks[i] = _next_retrieval_k([d for d, _ in e], base_tokens[i], ks[i], max_k)
+        pending = [i for i in pending if ks[i] is not None]
+    return examples, base_tokens
 
-# %% ../nbs/04_predict.ipynb 44
+
+def make_prediction_prompts(
+        email_summaries: List[Document],
+        chroma: VectorStore,
+        limit: int = None
+) -> List[str]:
+    "`make_prediction_prompt` for many emails, retrieving all of their examples together."
+    email_summaries = list(email_summaries)
+    examples, base_tokens = _retrieve_examples(email_summaries, chroma, limit)
+    return [
+        _stuff_prediction_prompt(s, [d for d, _ in e], b)
+        for s, e, b in zip(email_summaries, examples, base_tokens)]
+
+# %% ../nbs/04_predict.ipynb 45
 @quota_handler
 def predict_batch(llm: VertexAI, prompts: List[str]) -> List[str]:
     return llm.batch(prompts)
 
 
-def get_predictions(llm: VertexAI, prompts: List[str]) -> List[str]:
+def predict_prompts(llm: VertexAI, prompts: List[str]) -> List[str]:
+    "`predict_batch` on the prompts that aren't None. An email without a prompt, as no example fit, gets None."
+    asked = [p for p in prompts if p is not None]
+    predictions = iter(predict_batch(llm, asked) if len(asked) > 0 else [])
+    return [None if p is None else next(predictions) for p in prompts]
+
+
+def stream_predictions(
+        llm: VertexAI,
+        prompts: Iterable[str],
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[str]:
+    "Predictions in the order of `prompts`, holding only a bounded number of batches at a time."
+    for batch_predictions in dispatch_batches(
+            partial(predict_prompts, llm), prompts, 5, concurrency):
+        yield from batch_predictions
+
+
+def get_predictions(
+        llm: VertexAI,
+        prompts: List[str],
+        concurrency: int = DEFAULT_CONCURRENCY) -> List[str]:
     pbar = tqdm(total=len(prompts), ncols=80, leave=False)
     predictions = []
-    for batch in get_batches(iter(prompts), 5):
-        batch_predictions = predict_batch(llm, batch)
-        predictions.extend(batch_predictions)
-        pbar.update(len(batch))
+    for prediction in stream_predictions(llm, prompts, concurrency):
+        predictions.append(prediction)
+        pbar.update(1)
     pbar.close()
     return predictions
 
-# %% ../nbs/04_predict.ipynb 52
+# %% ../nbs/04_predict.ipynb 53
+PREDICTION_COLUMNS = ['prediction', 'label', 'idx', 'prompt', 'email']
+PREDICTION_FLUSH_ROWS = 5
+PREDICTION_CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def _prediction_checkpoint_path(path: Path) -> Path:
+    return path.with_name(path.name + PREDICTION_CHECKPOINT_SUFFIX)
+
+
+def _durable_size(path: Path) -> int:
+    "How much of `path` had been flushed to disk when its checkpoint was last written."
+    if not path.exists():
+        return 0
+    checkpoint_path = _prediction_checkpoint_path(path)
+    if not checkpoint_path.exists():
+        # Written in one go, before predictions were checkpointed
+        return path.stat().st_size
+    return json.loads(checkpoint_path.read_text())['bytes']
+
+
+def _write_prediction_checkpoint(path: Path, size: int) -> None:
+    checkpoint_path = _prediction_checkpoint_path(path)
+    temporary_path = checkpoint_path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps({'bytes': size}))
+    temporary_path.replace(checkpoint_path)
+
+
+def read_completed_idx(path: Path) -> Set[int]:
+    "The idx of every row of `path` that was durably written."
+    path = Path(path)
+    size = _durable_size(path)
+    if size == 0:
+        return set()
+    with open(path, 'rb') as f:
+        durable = f.read(size)
+    return set(pd.read_csv(io.BytesIO(durable), usecols=['idx']).idx.astype(int))
+
+
+def write_prediction_rows(
+        rows: Iterable[Dict[str, Any]],
+        path: Path,
+        resume: bool = False,
+        flush_rows: int = PREDICTION_FLUSH_ROWS) -> int:
+    """
+    Write rows of `PREDICTION_COLUMNS` to a CSV as they arrive, returning how many were written.
+    Every `flush_rows` rows are synced to disk and checkpointed.
+    With `resume`, anything after the last checkpoint is dropped and new rows are appended.
+    """
+    path = Path(path)
+    size = _durable_size(path) if resume else 0
+    if size > 0:
+        os.truncate(path, size)
+    count = 0
+    with open(path, 'a' if size > 0 else 'w', newline='', encoding='utf-8') as f:
+        def flush():
+            f.flush()
+            os.fsync(f.fileno())
+            _write_prediction_checkpoint(path, os.fstat(f.fileno()).st_size)
+
+        writer = csv.DictWriter(f, fieldnames=PREDICTION_COLUMNS, extrasaction='ignore', lineterminator='\n')
+        if size == 0:
+            writer.writeheader()
+        try:
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+                if count % flush_rows == 0:
+                    flush()
+        finally:
+            # Keep every complete row when a prediction fails
+            flush()
+    return count
+
+
 def write_predictions(
         predictions: List[str],
         labels: List[str],
@@ -128,12 +349,353 @@ def write_predictions(
         emails: List[str],
         directory: Path,
         file_name: str = "predictions.csv"):
-    pd.DataFrame(
-        list(zip(
-            predictions, 
-            labels,
-            idx,
-            prompts,
-            emails)),
-        columns=['prediction', 'label', 'idx', 'prompt', 'email']
-    ).to_csv(directory / file_name, index=False)
+    write_prediction_rows(
+        (dict(zip(PREDICTION_COLUMNS, row)) for row in zip(predictions, labels, idx, prompts, emails)),
+        directory / file_name)
+
+
+def predict_and_write(
+        llm: VertexAI,
+        prompts: List[str],
+        labels: List[str],
+        idx: List[int],
+        emails: List[str],
+        path: Path,
+        resume: bool = True,
+        concurrency: int = DEFAULT_CONCURRENCY) -> int:
+    """
+    `get_predictions` followed by `write_predictions`, appending each row as its batch completes.
+    With `resume`, emails whose idx is already in `path` are skipped, so a crashed or stalled run
+    continues where it stopped. Emails without a prompt get an empty prediction. Returns the number of new rows.
+    """
+    done = read_completed_idx(path) if resume else set()
+    todo = [i for i, x in enumerate(idx) if int(x) not in done]
+    predictions = stream_predictions(llm, (prompts[i] for i in todo), concurrency)
+    rows = (
+        {
+            'prediction': None if p is None else p.strip(),
+            'label': labels[i],
+            'idx': idx[i],
+            'prompt': prompts[i],
+            'email': emails[i],
+        }
+        for i, p in zip(todo, predictions))
+    return write_prediction_rows(tqdm(rows, total=len(todo), ncols=80, leave=False), path, resume=resume)
+
+# %% ../nbs/04_predict.ipynb 59
+CASCADE_THRESHOLD = 0.9
+CASCADE_NEIGHBORS = 10
+
+
+def vote_label(neighbors: List[Tuple[Document, float]]) -> Tuple[str, float]:
+    "The label with the most similarity among `neighbors`, and its share of their total similarity."
+    weights = {}
+    for document, distance in neighbors:
+        label = document.metadata.get('label')
+        weights[label] = weights.get(label, 0.0) + max(1.0 - distance, 0.0)
+    total = sum(weights.values())
+    if total == 0:
+        return None, 0.0
+    label = max(weights, key=weights.get)
+    return label, weights[label] / total
+
+
+def cascade_predictions(
+        email_summaries: List[Document],
+        chroma: VectorStore,
+        llm: VertexAI,
+        threshold: float = CASCADE_THRESHOLD,
+        neighbors: int = CASCADE_NEIGHBORS,
+        limit: int = None,
+        concurrency: int = DEFAULT_CONCURRENCY) -> pd.DataFrame:
+    """
+    Label emails whose nearest `neighbors` vote with at least `threshold` confidence by that vote,
+    and the rest with `get_predictions`. `source` says which branch labeled each email.
+    """
+    email_summaries = list(email_summaries)
+    examples, base_tokens = _retrieve_examples(email_summaries, chroma, limit, neighbors)
+    votes = [vote_label(e[:neighbors]) for e in examples]
+    ambiguous = [i for i, (_, confidence) in enumerate(votes) if confidence < threshold]
+    prompts = {
+        i: _stuff_prediction_prompt(email_summaries[i], [d for d, _ in examples[i]], base_tokens[i])
+        for i in ambiguous}
+    asked = [i for i in ambiguous if prompts[i] is not None]
+    answers = dict(zip(asked, get_predictions(llm, [prompts[i] for i in asked], concurrency)))
+    records = []
+    for i, (summary, (vote, confidence)) in enumerate(zip(email_summaries, votes)):
+        accepted = confidence >= threshold
+        records.append({
+            'prediction': vote if accepted else answers[i].strip() if i in answers else None,
+            'label': summary.metadata.get('label'),
+            'idx': summary.metadata.get('idx'),
+            'prompt': prompts.get(i),
+            'vote': vote,
+            'confidence': confidence,
+            'source': 'vote' if accepted else 'llm',
+        })
+    return pd.DataFrame.from_records(records)
+
+
+def cascade_report(predictions: pd.DataFrame) -> pd.DataFrame:
+    "The number, share and accuracy of emails labeled by each branch. The vote's share is the skip rate."
+    correct = predictions.prediction == predictions.label
+    emails = predictions.groupby('source').size()
+    report = pd.DataFrame({
+        'emails': emails,
+        'share': emails / len(predictions),
+        'accuracy': correct.groupby(predictions.source).mean()})
+    report.loc['all'] = [len(predictions), 1.0, correct.mean()]
+    return report
+
+
+def vote_threshold_table(
+        predictions: pd.DataFrame,
+        thresholds: Sequence[float] = tuple(np.linspace(0.5, 1.0, 11))) -> pd.DataFrame:
+    "The skip rate and the vote's accuracy on the emails it would label, at each threshold."
+    thresholds = np.asarray(thresholds)
+    correct = (predictions.vote == predictions.label).to_numpy()
+    accepted = predictions.confidence.to_numpy()[None, :] >= thresholds[:, None]
+    return pd.DataFrame({
+        'threshold': thresholds,
+        'skip_rate': accepted.mean(axis=1),
+        'vote_accuracy': (accepted & correct).sum(axis=1) / np.maximum(accepted.sum(axis=1), 1)})
+
+# %% ../nbs/04_predict.ipynb 63
+PREDICTION_SHARD_SIZE = 1000
+PROMPT_SHARD_NAME = "prompts-{:05d}.jsonl"
+METADATA_SHARD_NAME = "metadata-{:05d}.jsonl"
+BATCH_RESULT_DIR_NAME = "results"
+
+
+def write_prediction_shards(
+        email_summaries: Iterable[Document],
+        chroma: VectorStore,
+        destination_uri: str,
+        shard_size: int = PREDICTION_SHARD_SIZE,
+        limit: int = None) -> List[str]:
+    """
+    Write a prediction prompt for every email to `destination_uri/prompts-*.jsonl`,
+    and each email's idx and label to matching `metadata-*.jsonl` files.
+    Emails without a prompt, as no example fit, are left out, and so is a shard left with none.
+    Returns the prompt shard URIs.
+    """
+    prompt_uris = []
+    for shard, batch in enumerate(get_batches(email_summaries, shard_size)):
+        rows = [(s, p) for s, p in zip(batch, make_prediction_prompts(batch, chroma, limit)) if p is not None]
+        if len(rows) == 0:
+            continue
+        prompt_uri = f"{destination_uri}/{PROMPT_SHARD_NAME.format(shard)}"
+        metadata_uri = f"{destination_uri}/{METADATA_SHARD_NAME.format(shard)}"
+        with fsspec.open(prompt_uri, 'w') as prompt_f, fsspec.open(metadata_uri, 'w') as metadata_f:
+            for email_summary, prompt in rows:
+                prompt_f.write(json.dumps({'prompt': prompt}) + "\n")
+                metadata_f.write(json.dumps({
+                    'idx': email_summary.metadata.get('idx'),
+                    'label': email_summary.metadata.get('label')}) + "\n")
+        prompt_uris.append(prompt_uri)
+    return prompt_uris
+
+
+def _read_json_lines(uri: str) -> Iterable[Dict[str, Any]]:
+    with fsspec.open(uri, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _find_json_lines(uri: str) -> List[str]:
+    fs, path = fsspec.core.url_to_fs(uri)
+    return sorted(fs.unstrip_protocol(p) for p in fs.find(path) if p.endswith(".jsonl"))
+
+# %% ../nbs/04_predict.ipynb 65
+class VertexBatchRunner:
+    "Runs batch prediction jobs on Vertex AI."
+    def submit(
+            self,
+            source_uris: List[str],
+            destination_uri_prefix: str,
+            model_parameters: Dict[str, Any] = DEFAULT_PREDICT_PARAMS) -> BatchPredictionJob:
+        return batch_predict(source_uris, destination_uri_prefix, model_parameters)
+
+    def wait(self, job: BatchPredictionJob, poll_seconds: float = 60) -> str:
+        while not job.done():
+            time.sleep(poll_seconds)
+        if job.state != gca_job_state.JobState.JOB_STATE_SUCCEEDED:
+            raise RuntimeError(f"Batch prediction job {job.resource_name} ended with {job.state}: {job.error}")
+        return job.output_info.gcs_output_directory
+
+
+class LocalBatchRunner:
+    """
+    Stands in for Vertex AI, answering each prompt with `predict` 
+    and writing results in the same format a batch job does.
+    """
+    def __init__(self, predict: Callable[[str], str]):
+        self.predict = predict
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _run(self, source_uris: List[str], output_uri: str) -> str:
+        for shard, source_uri in enumerate(source_uris):
+            with fsspec.open(f"{output_uri}/{shard:012d}.jsonl", 'w') as f:
+                for instance in _read_json_lines(source_uri):
+                    result = {
+                        'instance': instance,
+                        'predictions': [{'content': self.predict(instance['prompt'])}],
+                        'status': ""}
+                    f.write(json.dumps(result) + "\n")
+        return output_uri
+
+    def submit(
+            self,
+            source_uris: List[str],
+            destination_uri_prefix: str,
+            model_parameters: Dict[str, Any] = DEFAULT_PREDICT_PARAMS) -> Future:
+        output_uri = f"{destination_uri_prefix}/prediction-model-{datetime.utcnow().isoformat()}Z"
+        return self._executor.submit(self._run, source_uris, output_uri)
+
+    def wait(self, job: Future, poll_seconds: float = 60) -> str:
+        while not job.done():
+            time.sleep(min(poll_seconds, 0.1))
+        return job.result()
+
+# %% ../nbs/04_predict.ipynb 66
+def collect_batch_predictions(
+        output_uri: str,
+        destination_uri: str) -> pd.DataFrame:
+    """
+    Map a finished job's predictions back to each email's idx and label.
+    Joins on the prompt, as a batch job doesn't keep the order of its input.
+    """
+    metadata_by_prompt = {}
+    for prompt_uri in _find_json_lines(destination_uri):
+        name = prompt_uri.rsplit("/", 1)[-1]
+        if not name.startswith("prompts-"):
+            continue
+        metadata_uri = prompt_uri[:-len(name)] + name.replace("prompts-", "metadata-")
+        for prompt, metadata in zip(_read_json_lines(prompt_uri), _read_json_lines(metadata_uri)):
+            metadata_by_prompt.setdefault(hash_text(prompt['prompt']), []).append(metadata)
+    records = []
+    for result_uri in _find_json_lines(output_uri):
+        for result in _read_json_lines(result_uri):
+            matches = metadata_by_prompt.get(hash_text(result['instance']['prompt']), [])
+            if len(matches) == 0:
+                continue
+            predictions = result.get('predictions') or [{}]
+            records.append({
+                **matches.pop(0),
+                'prediction': predictions[0].get('content', "").strip(),
+                'prompt': result['instance']['prompt']})
+    return pd.DataFrame.from_records(records, columns=['idx', 'label', 'prediction', 'prompt'])
+
+
+def run_batch_predictions(
+        email_summaries: Iterable[Document],
+        chroma: VectorStore,
+        destination_uri: str,
+        runner: Union[VertexBatchRunner, LocalBatchRunner] = None,
+        limit: int = None,
+        shard_size: int = PREDICTION_SHARD_SIZE,
+        poll_seconds: float = 60,
+        model_parameters: Dict[str, Any] = DEFAULT_PREDICT_PARAMS) -> pd.DataFrame:
+    """
+    Classify every email with one batch prediction job.
+
+    :param destination_uri: Folder for prompts and results, 
+        I.E. 'gs://BUCKET_NAME/JDB_experiments/prediction_batch' or a local path
+    """
+    runner = VertexBatchRunner() if runner is None else runner
+    prompt_uris = write_prediction_shards(email_summaries, chroma, destination_uri, shard_size, limit)
+    job = runner.submit(prompt_uris, f"{destination_uri}/{BATCH_RESULT_DIR_NAME}", model_parameters)
+    output_uri = runner.wait(job, poll_seconds)
+    return collect_batch_predictions(output_uri, destination_uri)
+
+# %% ../nbs/04_predict.ipynb 70
+PIPELINE_BATCH_SIZE = 5
+RETRIEVAL_BATCH_SIZE = 50
+RETRIEVAL_CONCURRENCY = 2
+
+
+def format_email(email: Email) -> str:
+    return f"-- SUBJECT --\n{email.email_subject}\n-- BODY --\n{email.email_body}"
+
+
+def stream_batches(
+        func: Callable[[List[Any]], List[Any]],
+        items: Iterable[Any],
+        batch_size: int,
+        concurrency: int) -> Iterable[Any]:
+    "`dispatch_batches`, yielding one result at a time."
+    for results in dispatch_batches(func, items, batch_size, concurrency):
+        yield from results
+
+
+def summarize_stream(
+        emails: Iterable[Email],
+        chain: RunnableSequence,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[Document]:
+    "Summary documents in the order of `emails`, carrying each email's idx, label and text."
+    def summarize(batch: List[Email]) -> List[Document]:
+        summaries = get_documents_summaries([email_to_document(e) for e in batch], chain)
+        return [
+            Document(
+                page_content=s.strip(),
+                metadata={'idx': e.idx, 'label': e.label, 'email': format_email(e)})
+            for e, s in zip(batch, summaries)]
+    return stream_batches(summarize, emails, batch_size, concurrency)
+
+
+def prompt_stream(
+        email_summaries: Iterable[Document],
+        chroma: VectorStore,
+        limit: int = None,
+        batch_size: int = RETRIEVAL_BATCH_SIZE,
+        concurrency: int = RETRIEVAL_CONCURRENCY) -> Iterable[Tuple[Document, str]]:
+    "Each summary with its prediction prompt, retrieving examples a batch at a time."
+    def make_prompts(batch: List[Document]) -> List[Tuple[Document, str]]:
+        return list(zip(batch, make_prediction_prompts(batch, chroma, limit)))
+    return stream_batches(make_prompts, email_summaries, batch_size, concurrency)
+
+
+def prediction_stream(
+        prompted: Iterable[Tuple[Document, str]],
+        llm: VertexAI,
+        batch_size: int = PIPELINE_BATCH_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[Dict[str, Any]]:
+    "Rows of `PREDICTION_COLUMNS`. Emails without a prompt, as no example fit, get no prediction."
+    def predict_rows(batch: List[Tuple[Document, str]]) -> List[Dict[str, Any]]:
+        predictions = predict_prompts(llm, [p for _, p in batch])
+        return [
+            {
+                'prediction': None if prediction is None else prediction.strip(),
+                'label': d.metadata.get('label'),
+                'idx': d.metadata.get('idx'),
+                'prompt': p,
+                'email': d.metadata.get('email'),
+            }
+            for (d, p), prediction in zip(batch, predictions)]
+    return stream_batches(predict_rows, prompted, batch_size, concurrency)
+
+
+def run_prediction_pipeline(
+        emails: Iterable[Email],
+        chroma: VectorStore,
+        path: Path,
+        summary_chain: RunnableSequence = None,
+        llm: VertexAI = None,
+        limit: int = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        resume: bool = False) -> int:
+    """
+    Summarize, prompt, predict and write every email in one streaming pass,
+    returning the number of rows written to the CSV at `path`.
+    With `resume`, emails already written to `path` are skipped.
+    """
+    summary_chain = get_summary_chain() if summary_chain is None else summary_chain
+    llm = get_llm() if llm is None else llm
+    done = read_completed_idx(path) if resume else set()
+    emails = (e for e in emails if int(e.idx) not in done)
+    summaries = summarize_stream(emails, summary_chain, concurrency=concurrency)
+    prompted = prompt_stream(summaries, chroma, limit)
+    rows = prediction_stream(prompted, llm, concurrency=concurrency)
+    return write_prediction_rows(tqdm(rows, ncols=80, leave=False), path, resume=resume)
@@ -2,19 +2,40 @@
 
 # %% auto 0
 __all__ = ['EMAIL_SUBJECT_PREFIX', 'EMAIL_BODY_PREFIX', 'PREFIX_LEN', 'SPLIT_CHAIN_PROMPT_TEMPLATE', 'SPLIT_CHAIN_PROMPT',
-           'SUMMARIZE_PROMPT_PREFIX', 'SUMMARIZE_PROMPT_STR', 'SUMMARIZE_PROMPT', 'BISON_MAXIMUM_INPUT_TOKENS',
-           'CONTEXT_TOKEN_LIMIT', 'SUMMARIZATION_PROMPT_FILE_NAME', 'SUMMARIZATION_METADATA_FILE_NAME',
-           'SUMMARIZATION_RESULT_PREFIX', 'email_to_document', 'get_summary_chain', 'get_documents_summaries',
-           'get_summaries', 'prepare_summarization_prompt', 'prepare_batch_summarization_files', 'summarize_prompts',
-           'load_batch_prediction_results']
+           'CHAIN_HEADER_PATTERN', 'SUMMARIZE_PROMPT_PREFIX', 'SUMMARIZE_PROMPT_STR', 'SUMMARIZE_PROMPT',
+           'BISON_MAXIMUM_INPUT_TOKENS', 'SUMMARIZATION_PROMPT_FILE_NAME', 'SUMMARIZATION_METADATA_FILE_NAME',
+           'SUMMARIZATION_RESULT_PREFIX', 'BATCH_RESULTS_FILE_NAME', 'BATCH_RESULTS_CHECKPOINT_SUFFIX',
+           'email_to_document', 'emails_to_documents', 'split_email_chains', 'split_email_chain', 'parse_split_answer',
+           'get_llm_email_splits', 'compare_chain_splits', 'get_context_token_limit', 'get_summary_chain',
+           'get_documents_summaries', 'get_summaries', 'summarize_unique_emails', 'prepare_summarization_prompt',
+           'prepare_batch_summarization_files', 'summarize_prompts', 'get_batch_output_prefix',
+           'get_prediction_content', 'load_batch_prediction_results']
 
 # %% ../nbs/02_process.ipynb 2
-from typing import Dict, Any, Tuple, Iterable, List
+from typing import Dict, Any, Tuple, Iterable, List, Optional, TextIO
+from pathlib import Path
+from functools import partial
+import ast
+import itertools
+import json
+import os
+import re
+import warnings
+
+import numpy as np
+import pandas as pd
 
 from .schema import predict, get_storage_client, \
-    get_model, DEFAULT_PREDICT_PARAMS, quota_handler
+    get_model, get_llm, DEFAULT_PREDICT_PARAMS, quota_handler
 from .load import get_emails_from_frame, get_raw_emails_tejas_case_numbers, \
-    Email, PROJECT_BUCKET, WRITE_PREFIX, get_idx, get_batches
+    Email, EmailBatch, PROJECT_BUCKET, WRITE_PREFIX, get_idx, get_batches
+from .dispatch import dispatch_batches, DEFAULT_CONCURRENCY
+from .chroma import list_blob_names, read_json_lines_from_gcs, \
+    read_json_line_batches_from_gcs
+from .cache import hash_text, batch_through_cache
+from .tokens import count_tokens
+from .dedupe import get_email_representatives, get_representative_emails, \
+    fan_out, NEAR_DUPLICATE_THRESHOLD
 
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
@@ -44,6 +65,20 @@ def email_to_document(
         metadata=metadata
     )
 
+
+def emails_to_documents(emails: EmailBatch) -> List[Document]:
+    "`email_to_document` for a whole batch of emails at once."
+    records = emails.metadata.to_dict('records') if emails.metadata.shape[1] > 0 else [{} for _ in range(len(emails))]
+    documents = []
+    for metadata, idx, label, subject, body in zip(
+            records, emails.idx.tolist(), emails.label, emails.email_subject, emails.email_body):
+        metadata['idx'] = idx
+        metadata['label'] = label
+        documents.append(Document(
+            page_content=f"{EMAIL_SUBJECT_PREFIX}\n{subject}\n{EMAIL_BODY_PREFIX}\n{body}",
+            metadata=metadata))
+    return documents
+
 # %% ../nbs/02_process.ipynb 9
 SPLIT_CHAIN_PROMPT_TEMPLATE = """The following is text from an email chain.
 If there is more than one email in the chain, return the positions in the text where each email starts.
@@ -57,7 +92,100 @@ Positions:"""
 
 SPLIT_CHAIN_PROMPT = PromptTemplate.from_template(SPLIT_CHAIN_PROMPT_TEMPLATE)
 
-# %% ../nbs/02_process.ipynb 22
+# %% ../nbs/02_process.ipynb 20
+_HEADER_LINE = r"[ \t>*]*(?:From|Sent|Date|To|Cc|Subject)[ \t]*:"
+_SEPARATOR_LINE = r"[ \t>]*(?:-{2,}[ \t]*(?:Original Message|Forwarded message)[ \t]*-{2,}|-{20,}|_{20,})[ \t]*$"
+_REPLY_LINE = r"[ \t>]*On [^\n\x00]{1,200}?(?:\n[^\n\x00]{0,200}?)?wrote:[ \t]*$"
+
+CHAIN_HEADER_PATTERN = re.compile(
+    rf"^(?:{_SEPARATOR_LINE}|{_HEADER_LINE}[^\n\x00]*\n{_HEADER_LINE}|{_REPLY_LINE})",
+    re.MULTILINE | re.IGNORECASE)
+# Lines that can sit between the matches of one header block
+_FILLER_LINE = re.compile(rf"(?:{_HEADER_LINE}.*|{_SEPARATOR_LINE}|[\s>]*)$", re.IGNORECASE)
+# No pattern can match across this, so every row can be scanned in one pass
+_ROW_SEPARATOR = "\n\x00\n"
+
+
+def _is_filler(text: str) -> bool:
+    return all(_FILLER_LINE.match(line) for line in text.split("\n"))
+
+
+def split_email_chains(bodies: pd.Series) -> pd.DataFrame:
+    """
+    Find where each email in every chain of `bodies` starts.
+    Returns the `offsets` of each email, starting with 0, 
+    and the `latest` email, which comes first in a reply chain.
+    """
+    texts = bodies.fillna("").astype(str).str.replace("\x00", "", regex=False).tolist()
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    row_starts = np.concatenate([[0], np.cumsum(lengths + len(_ROW_SEPARATOR))[:-1]])
+    match_starts = np.array(
+        [m.start() for m in CHAIN_HEADER_PATTERN.finditer(_ROW_SEPARATOR.join(texts))], dtype=np.int64)
+    rows = np.searchsorted(row_starts, match_starts, side='right') - 1
+    offsets = [[0] for _ in texts]
+    for row, start in zip(rows.tolist(), (match_starts - row_starts[rows]).tolist()):
+        if not _is_filler(texts[row][offsets[row][-1]:start]):
+            offsets[row].append(start)
+    latest = [t[:o[1]].strip() if len(o) > 1 else t.strip() for t, o in zip(texts, offsets)]
+    return pd.DataFrame({'offsets': offsets, 'latest': latest}, index=bodies.index)
+
+
+def split_email_chain(body: str) -> List[int]:
+    "Offsets of each email in a single chain."
+    return split_email_chains(pd.Series([body])).offsets.iloc[0]
+
+# %% ../nbs/02_process.ipynb 24
+def parse_split_answer(answer: str) -> List[int]:
+    "The offsets in an answer to `SPLIT_CHAIN_PROMPT`, or [0] if it can't be read."
+    try:
+        offsets = ast.literal_eval(answer.strip())
+        return sorted({0} | {int(o) for o in offsets})
+    except (ValueError, SyntaxError, TypeError):
+        return [0]
+
+
+def get_llm_email_splits(
+        bodies: List[str],
+        concurrency: int = DEFAULT_CONCURRENCY) -> List[List[int]]:
+    "Offsets from the LLM, the way we split chains before `split_email_chains`."
+    split_chain = SPLIT_CHAIN_PROMPT | get_llm()
+
+    @quota_handler
+    def split_batch(batch: List[str]) -> List[List[int]]:
+        return [parse_split_answer(a) for a in split_chain.batch([{'email': b} for b in batch])]
+    return list(itertools.chain.from_iterable(dispatch_batches(split_batch, bodies, 5, concurrency)))
+
+
+def compare_chain_splits(
+        predicted: List[List[int]],
+        reference: List[List[int]],
+        tolerance: int = 100) -> Dict[str, float]:
+    """
+    How often `predicted` finds as many emails as `reference`, 
+    and the precision and recall of its email boundaries, excluding the start of the chain.
+    """
+    same_count = 0
+    matched = 0
+    predicted_boundaries = 0
+    reference_boundaries = 0
+    for p, r in zip(predicted, reference):
+        same_count += len(p) == len(r)
+        p, r = [o for o in p if o > 0], [o for o in r if o > 0]
+        predicted_boundaries += len(p)
+        reference_boundaries += len(r)
+        unmatched = list(r)
+        for o in p:
+            near = [u for u in unmatched if abs(u - o) <= tolerance]
+            if len(near) > 0:
+                unmatched.remove(min(near, key=lambda u: abs(u - o)))
+                matched += 1
+    return {
+        'same_count': same_count / max(len(reference), 1),
+        'precision': matched / predicted_boundaries if predicted_boundaries > 0 else 1.0,
+        'recall': matched / reference_boundaries if reference_boundaries > 0 else 1.0,
+    }
+
+# %% ../nbs/02_process.ipynb 30
 # TODO: Ignore sender, receiver information
 # TODO: Summarize most recent email, ignore rest
 # TODO: Remove boilerplate
@@ -75,35 +203,63 @@ SUMMARIZE_PROMPT_STR = SUMMARIZE_PROMPT_PREFIX + "{context}\nSummary:"
 SUMMARIZE_PROMPT = PromptTemplate.from_template(SUMMARIZE_PROMPT_STR)
 
 BISON_MAXIMUM_INPUT_TOKENS = 8192
-CONTEXT_TOKEN_LIMIT = BISON_MAXIMUM_INPUT_TOKENS - len(SUMMARIZE_PROMPT_PREFIX)
 
-# %% ../nbs/02_process.ipynb 26
+
+def get_context_token_limit() -> int:
+    "Tokens left for an email once the summarization prompt is in, by the token counter in use now."
+    return BISON_MAXIMUM_INPUT_TOKENS - count_tokens(SUMMARIZE_PROMPT_PREFIX)
+
+# %% ../nbs/02_process.ipynb 35
 def get_summary_chain() -> RunnableSequence:
-    return SUMMARIZE_PROMPT | VertexAI()
+    return SUMMARIZE_PROMPT | get_llm()
+
+# %% ../nbs/02_process.ipynb 39
+@quota_handler(stage='summarize')
+def _batch_chain(chain: RunnableSequence, inputs: List[Dict[str, str]]) -> List[str]:
+    return chain.batch(inputs)
+
 
-# %% ../nbs/02_process.ipynb 30
-@quota_handler
 def get_documents_summaries(
     documents: List[Document], 
     chain: RunnableSequence
     ) -> List[str]:
-    return chain.batch([{'context': d.page_content} for d in documents])
+    "Summarize `documents`, only calling the model for the ones without a cached summary."
+    return batch_through_cache(
+        chain,
+        [{'context': d.page_content} for d in documents],
+        partial(_batch_chain, chain))
 
-# %% ../nbs/02_process.ipynb 34
+# %% ../nbs/02_process.ipynb 43
 def get_summaries(
         instances: Iterable[Email], 
         chain: RunnableSequence,
-        batch_size: int = 5) -> Iterable[List[str]]:
-    for instance_batch in get_batches(instances, batch_size):
+        batch_size: int = 5,
+        concurrency: int = DEFAULT_CONCURRENCY) -> Iterable[List[str]]:
+    "Summarize batches of emails, with up to `concurrency` batches in flight."
+    def summarize_batch(instance_batch: List[Email]) -> List[str]:
         instance_batch_documents = [email_to_document(i) for i in instance_batch]
-        yield get_documents_summaries(instance_batch_documents, chain)
+        return get_documents_summaries(instance_batch_documents, chain)
+    return dispatch_batches(summarize_batch, instances, batch_size, concurrency)
 
-# %% ../nbs/02_process.ipynb 44
+# %% ../nbs/02_process.ipynb 45
+def summarize_unique_emails(
+        emails: EmailBatch,
+        chain: RunnableSequence,
+        threshold: float = NEAR_DUPLICATE_THRESHOLD,
+        batch_size: int = 5,
+        concurrency: int = DEFAULT_CONCURRENCY) -> pd.Series:
+    "Summarize one email per cluster of near duplicates, and give every email the summary of its cluster, indexed by idx."
+    representatives = get_email_representatives(emails, threshold)
+    unique_emails = get_representative_emails(representatives, emails)
+    summaries = itertools.chain.from_iterable(get_summaries(unique_emails, chain, batch_size, concurrency))
+    return fan_out(pd.Series(list(summaries), index=unique_emails.idx, name='summary'), representatives)
+
+# %% ../nbs/02_process.ipynb 56
 def prepare_summarization_prompt(document: Document) -> Tuple[Dict[str, str], Dict[str, Any]]:
     prompt = {'prompt': SUMMARIZE_PROMPT.format(context=document.page_content)}
     return prompt, document.metadata
 
-# %% ../nbs/02_process.ipynb 49
+# %% ../nbs/02_process.ipynb 61
 SUMMARIZATION_PROMPT_FILE_NAME = "summarization_prompts.jsonl"
 SUMMARIZATION_METADATA_FILE_NAME = "summarization_metadata.jsonl"
 
@@ -137,7 +293,7 @@ def prepare_batch_summarization_files(
     if use_pbar:
         pbar.close()
 
-# %% ../nbs/02_process.ipynb 52
+# %% ../nbs/02_process.ipynb 64
 SUMMARIZATION_RESULT_PREFIX = "summarization"
 
 
@@ -156,6 +312,145 @@ def summarize_prompts(
         # Optional:
         model_parameters=params)
 
-# %% ../nbs/02_process.ipynb 54
-def load_batch_prediction_results():
-    pass
+# %% ../nbs/02_process.ipynb 67
+BATCH_RESULTS_FILE_NAME = "summarization_results.jsonl"
+BATCH_RESULTS_CHECKPOINT_SUFFIX = ".checkpoint.json"
+
+
+def get_batch_output_prefix(
+        file_prefix: str = WRITE_PREFIX,
+        bucket_name: str = PROJECT_BUCKET) -> str:
+    "The folder of the most recent batch job's output, I.E. 'JDB_experiments/summarization/prediction-model-2023-...'"
+    shards = list_blob_names(f"{file_prefix}/{SUMMARIZATION_RESULT_PREFIX}/", bucket_name=bucket_name)
+    if len(shards) == 0:
+        raise FileNotFoundError(f"No batch results in gs://{bucket_name}/{file_prefix}/{SUMMARIZATION_RESULT_PREFIX}")
+    return max(s.rsplit("/", 1)[0] for s in shards)
+
+
+def get_prediction_content(result: Dict[str, Any]) -> str:
+    predictions = result.get('predictions') or [{}]
+    return predictions[0].get("content", "").strip()
+
+
+def _read_checkpoint(path: Path) -> Dict[str, Any]:
+    checkpoint = {'completed': [], 'rows': 0, 'consumed': {}, 'unmatched': 0}
+    if path.exists():
+        checkpoint.update(json.loads(path.read_text()))
+    return checkpoint
+
+
+def _write_checkpoint(path: Path, checkpoint: Dict[str, Any]) -> None:
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(checkpoint))
+    temporary_path.replace(path)
+
+
+def _truncate_lines(path: Path, lines: int) -> None:
+    "Drop anything after the first `lines` lines, I.E. written after the last checkpoint."
+    if not path.exists():
+        return
+    with open(path, 'rb') as f:
+        for _ in range(lines):
+            f.readline()
+        size = f.tell()
+    os.truncate(path, size)
+
+
+def _metadata_by_prompt(
+        file_prefix: str,
+        bucket_name: str) -> Dict[str, List[Dict[str, Any]]]:
+    "Metadata for every prompt we wrote, keyed by a hash of the prompt."
+    prompts = read_json_lines_from_gcs(f"{file_prefix}/{SUMMARIZATION_PROMPT_FILE_NAME}", bucket_name)
+    metadata = read_json_lines_from_gcs(f"{file_prefix}/{SUMMARIZATION_METADATA_FILE_NAME}", bucket_name)
+    by_prompt = {}
+    for prompt, m in zip(prompts, metadata):
+        by_prompt.setdefault(hash_text(prompt['prompt']), []).append(m)
+    return by_prompt
+
+
+def _take_match(
+        by_prompt: Dict[str, List[Dict[str, Any]]],
+        consumed: Dict[str, int],
+        prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    The next unused metadata written for `prompt`, or None when there is none left.
+    `consumed` counts the matches already taken for each prompt hash, so a resumed run doesn't take them again.
+    """
+    key = hash_text(prompt)
+    matches = by_prompt.get(key, [])
+    taken = consumed.get(key, 0)
+    if taken >= len(matches):
+        return None
+    consumed[key] = taken + 1
+    return matches[taken]
+
+
+def load_batch_prediction_results(
+        directory: Path,
+        output_prefix: str = None,
+        file_prefix: str = WRITE_PREFIX,
+        bucket_name: str = PROJECT_BUCKET,
+        join_on: str = 'prompt',
+        workers: int = 8,
+        file_name: str = BATCH_RESULTS_FILE_NAME) -> pd.DataFrame:
+    """
+    Collect a batch summarization job's results into `directory / file_name`, 
+    one line of email metadata plus its `summary` per prediction.
+    Shards already collected by an earlier call are skipped.
+    Joining on prompt, results that match no prompt we wrote are left out, with a warning.
+
+    :param output_prefix: Folder of the job's output shards, defaults to the latest job's
+    :param join_on: 'prompt', or 'position' only if the job kept the order of its input,
+        as results are otherwise silently attached to the wrong emails
+    """
+    if join_on not in ['prompt', 'position']:
+        raise ValueError("join_on must be one of 'prompt', 'position'")
+    if output_prefix is None:
+        output_prefix = get_batch_output_prefix(file_prefix, bucket_name)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    results_path = directory / file_name
+    checkpoint_path = directory / (file_name + BATCH_RESULTS_CHECKPOINT_SUFFIX)
+    checkpoint = _read_checkpoint(checkpoint_path)
+    shards = [s for s in list_blob_names(output_prefix + "/", bucket_name) if s not in checkpoint['completed']]
+    if join_on == 'position':
+        metadata = read_json_lines_from_gcs(
+            f"{file_prefix}/{SUMMARIZATION_METADATA_FILE_NAME}", bucket_name)
+        metadata = itertools.islice(metadata, checkpoint['rows'], None)
+    else:
+        by_prompt = _metadata_by_prompt(file_prefix, bucket_name)
+
+    def complete(results_f: TextIO, shard: str, rows: int):
+        results_f.flush()
+        os.fsync(results_f.fileno())
+        checkpoint['completed'].append(shard)
+        checkpoint['rows'] = rows
+        _write_checkpoint(checkpoint_path, checkpoint)
+
+    rows = checkpoint['rows']
+    current_shard = None
+    _truncate_lines(results_path, rows)
+    with open(results_path, 'a') as results_f:
+        for shard, batch in read_json_line_batches_from_gcs(
+                shards, bucket_name, workers=workers, with_blob_names=True):
+            if current_shard is not None and shard != current_shard:
+                complete(results_f, current_shard, rows)
+            current_shard = shard
+            for result in batch:
+                if join_on == 'position':
+                    record = dict(next(metadata))
+                else:
+                    match = _take_match(
+                        by_prompt, checkpoint['consumed'], result.get('instance', {}).get('prompt', ""))
+                    if match is None:
+                        checkpoint['unmatched'] += 1
+                        continue
+                    record = dict(match)
+                record['summary'] = get_prediction_content(result)
+                results_f.write(json.dumps(record) + "\n")
+                rows += 1
+        if current_shard is not None:
+            complete(results_f, current_shard, rows)
+    if checkpoint['unmatched'] > 0:
+        warnings.warn(f"{checkpoint['unmatched']} results matched no prompt in {file_prefix} and were left out")
+    return pd.read_json(results_path, lines=True)
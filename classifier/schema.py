@@ -1,65 +1,298 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/00_schema.ipynb.
 
 # %% auto 0
-__all__ = ['PROJECT_ID', 'PROJECT_BUCKET', 'REGION', 'WRITE_PREFIX', 'DEFAULT_PREDICT_PARAMS', 'ONE_MINUTE', 'get_embedder',
-           'seconds_to_next_minute', 'batch_embed_documents', 'quota_handler', 'get_storage_client', 'init_vertexai',
-           'get_model', 'predict', 'batch_predict']
+__all__ = ['PROJECT_ID', 'PROJECT_BUCKET', 'REGION', 'TEXT_MODEL_NAME', 'EMBEDDING_MODEL_NAME', 'ONE_MINUTE', 'CHARS_PER_TOKEN',
+           'DEFAULT_RATE_LIMITS', 'CLIENTS', 'EMBEDDING_BATCH_SIZE', 'WRITE_PREFIX', 'DEFAULT_PREDICT_PARAMS',
+           'DEFAULT_MAX_RETRIES', 'TokenBucket', 'RateLimiter', 'get_rate_limiter', 'configure_rate_limit',
+           'backoff_delay', 'ClientRegistry', 'get_embedder', 'get_llm', 'seconds_to_next_minute',
+           'batch_embed_documents', 'quota_handler', 'init_vertexai', 'get_storage_client', 'get_model',
+           'warm_up_clients', 'predict', 'batch_predict']
 
 # %% ../nbs/00_schema.ipynb 3
 import os
-from typing import Dict, Callable, List
-from ratelimit import limits, sleep_and_retry
+from typing import Any, Dict, Callable, List, Union
+import math
+import random
+import threading
 import time
 from datetime import datetime
-from functools import wraps
+from functools import wraps, partial
+from contextlib import contextmanager
 
 import vertexai as vai
-from vertexai.language_models import TextGenerationModel
+from vertexai.language_models import TextGenerationModel, TextGenerationResponse
 from vertexai.language_models._language_models import MultiCandidateTextGenerationResponse
 from google.cloud.aiplatform import BatchPredictionJob
 from google.cloud import storage
 from google.api_core.exceptions import ResourceExhausted
 
 from langchain.llms import VertexAI
+from langchain.globals import get_llm_cache
+from langchain.schema import Generation
 from langchain.embeddings import VertexAIEmbeddings
 
+from .telemetry import CALL_METRICS
+
 # GRPC requires this
 os.environ["GRPC_DNS_RESOLVER"] = "native"
 
 PROJECT_ID = "cdejam-gbsrc-ext-cah"
 PROJECT_BUCKET = "pharma_email_classification"
 REGION = "us-central1"
+TEXT_MODEL_NAME = "text-bison"
+EMBEDDING_MODEL_NAME = "textembedding-gecko"
 
 # %% ../nbs/00_schema.ipynb 5
-def get_embedder() -> VertexAIEmbeddings:
+ONE_MINUTE = 60
+# Roughly how many characters make a token for our english emails
+CHARS_PER_TOKEN = 4
+DEFAULT_RATE_LIMITS = {
+    TEXT_MODEL_NAME: {'requests_per_minute': 50, 'tokens_per_minute': None},
+    EMBEDDING_MODEL_NAME: {'requests_per_minute': 600, 'tokens_per_minute': None},
+}
+
+
+class TokenBucket:
+    "Refills at `rate` per second up to `capacity`. Taking more than is available reserves future capacity."
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float, now: float) -> float:
+        "Take `amount` and return how many seconds to wait before using it."
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+class RateLimiter:
+    "Thread-safe requests and tokens per minute limits, which back off when the API says we're over quota."
+    def __init__(
+            self,
+            requests_per_minute: float,
+            tokens_per_minute: float = None,
+            burst_seconds: float = 10,
+            min_requests_per_minute: float = 1):
+        self._lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self.min_requests_per_minute = min_requests_per_minute
+        self.throttled_count = 0
+        self.seconds_waited = 0.0
+        self.request_bucket = None
+        self.token_bucket = None
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(
+            self,
+            requests_per_minute: float = None,
+            tokens_per_minute: float = None) -> None:
+        "Change the limits, e.g. when our quota is raised. Takes effect for the next call."
+        with self._lock:
+            if requests_per_minute is not None:
+                self.max_requests_per_minute = requests_per_minute
+                self.request_bucket = self._make_bucket(requests_per_minute, self.request_bucket)
+            if tokens_per_minute is not None:
+                self.token_bucket = self._make_bucket(tokens_per_minute, self.token_bucket)
+
+    def _make_bucket(self, per_minute: float, bucket: TokenBucket = None) -> TokenBucket:
+        rate = per_minute / ONE_MINUTE
+        capacity = max(1.0, rate * self.burst_seconds)
+        if bucket is None:
+            return TokenBucket(rate, capacity)
+        bucket.refill(time.monotonic())
+        bucket.rate, bucket.capacity = rate, capacity
+        bucket.level = min(bucket.level, capacity)
+        return bucket
+
+    @property
+    def requests_per_minute(self) -> float:
+        return self.request_bucket.rate * ONE_MINUTE
+
+    def _set_requests_per_minute(self, requests_per_minute: float) -> None:
+        self.request_bucket.rate = requests_per_minute / ONE_MINUTE
+        self.request_bucket.capacity = max(1.0, self.request_bucket.rate * self.burst_seconds)
+
+    def acquire(self, requests: int = 1, tokens: int = 0) -> float:
+        "Block until `requests` and `tokens` fit in the limits. Returns the seconds slept."
+        with self._lock:
+            now = time.monotonic()
+            wait = self.request_bucket.take(requests, now)
+            if self.token_bucket is not None and tokens > 0:
+                wait = max(wait, self.token_bucket.take(tokens, now))
+            self.seconds_waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def succeeded(self) -> None:
+        with self._lock:
+            if self.requests_per_minute < self.max_requests_per_minute:
+                self._set_requests_per_minute(
+                    min(self.max_requests_per_minute, self.requests_per_minute + 1))
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.throttled_count += 1
+            self._set_requests_per_minute(
+                max(self.min_requests_per_minute, self.requests_per_minute / 2))
+
+
+_RATE_LIMITERS: Dict[str, RateLimiter] = {}
+_RATE_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(model_name: str = TEXT_MODEL_NAME) -> RateLimiter:
+    with _RATE_LIMITERS_LOCK:
+        if model_name not in _RATE_LIMITERS:
+            limits = DEFAULT_RATE_LIMITS.get(model_name, DEFAULT_RATE_LIMITS[TEXT_MODEL_NAME])
+            _RATE_LIMITERS[model_name] = RateLimiter(**limits)
+        return _RATE_LIMITERS[model_name]
+
+
+def configure_rate_limit(
+        model_name: str = TEXT_MODEL_NAME,
+        requests_per_minute: float = None,
+        tokens_per_minute: float = None) -> RateLimiter:
+    limiter = get_rate_limiter(model_name)
+    limiter.configure(requests_per_minute, tokens_per_minute)
+    return limiter
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = ONE_MINUTE) -> float:
+    "Exponential backoff with full jitter, so threads throttled together don't retry together."
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# %% ../nbs/00_schema.ipynb 10
+_MISSING = object()
+
+
+class ClientRegistry:
+    "Thread-safe, lazily created, process-wide clients."
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._clients: Dict[str, Any] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._clients.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            if name not in self._clients:
+                if name not in self._factories:
+                    raise KeyError(f"No client registered as '{name}'")
+                self._clients[name] = self._factories[name]()
+            return self._clients[name]
+
+    def set(self, name: str, client: Any) -> None:
+        with self._lock:
+            self._clients[name] = client
+
+    @contextmanager
+    def override(self, name: str, client: Any):
+        "Use `client` for `name` inside the `with` block."
+        with self._lock:
+            previous = self._clients.get(name, _MISSING)
+            self._clients[name] = client
+        try:
+            yield client
+        finally:
+            with self._lock:
+                if previous is _MISSING:
+                    self._clients.pop(name, None)
+                else:
+                    self._clients[name] = previous
+
+    def warm(self, *names: str) -> None:
+        "Create clients ahead of time, all registered clients if no names are given."
+        for name in names or list(self._factories):
+            self.get(name)
+
+    def reset(self, name: str = None) -> None:
+        with self._lock:
+            if name is None:
+                self._clients.clear()
+            else:
+                self._clients.pop(name, None)
+
+
+CLIENTS = ClientRegistry()
+
+# %% ../nbs/00_schema.ipynb 13
+def _make_embedder() -> VertexAIEmbeddings:
     return VertexAIEmbeddings(
         project=PROJECT_ID,
         location=REGION,
-        model_name='textembedding-gecko'
+        model_name=EMBEDDING_MODEL_NAME
     )
 
-# %% ../nbs/00_schema.ipynb 6
+
+def _make_llm() -> VertexAI:
+    return VertexAI()
+
+
+CLIENTS.register('embedder', _make_embedder)
+CLIENTS.register('llm', _make_llm)
+
+
+def get_embedder() -> VertexAIEmbeddings:
+    return CLIENTS.get('embedder')
+
+
+def get_llm() -> VertexAI:
+    return CLIENTS.get('llm')
+
+# %% ../nbs/00_schema.ipynb 14
 def seconds_to_next_minute() -> int:
     sleep_time = 60 - datetime.utcnow().second
     return sleep_time
 
 
+# Vertex AI embeds at most 5 texts per request
+EMBEDDING_BATCH_SIZE = 5
+
+
 def batch_embed_documents(
         embedder: VertexAIEmbeddings, 
         texts: List[str], 
         retries: int = 5) -> List[str]:
+    # Embedders that limit their own requests, like `cache.CachedEmbeddings`, only call the API for some texts
+    if getattr(embedder, 'limits_requests', False):
+        return embedder.embed_documents(texts)
+    limiter = get_rate_limiter(EMBEDDING_MODEL_NAME)
+    requests = max(1, int(math.ceil(len(texts) / EMBEDDING_BATCH_SIZE)))
+    sizes = {'input_items': len(texts), 'input_chars': _count_text(texts)}
     retry_counter = 0
     while True:
+        CALL_METRICS.record_sleep('embed', limiter.acquire(requests))
+        start = time.perf_counter()
         try:
             embeddings = embedder.embed_documents(texts)
+            CALL_METRICS.record_call('embed', time.perf_counter() - start, output_items=len(embeddings), **sizes)
+            limiter.succeeded()
             return embeddings
         except Exception as e:
-            time.sleep(seconds_to_next_minute())
-        retry_counter += 1
-        if retry_counter >= retries:
-            raise e
+            throttled = isinstance(e, ResourceExhausted)
+            CALL_METRICS.record_call(
+                'embed', time.perf_counter() - start, 'throttled' if throttled else 'error', **sizes)
+            if throttled:
+                limiter.throttled()
+            retry_counter += 1
+            if retry_counter >= retries:
+                raise e
+            delay = backoff_delay(retry_counter)
+            CALL_METRICS.record_retry('embed', delay)
+            time.sleep(delay)
 
-# %% ../nbs/00_schema.ipynb 8
+# %% ../nbs/00_schema.ipynb 16
 WRITE_PREFIX = "JDB_experiments"
 
 DEFAULT_PREDICT_PARAMS = {
@@ -69,28 +302,85 @@ DEFAULT_PREDICT_PARAMS = {
 }
 
 _VERTEX_INITIATED = False
-ONE_MINUTE = 60
+DEFAULT_MAX_RETRIES = 8
+
+
+def _count_text(obj: Any) -> int:
+    "Characters of text in call arguments or results; strings, documents, responses and containers of them."
+    if isinstance(obj, str):
+        return len(obj)
+    if hasattr(obj, 'page_content'):
+        return len(obj.page_content)
+    if isinstance(getattr(obj, 'text', None), str):
+        return len(obj.text)
+    if isinstance(obj, dict):
+        return sum(_count_text(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_count_text(v) for v in obj)
+    return 0
+
+
+def _count_requests(args: tuple, kwargs: dict) -> int:
+    "Batch calls send one request per item of their first list argument."
+    for arg in list(args) + list(kwargs.values()):
+        if isinstance(arg, list):
+            return max(1, len(arg))
+    return 1
 
 
-def quota_handler(func: Callable):
+def quota_handler(
+        func: Callable = None,
+        model_name: str = TEXT_MODEL_NAME,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        stage: str = None):
+    """
+    Handles GCP ResourceExhausted exceptions.
+    Waits on the model's shared rate limiter before every call, 
+    and retries with jittered exponential backoff when we're throttled anyway.
+    Every attempt is recorded in `CALL_METRICS` under `stage`, the function's name by default.
+    Use as `@quota_handler` or `@quota_handler(model_name=..., max_retries=..., stage=...)`.
+    """
+    if func is None:
+        return partial(quota_handler, model_name=model_name, max_retries=max_retries, stage=stage)
+    stage = func.__name__.strip('_') if stage is None else stage
+
     @wraps(func)
     def handle_quota(*args, **kwargs):
-        """Handles GCP ResourceExhausted exceptions. 
-        Will sleep the thread until the next minute before trying again."""
-        try:
-            return func(*args, **kwargs)
-        except ResourceExhausted:
-            while True:
-                try:
-                    return func(*args, **kwargs)
-                except ResourceExhausted:
-                    # Sleep until the next minute
-                    sleep_time = 60 - datetime.utcnow().second
-                    time.sleep(sleep_time)
+        limiter = get_rate_limiter(model_name)
+        requests = _count_requests(args, kwargs)
+        chars = _count_text((args, kwargs))
+        tokens = int(math.ceil(chars / CHARS_PER_TOKEN))
+        sizes = {'input_items': requests, 'input_chars': chars, 'input_tokens': tokens}
+        attempt = 0
+        while True:
+            CALL_METRICS.record_sleep(stage, limiter.acquire(requests, tokens))
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except ResourceExhausted:
+                CALL_METRICS.record_call(stage, time.perf_counter() - start, 'throttled', **sizes)
+                limiter.throttled()
+                if attempt >= max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                CALL_METRICS.record_retry(stage, delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                CALL_METRICS.record_call(stage, time.perf_counter() - start, 'error', **sizes)
+                raise
+            CALL_METRICS.record_call(
+                stage, time.perf_counter() - start,
+                output_items=len(result) if isinstance(result, list) else 1,
+                output_chars=_count_text(result),
+                **sizes)
+            limiter.succeeded()
+            return result
     return handle_quota
 
 
-def get_storage_client() -> storage.Client:
+def _make_storage_client() -> storage.Client:
     return storage.Client(project=PROJECT_ID)
 
 
@@ -103,16 +393,32 @@ def init_vertexai(
         _VERTEX_INITIATED = True
 
 
-def get_model() -> TextGenerationModel:
+def _make_model() -> TextGenerationModel:
     init_vertexai()
-    return TextGenerationModel.from_pretrained("text-bison")
+    return TextGenerationModel.from_pretrained(TEXT_MODEL_NAME)
 
 
-@sleep_and_retry
-@limits(calls=50, period=ONE_MINUTE)
-def predict(
+CLIENTS.register('storage', _make_storage_client)
+CLIENTS.register('model', _make_model)
+
+
+def get_storage_client() -> storage.Client:
+    return CLIENTS.get('storage')
+
+
+def get_model() -> TextGenerationModel:
+    return CLIENTS.get('model')
+
+
+def warm_up_clients(*names: str) -> None:
+    "Create the model, LLM, embedder and storage clients before they're needed."
+    CLIENTS.warm(*names)
+
+
+@quota_handler
+def _predict(
         prompt: str,
-        parameters: Dict[str, str] = DEFAULT_PREDICT_PARAMS
+        parameters: Dict[str, str]
         ) -> MultiCandidateTextGenerationResponse:
     model = get_model()
     return model.predict(
@@ -120,22 +426,40 @@ def predict(
         **parameters)
 
 
+def predict(
+        prompt: str,
+        parameters: Dict[str, str] = DEFAULT_PREDICT_PARAMS
+        ) -> MultiCandidateTextGenerationResponse:
+    "Predict with the text model, answering from LangChain's LLM cache when it has this prompt and parameters."
+    cache = get_llm_cache()
+    llm_string = f"{TEXT_MODEL_NAME}:{sorted(parameters.items())}"
+    cached = None if cache is None else cache.lookup(prompt, llm_string)
+    if cached is not None:
+        candidate = TextGenerationResponse(text=cached[0].text, _prediction_response=None)
+        return MultiCandidateTextGenerationResponse(
+            text=candidate.text, _prediction_response=None, candidates=[candidate])
+    response = _predict(prompt, parameters)
+    if cache is not None:
+        cache.update(prompt, llm_string, [Generation(text=response.text)])
+    return response
+
+
 def batch_predict(
-        source_uri: str,
+        source_uri: Union[str, List[str]],
         destination_uri_prefix: str,
         model_parameters: Dict[str, str] = DEFAULT_PREDICT_PARAMS
 ) -> BatchPredictionJob:
     """
     Make a batch prediction request to text-bison.
 
-    :param source_uri: Source file in GCS with prompted requests, 
+    :param source_uri: Source file(s) in GCS with prompted requests, 
         I.E. 'gs://BUCKET_NAME/test_table.jsonl'
     :param destination_uri_prefix: Where the results will be written, 
         ex: 'gs://BUCKET_NAME/tmp/2023-05-25-vertex-LLM-Batch-Prediction/result3'
     """
     model = get_model()
     batch_prediction_job = model.batch_predict(
-        source_uri=[source_uri],
+        dataset=source_uri,
         destination_uri_prefix=destination_uri_prefix,
         # Optional:
         model_parameters=model_parameters
@@ -0,0 +1,191 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/14_telemetry.ipynb.
+
+# %% auto 0
+__all__ = ['LATENCY_BUCKETS', 'CALL_OUTCOMES', 'SLEEP_REASONS', 'SIZE_FIELDS', 'METRIC_PREFIX', 'CALL_METRICS_JSON_FILE_NAME',
+           'CALL_METRICS_PROMETHEUS_FILE_NAME', 'CALL_METRICS', 'StageMetrics', 'CallMetrics', 'write_call_metrics']
+
+# %% ../nbs/14_telemetry.ipynb 2
+from typing import Any, Dict, List, Sequence
+from pathlib import Path
+import bisect
+import json
+import threading
+import time
+
+# %% ../nbs/14_telemetry.ipynb 4
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+CALL_OUTCOMES = ('ok', 'throttled', 'error')
+SLEEP_REASONS = ('rate_limit', 'backoff')
+SIZE_FIELDS = ('input_items', 'input_chars', 'input_tokens', 'output_items', 'output_chars')
+METRIC_PREFIX = "classifier_model"
+CALL_METRICS_JSON_FILE_NAME = "model_calls.json"
+CALL_METRICS_PROMETHEUS_FILE_NAME = "model_calls.prom"
+
+
+class StageMetrics:
+    "Counts, sizes and a latency histogram of one stage's model calls."
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket and a last one for slower calls
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.latency_seconds = 0.0
+        self.calls = dict.fromkeys(CALL_OUTCOMES, 0)
+        self.retries = 0
+        self.sleep_seconds = dict.fromkeys(SLEEP_REASONS, 0.0)
+        self.sizes = dict.fromkeys(SIZE_FIELDS, 0)
+
+    def observe(self, latency: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, latency)] += 1
+        self.latency_seconds += latency
+
+    def quantile(self, q: float) -> float:
+        "Latency quantile, interpolated within its histogram bucket."
+        total = sum(self.bucket_counts)
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(self.bucket_counts):
+            if count > 0 and seen + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = 0.0 if i == 0 else self.buckets[i - 1]
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, Any]:
+        attempts = sum(self.calls.values())
+        return {
+            'calls': dict(self.calls),
+            'retries': self.retries,
+            'latency_seconds': {
+                'total': self.latency_seconds,
+                'mean': self.latency_seconds / attempts if attempts > 0 else None,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+            },
+            'latency_histogram': dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.bucket_counts)),
+            'sleep_seconds': dict(self.sleep_seconds),
+            **self.sizes,
+        }
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CallMetrics:
+    "Thread-safe model call metrics, by stage."
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages: Dict[str, StageMetrics] = {}
+            self.started = time.time()
+
+    def _stage(self, stage: str) -> StageMetrics:
+        if stage not in self.stages:
+            self.stages[stage] = StageMetrics(self.buckets)
+        return self.stages[stage]
+
+    def record_call(
+            self,
+            stage: str,
+            latency: float,
+            outcome: str = 'ok',
+            **sizes: int) -> None:
+        "One attempt at a model call, with any of `SIZE_FIELDS`."
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.observe(latency)
+            metrics.calls[outcome] += 1
+            for field, size in sizes.items():
+                metrics.sizes[field] += size
+
+    def record_sleep(self, stage: str, seconds: float, reason: str = 'rate_limit') -> None:
+        if seconds > 0:
+            with self._lock:
+                self._stage(stage).sleep_seconds[reason] += seconds
+
+    def record_retry(self, stage: str, backoff_seconds: float = 0.0) -> None:
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics.retries += 1
+            metrics.sleep_seconds['backoff'] += backoff_seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Every stage's metrics, plus totals. Stages run concurrently,
+        so their seconds can add up to more than `elapsed_seconds`.
+        """
+        with self._lock:
+            stages = {name: m.summary() for name, m in sorted(self.stages.items())}
+        return {
+            'started': self.started,
+            'elapsed_seconds': time.time() - self.started,
+            'model_seconds': sum(s['latency_seconds']['total'] for s in stages.values()),
+            'sleep_seconds': sum(sum(s['sleep_seconds'].values()) for s in stages.values()),
+            'stages': stages,
+        }
+
+    def to_prometheus(self) -> str:
+        "A snapshot in Prometheus' text exposition format."
+        with self._lock:
+            stages = sorted((name, m.summary(), list(m.bucket_counts)) for name, m in self.stages.items())
+        name = f"{METRIC_PREFIX}_call_latency_seconds"
+        lines = [
+            f"# HELP {name} Latency of model call attempts.",
+            f"# TYPE {name} histogram"]
+        for stage, summary, counts in stages:
+            cumulative = 0
+            for bound, count in zip([str(b) for b in self.buckets] + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{_label(stage)}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{stage="{_label(stage)}"}} {summary["latency_seconds"]["total"]}')
+            lines.append(f'{name}_count{{stage="{_label(stage)}"}} {cumulative}')
+
+        def counter(metric: str, help: str, values: List[tuple]) -> None:
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} counter")
+            for labels, value in values:
+                label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+                lines.append(f"{METRIC_PREFIX}_{metric}{{{label_text}}} {value}")
+
+        counter("calls_total", "Model call attempts by outcome.", [
+            ({'stage': s, 'outcome': o}, summary['calls'][o]) for s, summary, _ in stages for o in CALL_OUTCOMES])
+        counter("retries_total", "Retries after a throttled or failed attempt.", [
+            ({'stage': s}, summary['retries']) for s, summary, _ in stages])
+        counter("sleep_seconds_total", "Seconds slept before calls, on the rate limiter or backing off.", [
+            ({'stage': s, 'reason': r}, summary['sleep_seconds'][r]) for s, summary, _ in stages for r in SLEEP_REASONS])
+        for field in SIZE_FIELDS:
+            counter(f"{field}_total", f"Total {field.replace('_', ' ')} of model call attempts.", [
+                ({'stage': s}, summary[field]) for s, summary, _ in stages])
+        return "\n".join(lines) + "\n"
+
+
+CALL_METRICS = CallMetrics()
+
+
+def _write_atomically(path: Path, text: str) -> None:
+    temporary_path = path.with_suffix(path.suffix + ".tmp")
+    temporary_path.write_text(text)
+    temporary_path.replace(path)
+
+
+def write_call_metrics(
+        directory: Path,
+        metrics: CallMetrics = None) -> None:
+    """
+    Write the JSON summary and the Prometheus snapshot to `directory`.
+    Files are replaced whole, so a Prometheus textfile collector never reads half of one.
+    """
+    metrics = CALL_METRICS if metrics is None else metrics
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_atomically(directory / CALL_METRICS_JSON_FILE_NAME, json.dumps(metrics.summary(), indent=2))
+    _write_atomically(directory / CALL_METRICS_PROMETHEUS_FILE_NAME, metrics.to_prometheus())
@@ -0,0 +1,157 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../nbs/11_tokens.ipynb.
+
+# %% auto 0
+__all__ = ['LONG_WORD_CHARS', 'TOKEN_FEATURES', 'DEFAULT_TOKEN_COEFFICIENTS', 'TOKEN_COUNT_CACHE_SIZE', 'TOKEN_COUNTER_FILE_NAME',
+           'TOKEN_ESTIMATE_MARGIN', 'UNCALIBRATED_TOKEN_ESTIMATE_MARGIN', 'token_features', 'TokenCounter',
+           'get_token_counter', 'count_tokens', 'get_token_budget', 'count_tokens_remote', 'calibrate_token_counter']
+
+# %% ../nbs/11_tokens.ipynb 2
+from typing import List
+from pathlib import Path
+from functools import lru_cache
+import json
+import math
+import re
+
+import numpy as np
+
+from .schema import CLIENTS, CHARS_PER_TOKEN, get_model, quota_handler
+from .cache import CACHE_DIR
+
+# %% ../nbs/11_tokens.ipynb 4
+_WORDS = re.compile(r"[^\W\d_]+")
+_DIGITS = re.compile(r"\d")
+_SYMBOLS = re.compile(r"[^\w\s]|_")
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+# Words longer than this are usually split into more than one token
+LONG_WORD_CHARS = 7
+TOKEN_FEATURES = ['words', 'long_word_chars', 'digits', 'symbols', 'newlines', 'non_ascii', 'bias']
+DEFAULT_TOKEN_COEFFICIENTS = [1.0, 0.2, 1.0, 0.9, 1.0, 0.5, 0.0]
+TOKEN_COUNT_CACHE_SIZE = 2 ** 16
+TOKEN_COUNTER_FILE_NAME = "token_counter.json"
+# How far off a calibrated estimate can be, to leave room for in budgets
+TOKEN_ESTIMATE_MARGIN = 0.03
+# Room to leave when the default coefficients haven't been checked against the model
+UNCALIBRATED_TOKEN_ESTIMATE_MARGIN = 0.25
+
+
+def token_features(text: str) -> np.ndarray:
+    words = _WORDS.findall(text)
+    return np.array([
+        len(words),
+        sum(len(w) - LONG_WORD_CHARS for w in words if len(w) > LONG_WORD_CHARS),
+        len(_DIGITS.findall(text)),
+        len(_SYMBOLS.findall(text)),
+        text.count("\n"),
+        len(_NON_ASCII.findall(text)),
+        1.0], dtype=np.float64)
+
+
+class TokenCounter:
+    "Estimates the number of tokens in a text from counts of its words, digits and symbols."
+    def __init__(
+            self,
+            coefficients: List[float] = None,
+            cache_size: int = TOKEN_COUNT_CACHE_SIZE):
+        "Without `coefficients`, the counter uses the defaults and is uncalibrated."
+        self.calibrated = coefficients is not None
+        self.coefficients = np.asarray(
+            DEFAULT_TOKEN_COEFFICIENTS if coefficients is None else coefficients, dtype=np.float64)
+        self._count = lru_cache(maxsize=cache_size)(self._estimate)
+
+    def _estimate(self, text: str) -> int:
+        if len(text) == 0:
+            return 0
+        estimate = token_features(text) @ self.coefficients
+        if not self.calibrated:
+            estimate = max(estimate, len(text) / CHARS_PER_TOKEN)
+        return max(1, int(math.ceil(estimate)))
+
+    @property
+    def margin(self) -> float:
+        return TOKEN_ESTIMATE_MARGIN if self.calibrated else UNCALIBRATED_TOKEN_ESTIMATE_MARGIN
+
+    def budget(self, limit: int) -> int:
+        "How many estimated tokens can safely be used under a `limit` of real ones."
+        return int(limit * (1 - self.margin))
+
+    def count(self, text: str) -> int:
+        return self._count(text)
+
+    def __call__(self, text: str) -> int:
+        return self._count(text)
+
+    def calibrate(self, texts: List[str], counts: List[int]) -> float:
+        """
+        Fit the coefficients to exact token counts, minimizing the relative error.
+        Returns the mean absolute relative error of the fitted estimates.
+        """
+        features = np.stack([token_features(t) for t in texts])
+        counts = np.asarray(counts, dtype=np.float64)
+        weights = 1 / np.maximum(counts, 1)
+        self.coefficients, *_ = np.linalg.lstsq(features * weights[:, None], counts * weights, rcond=None)
+        self.calibrated = True
+        self._count.cache_clear()
+        return float(np.mean(np.abs(features @ self.coefficients - counts) * weights))
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({
+            'features': TOKEN_FEATURES,
+            'coefficients': self.coefficients.tolist()}))
+
+    @classmethod
+    def load(cls, path: Path) -> 'TokenCounter':
+        "The counter saved at `path`, or an uncalibrated one if there isn't one."
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        saved = json.loads(path.read_text())
+        if saved.get('features') != TOKEN_FEATURES:
+            return cls()
+        return cls(saved['coefficients'])
+
+# %% ../nbs/11_tokens.ipynb 6
+def _make_token_counter() -> TokenCounter:
+    return TokenCounter.load(CACHE_DIR / TOKEN_COUNTER_FILE_NAME)
+
+
+CLIENTS.register('token_counter', _make_token_counter)
+
+
+def get_token_counter() -> TokenCounter:
+    return CLIENTS.get('token_counter')
+
+
+def count_tokens(text: str) -> int:
+    "Estimated number of tokens in `text`."
+    return get_token_counter().count(text)
+
+
+def get_token_budget(limit: int) -> int:
+    "`TokenCounter.budget` of the shared counter."
+    return get_token_counter().budget(limit)
+
+
+@quota_handler
+def _count_tokens_remote(text: str) -> int:
+    return get_model().count_tokens([text]).total_tokens
+
+
+def count_tokens_remote(texts: List[str]) -> List[int]:
+    "Exact token counts from the model, one request per text."
+    return [_count_tokens_remote(t) for t in texts]
+
+
+def calibrate_token_counter(
+        texts: List[str],
+        path: Path = CACHE_DIR / TOKEN_COUNTER_FILE_NAME) -> float:
+    """
+    Fit the shared counter to exact counts for a sample of our texts, and save it for later runs.
+    Returns the mean absolute relative error on the sample.
+    """
+    counter = get_token_counter()
+    error = counter.calibrate(texts, count_tokens_remote(texts))
+    counter.save(path)
+    return error